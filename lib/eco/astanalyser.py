@@ -21,6 +21,8 @@
 
 from grammar_parser.bootstrap import AstNode, ListNode
 from grammar_parser.gparser import MagicTerminal
+from incparser.astree import Node
+import copy
 
 class URI(object):
     def __init__(self):
@@ -53,6 +55,38 @@ class Reference(object):
     def __repr__(self):
         return "Ref(%s/%s)" % (self.kind, self.name)
 
+def path_key(path):
+    """Returns a hashable key for a path. Like `AstAnalyser.paths_eq`, only
+    the kinds and names of the path's elements are compared."""
+    return tuple([(p.kind, p.name) for p in path])
+
+class SymbolTable(object):
+    """Hashed indexes over the URIs found by an `AstAnalyser`, so that names
+    can be resolved without scanning the URIs of every kind."""
+
+    def __init__(self, data):
+        self.names = {}     # (kind, path, name) -> first URI defining name
+        self.paths = {}     # path -> URIs within that path
+        self.nodes = {}     # id(node) -> first URI of node
+        self.astnodes = set() # (kind, id(astnode))
+        for kind in data:
+            for uri in data[kind]:
+                key = path_key(uri.path)
+                self.names.setdefault((kind, key, uri.name), uri)
+                if kind not in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
+                    self.paths.setdefault(key, []).append(uri)
+                self.nodes.setdefault(id(uri.node), uri)
+                self.astnodes.add((kind, id(uri.astnode)))
+
+def reference_names(uri):
+    """Returns the names a reference's resolution depends on: its own name and
+    the names of the URIs it is an alias of."""
+    names = set([uri.name])
+    for p in uri.path:
+        if isinstance(p, URI):
+            names.update(reference_names(p))
+    return names
+
 class AstAnalyser(object):
     def __init__(self, filename):
         self.errors = {}
@@ -62,6 +96,16 @@ class AstAnalyser(object):
 
         self.data = {}
         self.index = 0
+        self.symbols = None
+
+        # Results of previous scans, used to rescan only the AST nodes that
+        # the parser has rebuilt since: (id(astnode), scope) -> (astnode,
+        # URIs found within astnode, URI returned by scan)
+        self.cache = {}
+        self.cache_limit = 0
+        self.appended = []  # URIs in the order they were added by this scan
+        self.merges = 0     # language boxes merged by this scan
+        self.ref_errors = {} # id(reference) -> [(node, error)]
 
         rootnode = self.load_nb_file(filename)
         r = RuleReader()
@@ -71,6 +115,13 @@ class AstAnalyser(object):
 
         self.processed_nodes = set()
 
+        # The version of the parse tree that is analysed (see
+        # `Node.saved_state`), or None for the current tree
+        self.version = None
+        # If set, maps the ids of the roots of language boxes to the changes
+        # their parsers made, instead of taking those from the parsers
+        self.changes = None
+
     def load_nb_file(self, filename):
         from jsonmanager import JsonManager
         from grammars.grammars import lang_dict
@@ -127,8 +178,12 @@ class AstAnalyser(object):
         if node is None:
             return
 
-        if hasattr(node, 'alternate') and node.alternate:
-            node = node.alternate
+        children = None
+        if isinstance(node, Node):
+            children, _, _, _, _, _, alternate = node.saved_state(self.version)
+            if alternate:
+                node = alternate
+                children = None
 
         from grammar_parser.bootstrap import AstNode
 
@@ -139,6 +194,19 @@ class AstAnalyser(object):
             if id(node) in self.processed_nodes: # skip nodes that have been processed in parent
                 return
 
+            scope = (id(node), tuple([(p.kind, p.name, p.nbrule) for p in path]))
+            cached = self.cache.get(scope)
+            if cached is not None and cached[0] is node:
+                for uri in cached[1]:
+                    uri.index = self.index
+                    self.data.setdefault(uri.kind, [])
+                    self.data[uri.kind].append(uri)
+                    self.index += 1
+                self.appended.extend(cached[1])
+                return cached[2]
+            start = len(self.appended)
+            merges = self.merges
+
             base = None
             nbrule = self.get_definition(node)
             uris = []
@@ -179,12 +247,19 @@ class AstAnalyser(object):
                 uri.index = self.index
                 self.data.setdefault(uri.kind, [])
                 self.data[uri.kind].append(uri)
+                self.appended.append(uri)
                 self.index += 1
+            self.symbols = None
 
+            if merges == self.merges:
+                # language boxes may change without their parent being rebuilt
+                self.cache[scope] = (node, self.appended[start:], uri)
             return uri # only needed for base
 
         else:
-            for c in node.children:
+            if children is None:
+                children = node.children
+            for c in children:
                 self.scan(c, path)
             return
 
@@ -214,6 +289,8 @@ class AstAnalyser(object):
             uri = URI()
             if n is None:
                 uri.name = None
+            elif isinstance(n, Node):
+                uri.name = n.saved_state(self.version)[4]
             else:
                 uri.name = n.symbol.name
             uri.kind = _type
@@ -235,9 +312,14 @@ class AstAnalyser(object):
         return uris
 
     def merge_lbox_data(self, node, path):
+        self.merges += 1
         root = node.symbol.ast
         analyser = self.get_lboxanalyser(root)
-        analyser.analyse(root, self.parsers)
+        if self.changes is not None:
+            changes = self.changes.pop(id(root), None)
+        else:
+            changes = self.get_lboxparser(root).take_changes()
+        analyser.analyse(root, self.parsers, changes, self.version)
 
         for kind in analyser.data:
             if kind in ["File", "reference"]:
@@ -259,7 +341,9 @@ class AstAnalyser(object):
         return
 
     def convert_uri(self, newkind, prev, path):
-        uri = prev
+        # copy, as the language box's analyser may reuse its URIs
+        uri = copy.copy(prev)
+        uri.path = list(prev.path)
         # There is currently no easy way to find out if a namebinding rule
         # belongs to the top-level grammar rule. However, the top-level
         # namebinding rule typically doesn't have a name as there is no need for
@@ -282,18 +366,111 @@ class AstAnalyser(object):
     def add_uri(self, uri):
         self.data.setdefault(uri.kind, [])
         self.data[uri.kind].append(uri)
+        self.appended.append(uri)
         self.index += 1
-
-    def analyse(self, node, parsers=None):
-        # scan
+        self.symbols = None
+
+    def get_symbols(self):
+        if self.symbols is None:
+            self.symbols = SymbolTable(self.data)
+        return self.symbols
+
+    def analyse(self, node, parsers=None, changes=None, version=None):
+        """Finds all definitions and references below `node` and resolves
+        the references. `changes` are the ids of the AST nodes the parser has
+        rebuilt since the last analysis (see `IncParser.take_changes`). If
+        given, only those nodes are scanned again and only references whose
+        resolution may have changed are resolved again. Otherwise everything
+        is analysed from scratch. If `version` is given, the tree is analysed
+        as it was saved in that version."""
         self.errors = {}
         self.parsers = parsers
+        self.version = version
+
+        if changes is None:
+            self.cache.clear()
+            self.ref_errors.clear()
+        else:
+            for scope in [scope for scope in self.cache if scope[0] in changes]:
+                del self.cache[scope]
+        # keeps the previous URIs alive, so their ids can't be reused
+        previous = self.appended
 
         self.data.clear()
+        self.symbols = None
         self.processed_nodes.clear()
         self.index = 0
+        self.appended = []
+        self.merges = 0
         self.scan(node, [])
-        self.analyse_refs()
+
+        if changes is None:
+            self.cache_limit = 2 * len(self.cache) + 100
+            self.analyse_refs()
+            return
+
+        # Only references that are new, or that refer to a name that was
+        # defined or undefined, can resolve differently
+        now = set([id(uri) for uri in self.appended])
+        before = set([id(uri) for uri in previous])
+        names = set()
+        for uri in previous:
+            if id(uri) not in now and uri.kind != "reference":
+                names.add(uri.name)
+        for uri in self.appended:
+            if id(uri) not in before and uri.kind != "reference":
+                names.add(uri.name)
+        self.analyse_refs(lambda ref: id(ref) not in before or not names.isdisjoint(reference_names(ref)))
+        if len(self.cache) > self.cache_limit:
+            # forget nodes that are no longer part of the tree
+            self.cache.clear()
+
+    def copy(self):
+        """Returns a copy that can analyse the tree (e.g. on another thread)
+        without changing the results of this analyser. Scans change the URIs
+        they reuse from the cache, so all URIs are copied as well."""
+        uris = {}
+        def copy_uri(uri):
+            if not isinstance(uri, URI):
+                return uri
+            new = uris.get(id(uri))
+            if new is None:
+                new = uris[id(uri)] = copy.copy(uri)
+                new.path = [copy_uri(p) for p in uri.path]
+            return new
+        analyser = copy.copy(self)
+        analyser.errors = dict(self.errors)
+        analyser.data = dict((kind, [copy_uri(uri) for uri in l]) for kind, l in self.data.items())
+        analyser.symbols = None
+        analyser.appended = [copy_uri(uri) for uri in self.appended]
+        analyser.cache = dict((scope, (node, [copy_uri(uri) for uri in found], copy_uri(uri)))
+                              for scope, (node, found, uri) in self.cache.items())
+        analyser.ref_errors = dict((id(uris[key]), errors) for key, errors in self.ref_errors.items()
+                                   if key in uris)
+        analyser.processed_nodes = set()
+        return analyser
+
+    def update(self, analyser, parsers):
+        """Takes over the results of `analyser`, a copy made by `copy`.
+        `parsers` are the originals of the parsers it was given."""
+        self.__dict__.update(analyser.__dict__)
+        if getattr(analyser, "parsers", None) is not None:
+            self.parsers = parsers
+        self.version = None
+        self.changes = None
+
+    def get_outline(self):
+        """Returns the classes defined at the top level as a list of (URI,
+        outline) tuples, where outline lists the names defined within the URI
+        in the same way."""
+        outline = []
+        for uri in self.data.get("class", []):
+            if not uri.path or (uri.path and uri.path[0].name is None and len(uri.path) == 1):
+                outline.append(self.get_uri_outline(uri))
+        return outline
+
+    def get_uri_outline(self, uri):
+        return (uri, [self.get_uri_outline(n) for n in self.get_names_within_path(uri.as_path())])
 
     def get_lboxanalyser(self, root):
         if not self.parsers:
@@ -302,32 +479,49 @@ class AstAnalyser(object):
             if parser.previous_version.parent is root:
                 return analyser
 
-    def analyse_refs(self):
-        if "reference" in self.data:
-            for reference in self.data["reference"]:
+    def get_lboxparser(self, root):
+        for parser, lexer, lang, analyser, _ in self.parsers:
+            if parser.previous_version.parent is root:
+                return parser
+
+    def analyse_refs(self, changed=None):
+        ref_errors = {}
+        for reference in self.data.get("reference", []):
+            errors = None
+            if changed is not None and not changed(reference):
+                errors = self.ref_errors.get(id(reference))
+            if errors is None:
+                self.current_errors = []
                 self.find_reference(reference)
+                errors = self.current_errors
+            ref_errors[id(reference)] = errors
+            for node, error in errors:
+                self.errors[node] = error
+        self.ref_errors = ref_errors
 
     def find_reference(self, reference):
         if reference.name in self.keywords:
             return
+        names = self.get_symbols().names
+        key = path_key(reference.path)
         for refers in reference.nbrule.get_references()[0]:
 
             # global variable
-            if len(reference.path) == 0:
-                x = self.get_reference(refers, reference.path, reference.name)
+            if len(key) == 0:
+                x = names.get((refers, key, reference.name))
                 if x:
                     return x
 
             # iterate through path prefixes
-            path = list(reference.path)
-            while len(path) > 0:
-                x = self.get_reference(refers, path, reference.name)
+            for i in range(len(key), 0, -1):
+                # URIs are stored in the order they were defined in, so
+                # only the first definition needs to be checked
+                x = names.get((refers, key[:i], reference.name))
                 if x:
                     if x.nbrule.get_visibility() != "subsequent":
                         return x
                     if x.nbrule.get_visibility() == "subsequent" and x.index < reference.index:
                         return x
-                path.pop() # try with prefix of path
 
         # URI is alias (nested URIs)
         # evaluate references, then get_reference
@@ -339,18 +533,10 @@ class AstAnalyser(object):
                     if z:
                         return z
 
-        self.errors[reference.node] = "'%s' cannot be resolved to a variable." % (reference.name)
+        self.current_errors.append((reference.node, "'%s' cannot be resolved to a variable." % (reference.name)))
 
     def get_reference(self, kind, path, name):
-        if kind not in self.data:
-            return None
-        for candidate in self.data[kind]:
-            if candidate.name != name:
-                continue
-            if not self.paths_eq(candidate.path, path):
-                continue
-            return candidate
-        return None
+        return self.get_symbols().names.get((kind, path_key(path), name))
 
     def paths_eq(self, path1, path2):
         if len(path1) != len(path2):
@@ -410,42 +596,23 @@ class AstAnalyser(object):
                 # astnode must have a corresponding entry in self.data
                 if nbrule:
                     deftype = nbrule.get_deftype()
-                    if deftype in self.data:
-                        for e in self.data[deftype]:
-                            if e.astnode is astnode:
-                                return astnode
+                    if (deftype, id(astnode)) in self.get_symbols().astnodes:
+                        return astnode
             scope = scope.parent
 
     def find_uri_by_astnode(self, node):
-        for key in self.data:
-            for uri in self.data[key]:
-                if uri.node == node:
-                    return uri
-        return None
+        return self.get_symbols().nodes.get(id(node))
 
     def get_reachable_names_by_path(self, path):
         names = []
-        path = list(path)   # copy to not manipulate existing path
-        while path != []:
-            for key in self.data:
-                if key in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
-                    continue
-                for uri in self.data[key]:
-                    if uri.path == path:
-                        names.append(uri)
-            path.pop()
+        paths = self.get_symbols().paths
+        key = path_key(path)
+        for i in range(len(key), 0, -1):
+            names.extend(paths.get(key[:i], []))
         return names
 
     def get_names_within_path(self, path):
-        names = []
-        path = list(path)   # copy to not manipulate existing path
-        for key in self.data:
-            if key in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
-                continue
-            for uri in self.data[key]:
-                if uri.path == path:
-                    names.append(uri)
-        return names
+        return list(self.get_symbols().paths.get(path_key(path), []))
 
 class RuleReader(object):
     def read(self, root):
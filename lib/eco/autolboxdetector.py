@@ -369,10 +369,10 @@ class Recognizer(object):
                 continue
             elif isinstance(element, Reduce):
                 i = 0
-                while i < element.amount():
+                while i < element.length:
                    self.state.pop()
                    i += 1
-                goto = self.syntaxtable.lookup(self.state[-1], element.action.left)
+                goto = self.syntaxtable.lookup_id(self.state[-1], element.left_id)
                 assert isinstance(goto, Goto)
                 self.state.append(goto.action)
                 continue
@@ -387,7 +387,7 @@ class Recognizer(object):
             self.last_read = t[3][-1]
             self.last_token_value = t[0]
             self.last_split = t[4]
-            return Terminal(t[1])
+            return self.syntaxtable.terminal(t[1])
         except StopIteration:
             self.reached_eos = True
             return FinishSymbol() # No more tokens to read
@@ -402,31 +402,33 @@ class Recognizer(object):
         return True
 
     def is_finished(self):
-        result = self.syntaxtable.lookup(self.state[-1], FinishSymbol())
+        eos = self.syntaxtable.symbol_id(FinishSymbol())
+        result = self.syntaxtable.lookup_id(self.state[-1], eos)
         states = list(self.state)
         while isinstance(result, Reduce):
             i = 0
-            for i in range(result.amount()):
+            for i in range(result.length):
                 states.pop()
-            goto = self.syntaxtable.lookup(states[-1], result.action.left)
+            goto = self.syntaxtable.lookup_id(states[-1], result.left_id)
             states.append(goto.action)
-            result = self.syntaxtable.lookup(states[-1], FinishSymbol())
+            result = self.syntaxtable.lookup_id(states[-1], eos)
         if isinstance(result, Accept):
             return True
         return False
 
     def temp_parse(self, states, terminal):
+        terminal_id = self.syntaxtable.symbol_id(terminal)
         while True:
-            element = self.syntaxtable.lookup(states[-1], terminal)
+            element = self.syntaxtable.lookup_id(states[-1], terminal_id)
             if type(element) is Shift:
                 states.append(element.action)
                 return True
             elif type(element) is Reduce:
                 i = 0
-                while i < element.amount():
+                while i < element.length:
                    states.pop()
                    i += 1
-                goto = self.syntaxtable.lookup(states[-1], element.action.left)
+                goto = self.syntaxtable.lookup_id(states[-1], element.left_id)
                 assert isinstance(goto, Goto)
                 states.append(goto.action)
                 continue
@@ -0,0 +1,228 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Runs slow work, like writing swap files and analysing the tree, without
+blocking the editor.
+
+Jobs are run one after the other on a worker thread, while the GUI thread
+keeps changing the tree. A job therefore never reads the tree itself: it
+takes a snapshot when it is started (see `TreeManager.snapshot`) and reads
+the tree as it was saved in that version (see `Node.saved_state`), which
+later changes don't affect. Its result is handed back to the thread that
+polls the worker. If the tree has changed in the meantime the result is
+dropped, since the change has already requested a newer job."""
+
+import logging, os, queue, threading, traceback
+
+class Job(object):
+    """Work done by a `BackgroundWorker`. `start` is called on the polling
+    thread right before `run` is called on the worker thread. Afterwards
+    `finish` is called on the polling thread with the result of `run`, or
+    `drop` if the result is no longer wanted."""
+
+    def start(self):
+        pass
+
+    def run(self):
+        pass
+
+    def is_current(self):
+        return True
+
+    def finish(self, result):
+        pass
+
+    def drop(self):
+        pass
+
+class WriteJob(Job):
+    """Writes `filename` from the tree of the TreeManager `tm`, as it was
+    when the job was started. `write(path, version)` writes the tree in
+    `version` to a temporary file, which replaces `filename` once the job has
+    finished, so an interrupted write never leaves a broken file behind."""
+
+    def __init__(self, filename, tm, write):
+        self.filename = filename
+        self.tmp = filename + ".tmp"
+        self.tm = tm
+        self.write = write
+        self.snapshot = None
+
+    def start(self):
+        self.snapshot = self.tm.snapshot()
+
+    def run(self):
+        version, _ = self.snapshot
+        self.write(self.tmp, version)
+
+    def is_current(self):
+        return self.tm.is_current(self.snapshot)
+
+    def finish(self, result):
+        os.replace(self.tmp, self.filename)
+
+    def drop(self):
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+class AnalysisJob(Job):
+    """Runs the analysers of the TreeManager `tm` on the version of the tree
+    that is current when the job is started, and collects the outline of the
+    main language (see `AstAnalyser.get_outline`). The analysis works on
+    copies of the analysers, which only replace the originals once the job
+    has finished, after which `finished(outline)` is called."""
+
+    def __init__(self, tm, finished):
+        self.tm = tm
+        self.finished = finished
+        self.snapshot = None
+        self.parsers = None
+        self.copies = None
+        self.analyses = None
+        self.taken = []     # (parser, root, changes) taken from the parsers
+        self.changes = {}   # id(root) -> changes not used by the analysis yet
+
+    def start(self):
+        self.parsers = list(self.tm.parsers)
+        self.copies = [(p, l, lang, a.copy() if a else a, im) for p, l, lang, a, im in self.parsers]
+        # may parse language boxes, so the snapshot is taken afterwards
+        analyses = self.tm.get_analyses(self.copies)
+        self.snapshot = self.tm.snapshot()
+        if analyses is None:
+            return
+        self.analyses = []
+        # the parsers add to their changes on this thread, so they are taken
+        # here, also for the language boxes an analyser may reach
+        for analyser, parser, parsers in analyses:
+            self.analyses.append((analyser, parser.previous_version.parent, parsers))
+            for p in [parser] if parsers is None else [q[0] for q in parsers]:
+                root = p.previous_version.parent
+                changes = p.take_changes()
+                self.taken.append((p, root, changes))
+                self.changes[id(root)] = changes
+        for copy in self.copies:
+            if copy[3]:
+                copy[3].changes = self.changes
+
+    def run(self):
+        if self.analyses is None:
+            return None
+        version, _ = self.snapshot
+        for analyser, root, parsers in self.analyses:
+            analyser.analyse(root, parsers, self.changes.pop(id(root), None), version)
+        return self.copies[0][3].get_outline()
+
+    def is_current(self):
+        return self.tm.is_current(self.snapshot)
+
+    def finish(self, outline):
+        for p, copy in zip(self.parsers, self.copies):
+            if p[3]:
+                p[3].update(copy[3], self.parsers)
+        # language boxes that weren't reached keep their changes
+        for parser, root, changes in self.taken:
+            if id(root) in self.changes:
+                parser.restore_changes(changes)
+        if outline is not None:
+            self.finished(outline)
+
+    def drop(self):
+        for parser, root, changes in self.taken:
+            parser.restore_changes(changes)
+
+class BackgroundWorker(object):
+
+    def __init__(self):
+        self.running = {}       # key -> job handed to the worker thread
+        self.pending = {}       # key -> job waiting for the running one
+        self.discarded = set()  # running jobs whose results are dropped
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = None
+
+    def submit(self, key, job):
+        """Runs `job` on the worker thread. If the job that was submitted
+        last with the same `key` is still running, `job` is started once that
+        has finished (only the latest job is kept). Returns False if the job
+        had to wait."""
+        self.poll()
+        if key in self.running:
+            self.pending[key] = job
+            return False
+        self.start(key, job)
+        return True
+
+    def start(self, key, job):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name="BackgroundWorker")
+            self.thread.daemon = True
+            self.thread.start()
+        job.start()
+        self.running[key] = job
+        self.jobs.put((key, job))
+
+    def work(self):
+        while True:
+            key, job = self.jobs.get()
+            try:
+                self.results.put((key, job, job.run(), None))
+            except Exception:
+                self.results.put((key, job, None, traceback.format_exc()))
+
+    def poll(self):
+        """Hands back the results of finished jobs and starts waiting jobs.
+        Returns True if jobs are still running."""
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.done(*result)
+        return len(self.running) > 0
+
+    def wait(self):
+        """Blocks until all jobs have finished."""
+        while self.running:
+            self.done(*self.results.get())
+
+    def done(self, key, job, result, error):
+        del self.running[key]
+        if job in self.discarded:
+            self.discarded.remove(job)
+            job.drop()
+        elif not job.is_current():
+            job.drop()
+        elif error is not None:
+            logging.error("Job %s failed:\n%s", key, error)
+            job.drop()
+        else:
+            job.finish(result)
+        job = self.pending.pop(key, None)
+        if job:
+            self.start(key, job)
+
+    def discard(self, key):
+        """Cancels all jobs for `key`, e.g. before the file they write is
+        deleted. The result of a running job is dropped once it has
+        finished."""
+        self.pending.pop(key, None)
+        if key in self.running:
+            self.discarded.add(self.running[key])
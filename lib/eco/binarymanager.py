@@ -0,0 +1,235 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Compact binary .eco files.
+
+A binary file consists of a magic header, a number of sections, an index and
+a footer that points to the index. Each language box is stored in a section
+of its own (the main tree is section 0), so sections can be read
+independently of each other. A section is zlib compressed and contains the
+number of nodes, a table of fixed size records (one per node, in pre-order,
+see FIELDS) and a single blob that contains the text of all nodes one after
+the other (the offset of a node's text is the sum of the lengths before it).
+Node kinds (node and symbol class) and all other strings are interned into
+tables that are stored in the index, together with the offset, size and
+language of every section.
+
+When loading lazily only the main tree is built. Language boxes are built
+from their section when their tree is first accessed, which keeps opening
+and inspecting large composed documents cheap. The editor can't load lazily,
+as its lines need the text of every language box, and instead only defers
+parsing the boxes (see TreeManager.load_file).
+
+Files can be converted from and to the JSON format by running this module."""
+
+from array import array
+from optparse import OptionParser
+import json, struct, sys, zlib
+
+from grammar_parser.gparser import MagicTerminal
+from jsonmanager import JsonManager
+
+MAGIC = b"ECOBIN\x00\x01"
+FOOTER = struct.Struct("<Q")
+COUNT = struct.Struct("<I")
+# Fields of a node record
+FIELDS = ("kind", "lookup", "flags", "length", "children", "image", "section")
+NFIELDS = len(FIELDS)
+LOCAL_ERROR = 1
+NESTED_ERRORS = 2
+
+def is_binary(filename):
+    with open(filename, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+def _records(data=b""):
+    records = array("I")
+    records.frombytes(data)
+    if sys.byteorder == "big":
+        records.byteswap()
+    return records
+
+class BinaryManager(JsonManager):
+    """Reads and writes binary .eco files. Nodes are created in the same way
+    (and in the same order) as by the JsonManager, so both formats result in
+    identical trees."""
+
+    def __init__(self, lazy=False):
+        JsonManager.__init__(self)
+        self.lazy = lazy
+        self.data = None
+        self.sections = []
+
+    def save(self, root, language, whitespaces, filename, version=None):
+        kinds = {}
+        strings = {}
+        sections = []
+        todo = [(root, language, whitespaces)]
+        with open(str(filename), "wb") as fp:
+            fp.write(MAGIC)
+            offset = len(MAGIC)
+            while len(sections) < len(todo):
+                lbox_root, language, whitespaces = todo[len(sections)]
+                data = zlib.compress(self.write_section(lbox_root, kinds, strings, todo, version))
+                fp.write(data)
+                sections.append([offset, len(data), language, whitespaces])
+                offset += len(data)
+            index = {
+                "kinds": sorted(kinds, key=kinds.get),
+                "strings": sorted(strings, key=strings.get),
+                "sections": sections,
+            }
+            fp.write(json.dumps(index).encode("ascii"))
+            fp.write(FOOTER.pack(offset))
+
+    def write_section(self, root, kinds, strings, todo, version=None):
+        """Encodes the tree below `root` (as it was in `version`, if given).
+        The roots of language boxes are appended to `todo` and referenced by
+        their section number."""
+        records = _records()
+        text = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            symbol = node.symbol
+            children, nested_errors, local_error, _, name, lookup, _ = node.saved_state(version)
+            kind = (node.__class__.__name__, symbol.__class__.__name__)
+            kind = kinds.setdefault(kind, len(kinds))
+            lookup = strings.setdefault(lookup, len(strings))
+            flags = 0
+            if local_error:
+                flags |= LOCAL_ERROR
+            if nested_errors:
+                flags |= NESTED_ERRORS
+            image = 0
+            if node.image_src is not None:
+                image = strings.setdefault(node.image_src, len(strings)) + 1
+            section = 0
+            if isinstance(symbol, MagicTerminal):
+                section = len(todo)
+                todo.append((symbol.ast, name[1:-1], True))
+            text.append(name)
+            records.extend((kind, lookup, flags, len(name), len(children), image, section))
+            stack.extend(reversed(children))
+        if sys.byteorder == "big":
+            records.byteswap()
+        return COUNT.pack(len(records) // NFIELDS) + records.tobytes() + "".join(text).encode("utf-8")
+
+    def load(self, filename):
+        with open(str(filename), "rb") as fp:
+            self.data = fp.read()
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a binary Eco file" % (filename,))
+        offset, = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        index = json.loads(self.data[offset:len(self.data) - FOOTER.size].decode("ascii"))
+        self.kinds = [tuple(kind) for kind in index["kinds"]]
+        self.strings = index["strings"]
+        self.sections = index["sections"]
+
+        _, _, language, whitespaces = self.sections[0]
+        root = self.read_section(0)
+        self.language_boxes.append((root, language, whitespaces))
+        self.language_boxes.reverse()
+        if not self.lazy:
+            self.data = None
+        return self.language_boxes
+
+    def read_section(self, number):
+        """Builds the tree stored in section `number` and returns its root."""
+        offset, size = self.sections[number][:2]
+        data = zlib.decompress(self.data[offset:offset + size])
+        count, = COUNT.unpack_from(data)
+        end = COUNT.size + count * NFIELDS * 4
+        records = _records(data[COUNT.size:end])
+        text = data[end:].decode("utf-8")
+        kinds = self.kinds
+        strings = self.strings
+        pos = 0
+        stack = [] # nodes waiting for their children, with the number of missing children
+        for i in range(0, len(records), NFIELDS):
+            kind, lookup, flags, length, children, image, section = records[i:i + NFIELDS]
+            cls, symbol = kinds[kind]
+            jsnode = {
+                "class": cls,
+                "symbol": symbol,
+                "text": text[pos:pos + length],
+                "lookup": strings[lookup],
+                "local_error": bool(flags & LOCAL_ERROR),
+                "nested_errors": bool(flags & NESTED_ERRORS),
+                "image_src": strings[image - 1] if image else None,
+                "children": [],
+            }
+            pos += length
+            if section:
+                jsnode["section"] = section
+                if not self.lazy:
+                    jsnode["lbox"] = self.read_language_box(section)
+                    jsnode["language"], jsnode["whitespaces"] = self.sections[section][2:]
+            if children:
+                stack.append([jsnode, children])
+                continue
+            node = self.object_to_node(jsnode)
+            while stack:
+                parent = stack[-1]
+                parent[0]["children"].append(node)
+                parent[1] -= 1
+                if parent[1]:
+                    break
+                stack.pop()
+                node = self.object_to_node(parent[0])
+        return node
+
+    def read_language_box(self, section):
+        # Language boxes are linked separately
+        temp = self.last_terminal
+        self.last_terminal = None
+        lbox_root = self.read_section(section)
+        self.last_terminal = temp
+        return lbox_root
+
+    def object_to_node(self, jsnode):
+        node = JsonManager.object_to_node(self, jsnode)
+        if self.lazy and "section" in jsnode:
+            node.symbol.loader = lambda: self.load_language_box(node, jsnode["section"])
+        return node
+
+    def load_language_box(self, node, section):
+        """Builds a lazily loaded language box. Its tree is added to the
+        end of the language boxes returned by `load`."""
+        lbox_root = self.read_language_box(section)
+        language, whitespaces = self.sections[section][2:]
+        self.add_language_box(node, lbox_root, language, whitespaces)
+
+def main(argv=None):
+    optp = OptionParser(usage="usage: %prog [options] SOURCE DESTINATION\n\n"
+                        "Converts an .eco file into the binary format (or back).")
+    optp.add_option("-j", "--json", action="store_true", default=False, help="Write the JSON format instead")
+    (options, args) = optp.parse_args(argv)
+    if len(args) != 2:
+        optp.error("expected a source and a destination file")
+    root, language, whitespaces = JsonManager().load(args[0])[0]
+    manager = JsonManager() if options.json else BinaryManager()
+    manager.save(root, language, whitespaces, args[1])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,20 @@
+import os
+
 AUTOLBOX_HEURISTIC_LINE = True
 AUTOLBOX_HEURISTIC_HIST = True
 AUTOLBOX_HEURISTIC_STACK = True
+
+ECO_VERSION = "0.3.0"
+
+# Directory used to cache compiled grammars. Can be overridden with the
+# ECO_CACHE_DIR environment variable.
+CACHE_DIR = os.environ.get("ECO_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "eco")
+CACHE_MAX_ENTRIES = 200
+
+# Maximum number of undo steps that are kept. Older versions are discarded to
+# bound the memory used by the version history. None means unlimited.
+UNDO_LIMIT = 1000
+
+# Repaints of the editor taking longer than this (in milliseconds) are logged
+FRAME_BUDGET = 16
@@ -583,6 +583,19 @@ class LanguageView(QDialog):
 
 
 from optparse import OptionParser
+
+def create_optionparser():
+    parser = OptionParser(usage="usage: python2.7 %prog FILE [options]")
+    parser.add_option("-p", "--preload", action="store_true", default=False, help="Preload grammars")
+    parser.add_option("-v", "--verbose", action="store_true", default=False, help="Show output")
+    parser.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
+    parser.add_option("-e", "--export", action="store_true", default=False, help="Fast export files. Usage: --export [SOURCE] [DESTINATION]")
+    parser.add_option("-f", "--fullexport", action="store_true", default=False, help="Export files. Usage: --fullexport [SOURCE] [DESTINATION]")
+    parser.add_option("-g", "--grammar", action="store_true", default=None, help="Load external grammar. Usage: --grammar [GRAMMARFILE]")
+    parser.add_option("-c", "--composition", action="store_true", default=None, help="Load external composition. Usage: --composition [COMPOSITIONFILE]")
+    parser.add_option("-s", "--stats", action="store_true", default=False, help="Print parser statistics after every reparse")
+    return parser
+
 class Window(QMainWindow):
 
     def __init__(self):
@@ -884,33 +897,22 @@ class Window(QMainWindow):
             self.btReparse([])
 
     def parse_options(self):
-        # parse options
-        parser = OptionParser(usage="usage: python2.7 %prog FILE [options]")
-        parser.add_option("-p", "--preload", action="store_true", default=False, help="Preload grammars")
-        parser.add_option("-v", "--verbose", action="store_true", default=False, help="Show output")
-        parser.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
-        parser.add_option("-e", "--export", action="store_true", default=False, help="Fast export files. Usage: --export [SOURCE] [DESTINATION]")
-        parser.add_option("-f", "--fullexport", action="store_true", default=False, help="Export files. Usage: --fullexport [SOURCE] [DESTINATION]")
-        parser.add_option("-g", "--grammar", action="store_true", default=None, help="Load external grammar. Usage: --grammar [GRAMMARFILE]")
-        parser.add_option("-c", "--composition", action="store_true", default=None, help="Load external composition. Usage: --composition [COMPOSITIONFILE]")
-        (options, args) = parser.parse_args()
+        (options, args) = create_optionparser().parse_args()
 
         if options.log.upper() in ["INFO", "WARNING", "ERROR", "DEBUG"]:
             loglevel=getattr(logging, options.log.upper())
         else:
             loglevel=logging.WARNING
         logging.basicConfig(format='%(levelname)s: %(message)s', filemode='w', level=loglevel)
+        if loglevel == logging.DEBUG:
+            from incparser.trace import set_tracer, LoggingTracer
+            set_tracer(LoggingTracer())
+        if options.stats:
+            from treemanager import TreeManager
+            TreeManager.report_stats = lambda stats: sys.stderr.write("%s\n" % stats)
 
         if options.preload:
             self.preload()
-        if options.fullexport:
-            source = args[0]
-            dest = args[1]
-            self.cli_export(source, dest, False)
-        if options.export:
-            source = args[0]
-            dest = args[1]
-            self.cli_export(source, dest, True)
         if options.grammar:
             self.load_external_grammar(args[0])
             return
@@ -930,26 +932,6 @@ class Window(QMainWindow):
             except AttributeError:
                 pass
 
-    def cli_export(self, source, dest, fast):
-        print("Exporting...")
-        print("    Source: %s" % source)
-        print("    Destination: %s" % dest)
-
-        from jsonmanager import JsonManager
-        manager = JsonManager()
-        language_boxes = manager.load(source)
-
-        from treemanager import TreeManager
-        self.tm = TreeManager()
-
-        if fast:
-            self.tm.fast_export(language_boxes, dest, source=source)
-        else:
-            self.tm.load_file(language_boxes)
-            self.tm.export(dest, source=source)
-        QApplication.quit()
-        sys.exit(1)
-
     def show_languageboxes(self):
         if self.ui.actionShow_language_boxes.isChecked():
             return True
@@ -1201,10 +1183,14 @@ class Window(QMainWindow):
         if not ed:
             return
         self.delete_swap()
-        filename, _ = QFileDialog.getSaveFileName(self, "Save File", self.get_last_dir(), "Eco files (*.eco *.nb);; All files (*.*)")
+        filename, selected = QFileDialog.getSaveFileName(self, "Save File", self.get_last_dir(), "Eco files (*.eco *.nb);; Binary eco files (*.eco);; All files (*.*)")
         if filename:
             self.save_last_dir(str(filename))
             self.add_to_recent_files(str(filename))
+            if selected.startswith("Binary"):
+                self.getEditor().binaryfile = True
+            elif selected.startswith("Eco"):
+                self.getEditor().binaryfile = False
             self.getEditor().saveToJson(filename)
             self.getEditorTab().filename = filename
 
@@ -1212,6 +1198,7 @@ class Window(QMainWindow):
         if self.getEditorTab().filename is None:
             return
         swpfile = self.getEditorTab().filename + ".swp"
+        self.getEditor().worker.discard(swpfile)
         if os.path.isfile(swpfile):
             os.remove(swpfile)
 
@@ -1438,22 +1425,18 @@ class Window(QMainWindow):
             self.pgviewer.max_version = editor.tm.get_max_version()
             self.pgviewer.refresh(editor.tm.version)
 
-    def updateASTOutline(self):
+    def updateASTOutline(self, outline):
         self.ui.tw_astoutline.clear()
-        aa = self.getEditor().tm.parsers[0][3]
-        if "class" in aa.data:
-            for uri in aa.data["class"]:
-                if not uri.path or (uri.path and uri.path[0].name is None and len(uri.path) == 1):
-                    self.addToASTOutline(aa, uri, self.ui.tw_astoutline)
+        for uri, children in outline:
+            self.addToASTOutline(uri, children, self.ui.tw_astoutline)
         self.ui.tw_astoutline.expandAll()
 
-    def addToASTOutline(self, aa, uri, parent):
+    def addToASTOutline(self, uri, children, parent):
         qtreeitem = QTreeWidgetItem(parent)
         qtreeitem.setText(0, uri.name)
         qtreeitem.setIcon(0, QIcon("gui/"+uri.kind+".png"))
-        names = aa.get_names_within_path(uri.as_path())
-        for n in names:
-            self.addToASTOutline(aa, n, qtreeitem)
+        for n, grandchildren in children:
+            self.addToASTOutline(n, grandchildren, qtreeitem)
 
     def add_parsingstatus(self, nested, root, parent):
         if root not in nested:
@@ -1619,6 +1602,19 @@ class Window(QMainWindow):
         self.ui.expressionBox.setText(self.expression_list[self.expression_num])
 
 def main():
+    # Loading and saving don't recurse, but other parts of the editor still
+    # walk parse trees recursively
+    sys.setrecursionlimit(2000)
+    (options, args) = create_optionparser().parse_args()
+    if options.export or options.fullexport:
+        # Exporting doesn't need the GUI (see ecoexport.py for batch exports)
+        import ecoexport
+        if len(args) != 2:
+            sys.exit("Usage: --export [SOURCE] [DESTINATION]")
+        logging.basicConfig(format='%(levelname)s: %(message)s', level=getattr(logging, options.log.upper(), logging.WARNING))
+        failed = ecoexport.export_files([(args[0], args[1], options.export, False)], 1)
+        sys.exit(1 if failed else 0)
+
     app = QApplication(sys.argv)
     app.setStyle('gtk')
 
@@ -0,0 +1,182 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Headless batch export of .eco files to text or ATerms.
+
+Exporting doesn't need a QApplication or a window, so files are loaded with
+the JsonManager and exported through a plain TreeManager. Files are spread
+across a pool of worker processes. Each worker loads a grammar only once
+(grammars are kept in the per-process cache of `grammars.grammars`, which
+is in turn backed by the on-disk grammar cache)."""
+
+from optparse import OptionParser
+import contextlib, logging, multiprocessing, os, shutil, sys, tempfile, time, traceback
+
+def find_files(paths):
+    """Expands directories into the .eco files they contain (recursively).
+    Returns a list of (file, directory) tuples, where directory is the
+    directory argument the file was found in (or None)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith(".eco"):
+                        files.append((os.path.join(dirpath, name), path))
+        else:
+            files.append((path, None))
+    return files
+
+def destination(source, basedir, outdir, ext):
+    """Returns the path `source` is exported to. The directory structure below
+    `basedir` is mirrored within `outdir`."""
+    if source.endswith(".eco"):
+        name = source[:-len(".eco")] + ext
+    else:
+        name = source + ext
+    if outdir is None:
+        return name
+    if basedir is None:
+        return os.path.join(outdir, os.path.basename(name))
+    return os.path.join(outdir, os.path.relpath(name, basedir))
+
+def export_file(source, dest, fast=True):
+    """Exports a single .eco file to `dest`. Fast exports write out the tokens
+    as stored in the file, otherwise the file is reparsed first, which is
+    needed by exporters that depend on the parse tree. Returns False if the
+    file couldn't be exported."""
+    from jsonmanager import JsonManager
+    from treemanager import TreeManager
+
+    language_boxes = JsonManager().load(source)
+    tm = TreeManager()
+    if fast:
+        result = tm.fast_export(language_boxes, dest, source=source)
+    else:
+        tm.load_file(language_boxes)
+        result = tm.export(dest, source=source)
+    return result is not False
+
+def export_job(job):
+    """Runs in a worker process. Returns (source, dest, ok, seconds, error,
+    text), where text is the exported text if it was requested on stdout."""
+    source, dest, fast, tostdout = job
+    start = time.time()
+    tmpdir = None
+    text = None
+    try:
+        if tostdout:
+            tmpdir = tempfile.mkdtemp(prefix="ecoexport")
+            path = os.path.join(tmpdir, os.path.basename(dest))
+        else:
+            path = dest
+            if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Exporters report problems on stdout, which may be used for output
+        with contextlib.redirect_stdout(sys.stderr):
+            ok = export_file(source, path, fast)
+        if ok and tostdout:
+            with open(path) as f:
+                text = f.read()
+        error = None if ok else "syntax errors"
+    except Exception as e:
+        logging.debug(traceback.format_exc())
+        ok = False
+        error = "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return (source, dest, ok, time.time() - start, error, text)
+
+def export_files(jobs, processes=None, out=sys.stdout, status=sys.stderr):
+    """Exports a list of (source, dest, fast, tostdout) jobs. Results are
+    reported in the order of `jobs` while the remaining files are still being
+    exported. Returns the number of files that failed."""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        results = map(export_job, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(export_job, jobs)
+    failed = 0
+    start = time.time()
+    try:
+        for source, dest, ok, seconds, error, text in results:
+            if ok:
+                if text is not None:
+                    out.write(text)
+                    out.flush()
+                    status.write("OK    %s (%.2fs)\n" % (source, seconds))
+                else:
+                    status.write("OK    %s -> %s (%.2fs)\n" % (source, dest, seconds))
+            else:
+                failed += 1
+                status.write("FAIL  %s (%.2fs): %s\n" % (source, seconds, error))
+            status.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    status.write("Exported %s of %s file(s) in %.2fs\n" % (len(jobs) - failed, len(jobs), time.time() - start))
+    return failed
+
+def main(argv=None):
+    optp = OptionParser(usage="usage: %prog [options] FILE|DIRECTORY ...\n\n"
+                        "Exports .eco files (directories are searched recursively) without starting the editor.")
+    optp.add_option("-o", "--output", default=None, help="Write exported files into this directory (default: next to the source)")
+    optp.add_option("-a", "--aterms", action="store_true", default=False, help="Export ATerms instead of text")
+    optp.add_option("-x", "--extension", default=None, help="Extension that replaces '.eco' (default: '.txt', or '.aterms' with --aterms)")
+    optp.add_option("-s", "--stdout", action="store_true", default=False, help="Write exported text to stdout in the given order instead of to files")
+    optp.add_option("-f", "--full", action="store_true", default=False, help="Reparse files before exporting (needed by some exporters)")
+    optp.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: number of CPUs)")
+    optp.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
+    (options, args) = optp.parse_args(argv)
+    # Some exporters walk parse trees recursively
+    sys.setrecursionlimit(2000)
+
+    if not args:
+        optp.print_help()
+        return 2
+
+    loglevel = getattr(logging, options.log.upper(), logging.WARNING)
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=loglevel)
+
+    ext = options.extension
+    if ext is None:
+        ext = ".aterms" if options.aterms else ".txt"
+    elif options.aterms and not ext.endswith(".aterms"):
+        optp.error("ATerms exports need an extension ending in '.aterms'")
+
+    jobs = []
+    for source, basedir in find_files(args):
+        dest = destination(source, basedir, options.output, ext)
+        jobs.append((source, dest, not options.full, options.stdout))
+    if not jobs:
+        sys.stderr.write("No .eco files found\n")
+        return 1
+    return 1 if export_files(jobs, options.jobs) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -77,7 +77,7 @@ class EditorTab(QWidget):
 
     def update_theme(self):
         self.scrollarea.update_theme()
-        self.editor.update()
+        self.editor.update_theme()
 
     def changed(self):
         return self.editor.tm.changed
@@ -51,10 +51,17 @@ class Rule(object):
         return "Rule(%s => %s)" % (self.symbol, self.alternatives)
 
 class Symbol(object):
+    # Set by SymbolTable.intern. Since node symbols are renamed during editing,
+    # only interned symbols may cache their hash.
+    id = -1
+    _hash = None
+
     def __init__(self, name=""):
         self.name = name
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if other.__class__ != self.__class__:
             return False
         return self.name == other.name
@@ -63,9 +70,22 @@ class Symbol(object):
         return not self == other
 
     def __hash__(self):
+        if self._hash is not None:
+            return self._hash
         #XXX unsafe hashfunction
         return hash(self.__class__.__name__ + self.name)
 
+    def __getstate__(self):
+        # string hashes differ between processes, so never pickle them
+        state = self.__dict__.copy()
+        state.pop("_hash", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.id >= 0:
+            self._hash = hash(self.__class__.__name__ + self.name)
+
     def copy(self):
         return self.__class__(self.name)
 
@@ -76,6 +96,16 @@ class Terminal(Symbol):
 
 class MagicTerminal(Terminal):
     """Special terminal representing language boxes."""
+    def __getattr__(self, name):
+        # Language boxes that are read lazily from binary files (see
+        # binarymanager.py) are loaded when their tree is first accessed
+        loader = self.__dict__.get("loader")
+        if loader is None or name not in ("ast", "parser"):
+            raise AttributeError(name)
+        del self.loader
+        loader()
+        return self.__dict__[name]
+
     def __repr__(self):
         return "MagicTerminal('%s')" % (repr(self.name),)
 
@@ -109,6 +139,41 @@ class Epsilon(Symbol):
         #XXX why doesn't Epsilon inherit this method from Symbol!?
         return hash(self.__class__.__name__ + self.name)
 
+class SymbolTable(object):
+    """Keeps one canonical instance per (kind, name) of the symbols of a
+    grammar. Interned symbols get a unique integer id and a precomputed hash,
+    so comparing and hashing them is cheap. Interned symbols must never be
+    renamed: use `copy()` to get a symbol that can be modified."""
+
+    def __init__(self):
+        self.symbols = []
+        self.ids = {}
+
+    def intern(self, symbol):
+        key = (symbol.__class__, symbol.name)
+        try:
+            return self.symbols[self.ids[key]]
+        except KeyError:
+            pass
+        # intern a private copy, so renaming the original can't corrupt the
+        # cached hash
+        symbol = symbol.__class__(symbol.name)
+        symbol.id = len(self.symbols)
+        symbol._hash = hash(symbol.__class__.__name__ + symbol.name)
+        self.ids[key] = symbol.id
+        self.symbols.append(symbol)
+        return symbol
+
+    def get(self, cls, name):
+        """Returns the interned symbol `cls(name)` or None."""
+        try:
+            return self.symbols[self.ids[(cls, name)]]
+        except KeyError:
+            return None
+
+    def __len__(self):
+        return len(self.symbols)
+
 class ExtendedSymbol(object):
 
     def __init__(self, name, children):
@@ -19,7 +19,7 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon
+from grammar_parser.gparser import Parser, Nonterminal, Terminal, MagicTerminal, Epsilon, SymbolTable
 
 
 def test_terminal():
@@ -131,3 +131,31 @@ def test_group_rule():
     assert p.rules[Nonterminal("A_group1")].alternatives == [[Terminal("b"), Nonterminal("A_group2")],
                                                              [Terminal("c"), Nonterminal("A_group2")]]
     assert p.rules[Nonterminal("A_group2")].alternatives == [[Terminal("g")]]
+
+def test_symboltable():
+    st = SymbolTable()
+    a = Terminal("a")
+    t1 = st.intern(a)
+    assert t1 is not a
+    assert t1 == a
+    assert hash(t1) == hash(a)
+    assert st.intern(Terminal("a")) is t1
+    assert st.intern(Nonterminal("a")) is not t1
+    assert st.intern(MagicTerminal("a")) != t1
+    assert [s.id for s in st.symbols] == [0, 1, 2]
+    assert st.get(Nonterminal, "a").id == 1
+    assert st.get(Terminal, "b") is None
+    # copies of interned symbols can be modified safely
+    c = t1.copy()
+    assert c.id == -1
+    c.name = "b"
+    assert hash(t1) == hash(Terminal("a"))
+
+def test_symboltable_pickle():
+    import pickle
+    st = SymbolTable()
+    t = st.intern(Terminal("a"))
+    t2 = pickle.loads(pickle.dumps(t))
+    assert "_hash" not in pickle.loads(pickle.dumps(t)).__getstate__()
+    assert t2.id == t.id
+    assert hash(t2) == hash(Terminal("a"))
@@ -88,7 +88,8 @@ class Test_CalcLexer(Test_IncrementalLexer):
         assert next_token() == ("1", "INT", 1, [TextNode(Terminal("1+2*3"))], -4)
         assert next_token() == ("+", "plus", 0, [TextNode(Terminal("1+2*3"))], -3)
         assert next_token() == ("2", "INT", 1, [TextNode(Terminal("1+2*3"))], -2)
-        assert next_token() == ("*", "mul", 0, [TextNode(Terminal("1+2*3"))], -1)
+        # "*" could still become cmt_end ("*/")
+        assert next_token() == ("*", "mul", 1, [TextNode(Terminal("1+2*3"))], -1)
         assert next_token() == ("3", "INT", 1, [TextNode(Terminal("1+2*3"))], 0)
 
     def test_token_iter2(self):
@@ -20,6 +20,8 @@
 # IN THE SOFTWARE.
 
 import re
+from bisect import bisect_right
+from array import array
 from grammar_parser.gparser import Nonterminal, Terminal, IndentationTerminal
 from .syntaxtable import FinishSymbol
 
@@ -40,31 +42,8 @@ class AST(object):
     def get_bos(self):
         return self.parent.children[0]
 
-    def find_node_at_pos(self, pos, node=None): #recursive
-        if node is None:
-           node = self.parent.children[1]
-
-        if isinstance(node.symbol, Nonterminal):
-            for child in node.children:
-                result = self.find_node_at_pos(pos, child)
-                if result:
-                    return result
-
-        if node.pos + len(node.symbol.name) >= pos:
-            return node
-
-
-    def find_node_at_pos_iterative(self, pos): #not working
-        stack = []
-        stack.append(self.parent.children[1]) # skip bos
-        #XXX speed things up later by having a list/dict of all terminal nodes
-        while stack != []:
-            e = stack.pop(0)
-            if isinstance(e.symbol, Nonterminal):
-                stack.extend(e.children)
-                continue
-            if e.pos + len(e.symbol.name) >= pos:
-                return e
+    def find_node_at_pos(self, pos):
+        return self.parent.find_terminal(pos)[0]
 
     def find_common_parent(self, start, end):
         start_parents = []
@@ -103,6 +82,154 @@ class AST(object):
         self.parent.cprint(output)
         return "\n".join(output)
 
+class NodeHistory(object):
+    """Version history of a node.
+
+    Each save stores a single record (a tuple with the values of `ATTRS`)
+    under its version. Versions are kept sorted in a typed array, so finding
+    the record that is valid in some version is a binary search. Unchanged
+    records and children lists are shared with the previous save.
+
+    Records are deliberately not split into per-attribute columns: a changed
+    record only costs one tuple of references, while undo and redo load every
+    attribute of every node they touch and would have to look each one up
+    separately.
+
+    For compatibility the history can also be accessed like the old log
+    dictionary, i.e. `log[(attr, version)]`, which only finds attributes that
+    were saved in exactly that version."""
+
+    __slots__ = ["versions", "records", "new_version"]
+
+    ATTRS = ("children", "parent", "left", "right", "next_term", "prev_term",
+             "deleted", "indent", "changed", "nested_changes", "nested_errors",
+             "local_error", "textlen", "position", "isolated", "symbol.name",
+             "lookup", "alternate")
+    INDEX = dict((a, i) for i, a in enumerate(ATTRS))
+
+    def __init__(self):
+        self.versions = array("i")
+        self.records = []
+        self.new_version = -1
+
+    def save(self, node, version):
+        i = bisect_right(self.versions, version)
+        if i > 0 and self.versions[i-1] == version:
+            # overwriting this version: compare with the one before
+            prev = self.records[i-2] if i > 1 else None
+        else:
+            prev = self.records[i-1] if i > 0 else None
+        children = node.children
+        if prev is not None:
+            oldchildren = prev[0]
+            if len(oldchildren) == len(children) and all(a is b for a, b in zip(oldchildren, children)):
+                children = oldchildren
+            else:
+                children = list(children)
+        else:
+            children = list(children)
+        record = (children, node.parent, node.left, node.right, node.next_term,
+                  node.prev_term, node.deleted, node.indent, node.changed,
+                  node.nested_changes, node.nested_errors, node.local_error,
+                  node.textlen, node.position, node.isolated, node.symbol.name,
+                  getattr(node, "lookup", ""), getattr(node, "alternate", None))
+        if prev is not None and all(a is b for a, b in zip(record, prev)):
+            record = prev
+        self.put(version, record)
+
+    def put(self, version, record):
+        i = bisect_right(self.versions, version)
+        if i > 0 and self.versions[i-1] == version:
+            self.records[i-1] = record
+        else:
+            self.versions.insert(i, version)
+            self.records.insert(i, record)
+
+    def find(self, version):
+        """Returns the record valid in `version` and the version it was saved
+        in, or (None, None) if there is none."""
+        i = bisect_right(self.versions, version) - 1
+        if i < 0:
+            return None, None
+        return self.records[i], self.versions[i]
+
+    def get(self, attr, version):
+        i = bisect_right(self.versions, version) - 1
+        if i < 0:
+            raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        if attr == "version":
+            return self.versions[i]
+        return self.records[i][self.INDEX[attr]]
+
+    def set(self, attr, version, value):
+        """Overrides a single attribute in `version`. If the node wasn't saved
+        in that version, the record valid at that point is copied."""
+        record, _ = self.find(version)
+        if record is None:
+            raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        record = list(record)
+        record[self.INDEX[attr]] = value
+        self.put(version, tuple(record))
+
+    def has_version(self, version):
+        i = bisect_right(self.versions, version)
+        return i > 0 and self.versions[i-1] == version
+
+    def latest(self, version=None):
+        """Returns the latest saved version (not newer than `version`)."""
+        if version is None:
+            i = len(self.versions)
+        else:
+            i = bisect_right(self.versions, version)
+        if i == 0:
+            return None
+        return self.versions[i-1]
+
+    def remove(self, version):
+        i = bisect_right(self.versions, version) - 1
+        if i >= 0 and self.versions[i] == version:
+            del self.versions[i]
+            del self.records[i]
+        if self.new_version == version:
+            self.new_version = -1
+
+    def truncate(self, version):
+        """Removes all versions newer than `version`."""
+        i = bisect_right(self.versions, version)
+        del self.versions[i:]
+        del self.records[i:]
+        if self.new_version > version:
+            self.new_version = -1
+
+    def compact(self, version):
+        """Removes all versions older than `version`, except for the one that
+        is still valid in `version`."""
+        i = bisect_right(self.versions, version) - 1
+        if i > 0:
+            del self.versions[:i]
+            del self.records[:i]
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, key):
+        attr, version = key
+        if attr == "new":
+            return self.new_version == version
+        return self.has_version(version)
+
+    def __getitem__(self, key):
+        attr, version = key
+        if not key in self:
+            raise KeyError(key)
+        if attr == "new":
+            return True
+        return self.get(attr, version)
+
+    def __setitem__(self, key, value):
+        attr, version = key
+        self.set(attr, version, value)
+
 class Node(object):
     __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations", "log", "max_version"]
     def __init__(self, symbol, state, children):
@@ -117,7 +244,7 @@ class Node(object):
         if children is None:
             children = []
         self.set_children(children)
-        self.log = {}
+        self.log = NodeHistory()
         self.max_version = None
         self.annotations = []
 
@@ -187,81 +314,49 @@ class Node(object):
                 break
 
     def save(self, version):
-        # XXX version set, e.g. set(0,1,5,6,9) that contains all versions in
-        # which this node has been saved. this way we can easily check if a
-        # the node has changes in that version and quickly get the closest
-        # versions to it if not
-        self.log[("children", version)] = list(self.children)
-        self.log[("parent", version)] = self.parent
-        self.log[("left", version)] = self.left
-        self.log[("right", version)] = self.right
-        self.log[("next_term", version)] = self.next_term
-        self.log[("prev_term", version)] = self.prev_term
-        self.log[("deleted", version)] = self.deleted
-        self.log[("indent", version)] = self.indent
-        self.log[("changed", version)] = self.changed
-        self.log[("nested_changes", version)] = self.nested_changes
-        self.log[("nested_errors", version)] = self.nested_errors
-        self.log[("local_error", version)] = self.local_error
-        self.log[("textlen", version)] = self.textlen
-        self.log[("position", version)] = self.position
-        self.log[("isolated", version)] = self.isolated
-        self.log[("version", version)] = version
+        self.log.save(self, version)
         if self.new:
-            self.log[("new", version)] = True
+            self.log.new_version = version
             self.new = False
         # XXX save lookback
         self.version = version
 
     def load(self, version):
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.parent = self.log[("parent", version)]
-                self.children = list(self.log[("children", version)])
-                self.left = self.log[("left", version)]
-                self.right = self.log[("right", version)]
-                self.next_term = self.log[("next_term", version)]
-                self.prev_term = self.log[("prev_term", version)]
-                self.deleted = self.log[("deleted", version)]
-                self.indent = self.log[("indent", version)]
-                self.changed = self.log[("changed", version)]
-                self.nested_changes = self.log[("nested_changes", version)]
-                self.local_error = self.log[("local_error", version)]
-                self.nested_errors = self.log[("nested_errors", version)]
-                self.textlen = self.log[("textlen", version)]
-                self.position = self.log[("position", version)]
-                self.isolated = self.log[("isolated", version)]
-                self.version = version
-                return
-            version -= 1
+        record, version = self.log.find(version)
+        if record is None:
+            return
+        (children, self.parent, self.left, self.right, self.next_term,
+         self.prev_term, self.deleted, self.indent, self.changed,
+         self.nested_changes, self.nested_errors, self.local_error,
+         self.textlen, self.position, self.isolated) = record[:15]
+        self.children = list(children)
+        self.version = version
+
+    def saved_state(self, version):
+        """Returns the children, nested errors, local error, text length,
+        text, lookup and AST node of this node as they were saved in
+        `version`, or their current values if `version` is None or wasn't
+        saved. Saved records are never changed, so other threads can read old
+        versions while the tree is being edited."""
+        if version is not None:
+            record, _ = self.log.find(version)
+            if record is not None:
+                return record[0], record[10], record[11], record[12], record[15], record[16], record[17]
+        return (self.children, self.nested_errors, self.local_error, self.textlen,
+                self.symbol.name, getattr(self, "lookup", ""), getattr(self, "alternate", None))
 
     def delete_version(self, version):
-        if not ("parent", version) in self.log:
+        if not self.log.has_version(version):
             return
         assert version <= self.max_version
-        for attr in ["parent", "children", "left", "right", "next_term", "prev_term", "deleted", "indent",\
-                "changed", "nested_changes", "local_error", "nested_errors", "symbol.name", "lookup", "version"]:
-            if (attr, version) in self.log:
-                self.log.pop((attr, version))
+        self.log.remove(version)
         # reset max_version
-        new_max = version - 1
-        while not ("parent", new_max) in self.log:
-            if new_max == 0:
-                break
-            new_max -= 1
-        self.max_version = new_max
+        self.max_version = self.log.latest(version - 1) or 0
 
     def get_attr(self, attr, version):
         if version is None:
             return getattr(self, attr)
-        if self.max_version and version > self.max_version:
-            return self.log[(attr, self.max_version)]
-        while version >= 0:
-            try:
-                return self.log[(attr, version)]
-            except KeyError:
-                version -= 1
-        raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        return self.log.get(attr, version)
 
     def remove_child(self, child, remove=False):
         for i in range(len(self.children)):
@@ -481,7 +576,6 @@ class TextNode(Node):
         self.alternate = None
         self.lookahead = lookahead
         self.lookup = ""
-        self.log = {}
         self.version = 0
         self.indent = None
         self.textlen = -1
@@ -555,34 +649,90 @@ class TextNode(Node):
 
     def save(self, version):
         Node.save(self, version)
-        self.log[("symbol.name", version)] = self.symbol.name
-        self.log[("lookup", version)] = self.lookup
         self.max_version = version
 
     def load(self, version):
         Node.load(self, version)
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.lookup = self.log[("lookup", version)]
-                break
-            version -= 1
+        record, _ = self.log.find(version)
+        if record is None:
+            return
+        self.lookup = record[16]
 
         if not isinstance(self.symbol, Terminal):
             return
-        text = self.get_text(version)
+        text = record[15]
         if text:
             self.symbol.name = text
         else:
             pass
 
     def is_new(self, version):
-        return ("new", version) in self.log
+        return self.log.new_version == version
 
     def textlength(self, version = None):
         if version is not None:
             return self.get_attr("textlen", version)
         return self.textlen
 
+    def get_offset(self, version=None):
+        """Returns the character offset of this node within its parse tree,
+        or within the parse tree of `version`. Language boxes have their own
+        offsets and count as their name within the surrounding tree.
+
+        Adds up the text lengths of the siblings left of this node and of each
+        of its ancestors, which takes O(depth * branching). Lists in the
+        bundled grammars are left-recursive (e.g. `stmts ::= stmts stmt`), so
+        this is linear in the worst case. The editor uses the text index for
+        offsets in the current document instead (see textindex.py)."""
+        if version is not None:
+            offset = 0
+            node = self
+            while True:
+                if isinstance(node, BOS):
+                    # Reached the beginning of the parse tree
+                    break
+                left = node.get_attr("left", version)
+                if left:
+                    node = left
+                    offset += node.textlength(version = version)
+                else:
+                    node = node.get_attr("parent", version)
+            return offset
+        offset = 0
+        node = self
+        parent = node.parent
+        while parent is not None:
+            for c in parent.children:
+                if c is node:
+                    break
+                offset += c.textlen
+            node = parent
+            parent = node.parent
+        return offset
+
+    def find_terminal(self, offset):
+        """Returns the terminal left of character `offset` within this subtree
+        and the position within that terminal, like the cursor does. Descends
+        from this node using the text lengths of the subtrees, which costs
+        O(depth * branching) like `get_offset`. See textindex.py for lookups
+        in the current document."""
+        offset = min(offset, self.textlen)
+        if offset <= 0:
+            node = self
+            while node.children:
+                node = node.children[0]
+            return node, 0
+        node = self
+        while node.children:
+            for c in node.children:
+                if offset <= c.textlen:
+                    node = c
+                    break
+                offset -= c.textlen
+            else:
+                raise ValueError("text lengths of %s are out of date" % (node,))
+        return node, offset
+
     def calc_textlength(self):
         if self.children:
             self.textlen = sum([c.textlen for c in self.children])
@@ -592,9 +742,10 @@ class TextNode(Node):
             self.textlen = len(self.symbol.name)
 
     def has_unsaved_changes(self):
-        if self.changed != self.log[("changed", self.version)]:
+        record, _ = self.log.find(self.version)
+        if self.changed != record[8]:
             return True
-        if self.nested_changes != self.log[("nested_changes", self.version)]:
+        if self.nested_changes != record[9]:
             return True
         return False
 
@@ -607,11 +758,10 @@ class TextNode(Node):
         return self.nested_errors or self.local_error
 
     def get_text(self, version):
-        while version >= 0:
-            if ("symbol.name", version) in self.log:
-                return self.log[("symbol.name", version)]
-            version -= 1
-        return self.symbol.name
+        record, _ = self.log.find(version)
+        if record is None:
+            return self.symbol.name
+        return record[15]
 
     def insert(self, char, pos):
         l = list(self.symbol.name)
@@ -0,0 +1,141 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""On-disk cache for compiled grammars.
+
+Entries are addressed by a sha256 digest of everything that influences the
+result (grammar text, options, lr_type, Eco version), so the same grammar
+maps to the same file across processes. The key also contains the FORMAT of
+the cached class (e.g. `StateGraph.FORMAT`), which has to be increased
+whenever a change to the class changes what is pickled, so that entries of
+older builds are no longer found. Classes that convert old pickles in
+`__setstate__` (like `SyntaxTable`) don't need a format. Each file starts with a magic
+header and a checksum of the pickled payload, which is verified on load.
+Writes go to a temporary file that is then renamed into place, so concurrent
+Eco instances never see half-written entries."""
+
+import os, hashlib, pickle, tempfile, logging
+
+import config
+
+MAGIC = b"ECOCACHE1\n"
+SUFFIX = ".pcl"
+
+def digest(*parts):
+    """Computes a stable hex digest over `parts`, which are converted to
+    strings using `repr`."""
+    m = hashlib.sha256()
+    m.update(config.ECO_VERSION.encode("utf-8"))
+    for p in parts:
+        m.update(b"\0")
+        m.update(repr(p).encode("utf-8"))
+    return m.hexdigest()
+
+class GrammarCache(object):
+
+    def __init__(self, directory=None, max_entries=None):
+        self.directory = directory or config.CACHE_DIR
+        if max_entries is None:
+            max_entries = config.CACHE_MAX_ENTRIES
+        self.max_entries = max_entries
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key):
+        """Returns the object stored under `key` or None if there is no valid
+        entry. Corrupt entries are removed."""
+        filename = self.path(key)
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        header = len(MAGIC) + 32
+        if data[:len(MAGIC)] != MAGIC or \
+                hashlib.sha256(data[header:]).digest() != data[len(MAGIC):header]:
+            logging.warning("Removing corrupt cache entry %s", filename)
+            self.remove(filename)
+            return None
+        try:
+            obj = pickle.loads(data[header:])
+        except Exception as e:
+            # e.g. pickled classes have changed since the entry was written
+            logging.warning("Could not unpickle cache entry %s: %s", filename, e)
+            self.remove(filename)
+            return None
+        try:
+            os.utime(filename, None) # mark as recently used
+        except OSError:
+            pass
+        return obj
+
+    def store(self, key, obj):
+        """Atomically writes `obj` to the cache. Failing to write the cache
+        is not an error: the grammar will just be rebuilt next time."""
+        payload = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError as e:
+            logging.debug("Could not write to cache directory %s: %s", self.directory, e)
+            return False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                f.write(hashlib.sha256(payload).digest())
+                f.write(payload)
+            os.replace(tmpname, self.path(key))
+        except OSError as e:
+            logging.debug("Could not write cache entry %s: %s", key, e)
+            self.remove(tmpname)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Removes the least recently used entries until there are at most
+        `max_entries` left."""
+        if not self.max_entries:
+            return
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(SUFFIX)]
+        except OSError:
+            return
+        if len(names) <= self.max_entries:
+            return
+        entries = []
+        for n in names:
+            filename = os.path.join(self.directory, n)
+            try:
+                entries.append((os.path.getmtime(filename), filename))
+            except OSError:
+                pass
+        entries.sort()
+        for _, filename in entries[:len(entries) - self.max_entries]:
+            self.remove(filename)
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
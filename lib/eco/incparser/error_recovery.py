@@ -1,14 +1,14 @@
 from .astree import FinishSymbol, BOS, EOS, Nonterminal
 from .syntaxtable import Goto
-import logging
 
 class RecoveryManager(object):
 
-    def __init__(self, previous_version, root, stack, syntaxtable):
+    def __init__(self, previous_version, root, stack, syntaxtable, tracer=None):
         self.previous_version = previous_version
         self.root = root
         self.stack = stack
         self.syntaxtable = syntaxtable
+        self.tracer = tracer
         self.rejects = set()
 
         self.new_state = None
@@ -19,7 +19,8 @@ class RecoveryManager(object):
         to find a subtree containing that nodes that can be reverted to allow
         the parsing algorithm to continue."""
 
-        logging.debug("\x1b[31mRecovering\x1b[0m %s (%s)", error_node, id(error_node))
+        if self.tracer:
+            self.tracer("recover", node=error_node)
 
         ancestors_to_ignore = set()
 
@@ -145,7 +146,8 @@ class RecoveryManager(object):
             self.iso_node.state = self.new_state
             self.iso_offset = last_offset
             self.error_offset = error_offset
-            logging.debug("   Found valid isolation node %s (%s)", node, id(node))
+            if self.tracer:
+                self.tracer("isolate", node=node)
             return True
 
         return False
@@ -195,19 +197,5 @@ class RecoveryManager(object):
         return offset
 
     def offset(self, node, version = None):
-        """Calculates the character offset of `node`. This is an optimised
-        version that goes backwards through the tree starting at the node,
-        instead of starting at BOS which requires looking into each subtree to
-        find `node`."""
-        offset = 0
-        while True:
-            if isinstance(node, BOS):
-                # Reached the beginning of the parse tree
-                break
-            left = node.get_attr("left", version)
-            if left:
-                node = left
-                offset += node.textlength(version = version)
-            else:
-                node = node.get_attr("parent", version)
-        return offset
+        """Calculates the character offset of `node`."""
+        return node.get_offset(version)
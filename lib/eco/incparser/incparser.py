@@ -21,20 +21,17 @@
 
 
 
-try:
-    import pickle as pickle
-except:
-    import pickle
-
 import time, os
 
 from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon, IndentationTerminal, MagicTerminal
 from .syntaxtable import SyntaxTable, FinishSymbol, Reduce, Accept, Shift
 from .stategraph import StateGraph
-from .constants import LR0, LALR
+from .cache import GrammarCache, digest
+from .constants import LR0
 from .astree import AST, TextNode, BOS, EOS
 from ip_plugins.plugin import PluginManager
 from .error_recovery import RecoveryManager
+from .stats import ParseStats
 from autolboxdetector import NewAutoLboxDetector
 
 import logging
@@ -57,6 +54,9 @@ def printline(start):
 
 class IncParser(object):
 
+    # Receives parse events if tracing is enabled (see incparser/trace.py)
+    tracer = None
+
     def __init__(self, grammar=None, lr_type=LR0, whitespaces=False, startsymbol=None):
 
         if grammar:
@@ -64,25 +64,22 @@ class IncParser(object):
             parser = Parser(grammar, whitespaces)
             parser.parse()
 
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(hash(grammar) ^ hash(whitespaces)), ".pcl"])
-            try:
-                logging.debug("Try to unpickle former stategraph")
-                f = open(filename, "rb")
-                start = time.time()
-                self.graph = pickle.load(f)
+            cache = GrammarCache()
+            key = digest("stategraph", StateGraph.FORMAT, grammar, whitespaces, lr_type)
+            logging.debug("Try to unpickle former stategraph")
+            start = time.time()
+            self.graph = cache.load(key)
+            if self.graph is not None:
                 end = time.time()
                 logging.debug("unpickling done in %s", end-start)
-            except IOError:
+            else:
                 logging.debug("could not unpickle old graph")
                 logging.debug("Creating Stategraph")
                 self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
                 logging.debug("Building Stategraph")
                 self.graph.build()
                 logging.debug("Pickling")
-                pickle.dump(self.graph, open(filename, "wb"))
-
-            if lr_type == LALR:
-                self.graph.convert_lalr()
+                cache.store(key, self.graph)
 
             logging.debug("Creating Syntaxtable")
             self.syntaxtable = SyntaxTable(None, lr_type)
@@ -103,6 +100,11 @@ class IncParser(object):
         self.prev_version = 0
 
         self.ooc = None
+        self.stats = ParseStats()
+
+        # Ids of the AST nodes (re)built since the last call of
+        # `take_changes`. None if those can't be known, e.g. after undo.
+        self.analysis_changes = None
 
         self.autolboxes = None
         self.autodetector = None
@@ -116,20 +118,16 @@ class IncParser(object):
         self.graph = None
         self.syntaxtable = None
         if pickle_id:
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(pickle_id), ".pcl"])
-            try:
-                with open(filename, "rb") as f:
-                    self.syntaxtable = pickle.load(f)
-            except IOError:
-                pass
+            cache = GrammarCache()
+            key = digest("syntaxtable", pickle_id, lr_type)
+            self.syntaxtable = cache.load(key)
         if self.syntaxtable is None:
             self.graph = StateGraph(startsymbol, rules, lr_type)
             self.graph.build()
             self.syntaxtable = SyntaxTable(prod_ids, lr_type)
             self.syntaxtable.build(self.graph, precedences)
             if pickle_id:
-                with open(filename, "wb") as f:
-                    pickle.dump(self.syntaxtable, f)
+                cache.store(key, self.syntaxtable)
 
         self.whitespaces = whitespaces
 
@@ -154,8 +152,21 @@ class IncParser(object):
         self.inc_parse([], True)
 
     def inc_parse(self, line_indents=[], needs_reparse=False, state=0, stack = []):
-        logging.debug("============ NEW %s PARSE ================= ", "OOC" if self.ooc else "INCREMENTAL")
-        logging.debug("= starting in state %s ", state)
+        if self.ooc:
+            # out-of-context analyses count into the stats of the outer parse
+            return self.parse(needs_reparse, state, stack)
+        self.stats = ParseStats()
+        start = time.perf_counter()
+        try:
+            return self.parse(needs_reparse, state, stack)
+        finally:
+            self.stats.times["parse"] += time.perf_counter() - start
+
+    def parse(self, needs_reparse, state, stack):
+        tracer = self.tracer
+        stats = self.stats
+        if tracer:
+            tracer("parse", ooc=bool(self.ooc), state=state)
         self.validating = False
         self.reused_nodes = set()
         self.current_state = state
@@ -175,57 +186,56 @@ class IncParser(object):
             rmroot = self.ooc[1]
         else:
             rmroot = self.previous_version.parent
-        self.rm = RecoveryManager(self.prev_version, rmroot, self.stack, self.syntaxtable)
+        self.rm = RecoveryManager(self.prev_version, rmroot, self.stack, self.syntaxtable, tracer)
 
         USE_OPT = True
 
 
         la = self.pop_lookahead(bos)
         while(True):
-            logging.debug("\x1b[35mProcessing\x1b[0m %s %s %s %s", la, la.changed, id(la), la.indent)
+            if tracer:
+                tracer("lookahead", node=la, state=self.current_state)
             self.loopcount += 1
-
-
+            stats.lookaheads += 1
 
             # Abort condition for out-of-context analysis. If we reached the state of the
             # node that is being analyses and the lookahead matches the nodes
             # lookahead from the previous parse, we are done
             if self.ooc:
-                logging.debug("ooc %s %s", self.ooc, id(self.ooc))
-                logging.debug("la %s", la)
-                logging.debug("cs %s", self.current_state)
                 if la is self.ooc[0]:
                     if isinstance(la.symbol, Nonterminal):
                         # if OOC is Nonterminal, use first terminal to apply
                         # reductions
                         first_term = la.find_first_terminal(self.prev_version)
-                        lookup = self.get_lookup(first_term)
+                        lookup = self.get_lookup_id(first_term)
                     else:
-                        lookup = self.get_lookup(la)
+                        lookup = self.get_lookup_id(la)
                     while True:
                         # OOC is complete if we reached the expected state and
                         # there are no more reductions left to do
                         if self.current_state == self.ooc[2] and len(self.stack) == 2:
-                            logging.debug("======= OOC parse successfull =========")
+                            if tracer:
+                                tracer("accept", loopcount=self.loopcount)
                             self.last_status = True
                             return True
                         # Otherwise apply more reductions to reach the wanted
                         # state or an error occurs
-                        element = self.syntaxtable.lookup(self.current_state, lookup)
+                        element = self.syntaxtable.lookup_id(self.current_state, lookup)
                         if not isinstance(element, Reduce):
-                            logging.debug("No more reductions")
                             break
                         else:
                             self.reduce(element)
-                    logging.debug("======= OOC parse failed =========")
+                    if tracer:
+                        tracer("error", loopcount=self.loopcount)
                     self.last_status = False
                     return False
 
             if isinstance(la.symbol, Terminal) or isinstance(la.symbol, FinishSymbol) or la.symbol == Epsilon():
-                    lookup_symbol = self.get_lookup(la)
-                    result = self.parse_terminal(la, lookup_symbol)
+                    lookup_id = self.get_lookup_id(la)
+                    result = self.parse_terminal(la, lookup_id)
                     if result == "Accept":
-                        logging.debug("============ INCREMENTAL PARSE END (ACCEPT) ================= ")
+                        if tracer:
+                            tracer("accept", loopcount=self.loopcount)
                         # With error recovery we can end up in the accepting
                         # state despite errors occuring during the parse.
                         if len(self.error_nodes) == 0:
@@ -235,7 +245,8 @@ class IncParser(object):
                         self.last_status = False
                         return False
                     elif result == "Error":
-                        logging.debug("============ INCREMENTAL PARSE END (ERROR) ================= ")
+                        if tracer:
+                            tracer("error", loopcount=self.loopcount)
                         self.last_status = False
                         return False
                     elif result != None:
@@ -252,19 +263,20 @@ class IncParser(object):
                             # skip this node immediately.
                             la = self.left_breakdown(la)
                             continue
-                        goto = self.syntaxtable.lookup(self.current_state, la.symbol)
+                        goto = self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.symbol_id(la.symbol))
                         # Only opt-shift if the nonterminal has children to
                         # avoid a bug in the retainability algorithm. See
                         # test/test_eco.py::Test_RetainSubtree::test_bug1
                         if goto and la.children: # can we shift this Nonterminal in the current state?
-                            logging.debug("OPTShift: %s in state %s -> %s", la.symbol, self.current_state, goto)
+                            if tracer:
+                                tracer("optshift", node=la, state=self.current_state, goto=goto)
+                            stats.optshifts += 1
                             follow_id = goto.action
                             self.stack.append(la)
                             la.deleted = False
                             la.state = follow_id #XXX this fixed goto error (I should think about storing the states on the stack instead of inside the elements)
                             la.exists = True
                             self.current_state = follow_id
-                            logging.debug("USE_OPT: set state to %s", self.current_state)
                             if la.isolated:
                                 # When skipping previously isolated subtrees,
                                 # traverse their children to find the error
@@ -277,10 +289,9 @@ class IncParser(object):
                             #XXX can be made faster by providing more information in syntax tables
                             first_term = la.find_first_terminal(self.prev_version)
 
-                            lookup_symbol = self.get_lookup(first_term)
-                            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
+                            lookup_id = self.get_lookup_id(first_term)
+                            element = self.syntaxtable.lookup_id(self.current_state, lookup_id)
                             if isinstance(element, Reduce):
-                                logging.debug("OPT Reduce: %s", element)
                                 self.reduce(element)
                             else:
                                 la = self.left_breakdown(la)
@@ -293,7 +304,6 @@ class IncParser(object):
                         element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
 
                         if self.shiftable(la):
-                            logging.debug("\x1b[37mis shiftable\x1b[0m")
                             self.stack.append(la)
                             self.current_state = la.state
                             self.right_breakdown()
@@ -301,8 +311,9 @@ class IncParser(object):
                         else:
                             la = self.left_breakdown(la)
 
-    def parse_terminal(self, la, lookup_symbol):
-        """Lookup the current lookahead symbol in the syntax table and apply the received action."""
+    def parse_terminal(self, la, lookup_id):
+        """Lookup the current lookahead symbol (given by its id in the syntax
+        table) and apply the received action."""
         element = None
         if la.deleted:
             # Nodes are no longer removed from the tree. Instead "deleted" nodes
@@ -318,13 +329,14 @@ class IncParser(object):
         if isinstance(la, EOS):
             # This is needed so we can finish single line comments at the end of
             # the file
-            element = self.syntaxtable.lookup(self.current_state, Terminal("<eos>"))
+            element = self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.terminal_id("<eos>"))
             if isinstance(element, Shift):
                 self.current_state = element.action
                 return la
         if element is None:
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[34mparse_terminal\x1b[0m: %s in %s -> %s", lookup_symbol, self.current_state, element)
+            element = self.syntaxtable.lookup_id(self.current_state, lookup_id)
+        if self.tracer:
+            self.tracer("terminal", node=la, state=self.current_state, action=element)
         if isinstance(element, Accept):
             #XXX change parse so that stack is [bos, startsymbol, eos]
             bos = self.previous_version.parent.children[0]
@@ -334,25 +346,20 @@ class IncParser(object):
             eos.changed = False
             self.previous_version.parent.set_children([bos, self.stack[1], eos])
             self.previous_version.parent.changed = True
-            logging.debug("loopcount: %s", self.loopcount)
-            logging.debug ("\x1b[32mAccept\x1b[0m")
             return "Accept"
         elif isinstance(element, Shift):
             self.validating = False
+            self.stats.shifts += 1
             self.shift(la, element)
             la.local_error = la.nested_errors = False
             return self.pop_lookahead(la)
 
         elif isinstance(element, Reduce):
-            logging.debug("\x1b[33mReduce\x1b[0m: %s -> %s", la, element)
             self.reduce(element)
-            return la #self.parse_terminal(la, lookup_symbol)
+            return la #self.parse_terminal(la, lookup_id)
         elif element is None:
             if self.validating:
-                logging.debug("Was validating: Right breakdown and return to normal")
-                logging.debug("Before breakdown: %s", self.stack[-1])
                 self.right_breakdown()
-                logging.debug("After breakdown: %s", self.stack[-1])
                 self.validating = False
             else:
                 if self.autodetector and self.option_autolbox_find:
@@ -361,18 +368,20 @@ class IncParser(object):
                     else:
                         self.autodetector.detect_lbox(la)
                 self.error_nodes.append(la)
-                if self.rm.recover(la):
+                self.stats.isolations += 1
+                start = time.perf_counter()
+                recovered = self.rm.recover(la)
+                if not self.ooc:
+                    self.stats.times["recovery"] += time.perf_counter() - start
+                if recovered:
                     # recovered, continue parsing
                     self.refine(self.rm.iso_node, self.rm.iso_offset, self.rm.error_offset)
                     self.current_state = self.rm.new_state
                     self.rm.iso_node.isolated = la
                     self.rm.iso_node.deleted = False
                     self.stack.append(self.rm.iso_node)
-                    logging.debug("Recovered. Continue after %s", self.rm.iso_node)
                     return self.pop_lookahead(self.rm.iso_node)
-                logging.debug("Couldn't find a subtree to recover. Recovering the whole tree.")
-                logging.debug("\x1b[31mError\x1b[0m: %s %s %s", la, la.prev_term, la.next_term)
-                logging.debug("loopcount: %s", self.loopcount)
+                # Couldn't find a subtree to recover: recover the whole tree
 
                 error_offset = self.rm.offset(la, self.rm.previous_version)
                 iso_node = self.previous_version.parent
@@ -391,6 +400,15 @@ class IncParser(object):
             lookup_symbol = Terminal(lookup_symbol.name)
         return lookup_symbol
 
+    def get_lookup_id(self, la):
+        """Like `get_lookup`, but returns the symbol's id in the syntax table
+        without creating a new symbol."""
+        if la.lookup != "":
+            return self.syntaxtable.terminal_id(la.lookup)
+        if isinstance(la.symbol, IndentationTerminal):
+            return self.syntaxtable.terminal_id(la.symbol.name)
+        return self.syntaxtable.symbol_id(la.symbol)
+
     def isolate(self, node):
         if node.has_changes():# or node.has_errors():
             node.load(self.prev_version)
@@ -425,7 +443,9 @@ class IncParser(object):
     def refine(self, node, offset, error_offset):
         # for all children that come after the detection offset, we need
         # to analyse them using the normal incparser
-        logging.debug("    Refine %s Offset: %s Error Offset: %s", node, offset, error_offset)
+        if self.tracer:
+            self.tracer("refine", node=node, offset=offset, error_offset=error_offset)
+        start = time.perf_counter()
         retain_set = set()
         self.pass1(node, offset, error_offset, retain_set, offset)
         node.load(self.prev_version)
@@ -433,6 +453,8 @@ class IncParser(object):
         node.set_children(node.children) # reset sibling pointers
         node.local_error = node.nested_errors = False
         self.pass2(node, offset, error_offset, retain_set)
+        if not self.ooc:
+            self.stats.times["refine"] += time.perf_counter() - start
 
     def pass1 (self, node, offset, error_offset, retain_set, poffset):
         if offset > error_offset:
@@ -450,7 +472,7 @@ class IncParser(object):
     def pass2(self, node, offset, error_offset, retain_set):
         for c in node.children:
             if self.ooc and c is self.ooc[0]:
-                logging.debug("    Don't refine TempEOS nodes")
+                # Don't refine TempEOS nodes
                 return
             if offset > error_offset:
                 # XXX check if following terminal requires analysis
@@ -498,7 +520,8 @@ class IncParser(object):
     def retain_or_discard(self, node, parent, retain_set):
         if node in retain_set:
             retain_set.remove(node)
-            logging.debug("    Retaining %s (%s). Set parent to %s (%s) (%s)", node, id(node), parent, id(parent), "SAME" if parent is node.parent else "DIFF")
+            if self.tracer:
+                self.tracer("retain", node=node, parent=parent)
             # Might have been assigned to a different parent in current version
             # that was removed during refinement. This makes sure this node is
             # assigned to the right parent. See test_eco.py:Test_RetainSubtree
@@ -517,17 +540,19 @@ class IncParser(object):
         node.set_children(node.children) # reset links between children
 
     def out_of_context_analysis(self, node):
-        logging.debug("    Attempting out of context analysis on %s (%s)", node, id(node))
-
+        tracer = self.tracer
         if not node.children:
-            logging.debug("    Failed: Node has no children")
+            if tracer:
+                tracer("ooc", node=node, result="no children")
+            self.stats.isolations += 1
             self.isolate(node)
             return
 
         if not node.has_changes():
             if node.has_errors():
                 self.find_nested_error(node)
-            logging.debug("    Failed: Node has no changes")
+            if tracer:
+                tracer("ooc", node=node, result="no changes")
             return
 
         # check if subtree is followed by terminal requiring analysis
@@ -537,7 +562,9 @@ class IncParser(object):
             # XXX This should also include `follow.changed`, but since currently nodes
             # are marked as changed even if just their siblings or next_terms
             # are updated, this would fail for most out-of-context analyses
-            logging.debug("   Failed: Surrounding context has changed")
+            if tracer:
+                tracer("ooc", node=node, result="context changed")
+            self.stats.isolations += 1
             self.isolate(node)
             return
 
@@ -546,6 +573,9 @@ class IncParser(object):
         temp_parser.prev_version = self.prev_version
         temp_parser.reference_version = self.reference_version
         temp_parser.lang = self.lang
+        temp_parser.tracer = tracer
+        temp_parser.stats = self.stats
+        self.stats.ooc_attempts += 1
 
         oldname = node.symbol.name
         oldleft = node.left
@@ -572,12 +602,11 @@ class IncParser(object):
         # isolation nodes. Without this change we would calculate the offset
         # within the original parse tree and not the offset within the temporary
         # parse tree
-        node.log[("left", self.prev_version)] = temp_bos
-        node.log[("right", self.prev_version)] = temp_eos
+        node.log.set("left", self.prev_version, temp_bos)
+        node.log.set("right", self.prev_version, temp_eos)
 
-        logging.debug("    TempEOS: %s", temp_eos)
         temp_root = Node(Nonterminal("TempRoot"), 0, [temp_bos, node, temp_eos])
-        node.log[("parent", self.prev_version)] = temp_root
+        node.log.set("parent", self.prev_version, temp_root)
         temp_root.save(self.prev_version)
         temp_bos.next_term = node
         temp_bos.state = oldleft.state
@@ -600,10 +629,12 @@ class IncParser(object):
         self.error_pres.extend(temp_parser.error_pres)
         if temp_parser.last_status == False:
               # isolate
-              logging.debug("OOC analysis of %s failed. Error on %s.", node, temp_parser.error_nodes)
-              node.log[("left", self.prev_version)] = saved_left
-              node.log[("right", self.prev_version)] = saved_right
-              node.log[("parent", self.prev_version)] = saved_parent
+              if tracer:
+                  tracer("ooc", node=node, result="error")
+              node.log.set("left", self.prev_version, saved_left)
+              node.log.set("right", self.prev_version, saved_right)
+              node.log.set("parent", self.prev_version, saved_parent)
+              self.stats.isolations += 1
               self.isolate(node) # revert changes done during OOC
               if temp_parser.previous_version.parent.isolated:
                   # if during OOC parsing error recovery isolated the entire
@@ -616,19 +647,23 @@ class IncParser(object):
         newnode = temp_parser.stack[-1]
 
         if newnode.symbol.name != oldname:
-            logging.debug("OOC analysis resulted in different symbol: %s", newnode.symbol.name)
+            if tracer:
+                tracer("ooc", node=node, result="different symbol")
             # node is not the same: revert all changes!
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
+            node.log.set("left", self.prev_version, saved_left)
+            node.log.set("right", self.prev_version, saved_right)
+            node.log.set("parent", self.prev_version, saved_parent)
+            self.stats.isolations += 1
             self.isolate(node)
             return
 
         if newnode is not node:
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
-            logging.debug("OOC analysis resulted in different node but same symbol: %s", newnode.symbol.name)
+            node.log.set("left", self.prev_version, saved_left)
+            node.log.set("right", self.prev_version, saved_right)
+            node.log.set("parent", self.prev_version, saved_parent)
+            if tracer:
+                tracer("ooc", node=node, result="different node")
+            self.stats.ooc_successes += 1
             assert len(temp_parser.stack) == 2 # should only contain [EOS, node]
             i = oldparent.children.index(node)
             oldparent.children[i] = newnode
@@ -644,30 +679,30 @@ class IncParser(object):
             newnode.mark_changed() # why did I remove this?
             return
 
-        logging.debug("Subtree resulted in the same parse as before %s %s", newnode, node)
+        if tracer:
+            tracer("ooc", node=node, result="same node")
+        self.stats.ooc_successes += 1
         assert len(temp_parser.stack) == 2 # should only contain [EOS, node]
         node.parent = oldparent
         node.left = oldleft
         node.right = oldright
-        node.log[("left", self.prev_version)] = saved_left
-        node.log[("right", self.prev_version)] = saved_right
-        node.log[("parent", self.prev_version)] = saved_parent
+        node.log.set("left", self.prev_version, saved_left)
+        node.log.set("right", self.prev_version, saved_right)
+        node.log.set("parent", self.prev_version, saved_parent)
 
     def reduce(self, element):
         """Reduce elements on the stack to a non-terminal."""
 
         children = []
         i = 0
-        while i < element.amount():
+        while i < element.length:
             c = self.stack.pop()
             children.insert(0, c)
             i += 1
 
-        logging.debug("   Element on stack: %s(%s)", self.stack[-1].symbol, self.stack[-1].state)
         self.current_state = self.stack[-1].state #XXX don't store on nodes, but on stack
-        logging.debug("   Reduce: set state to %s (%s)", self.current_state, self.stack[-1].symbol)
 
-        goto = self.syntaxtable.lookup(self.current_state, element.action.left)
+        goto = self.syntaxtable.lookup_id(self.current_state, element.left_id)
         if goto is None:
             raise Exception("Reduction error on %s in state %s: goto is None" % (element, self.current_state))
         assert goto is not None
@@ -684,8 +719,10 @@ class IncParser(object):
                 c.mark_changed()
 
         reuse_parent = self.ambig_reuse_check(element.action.left, children)
+        stats = self.stats
+        stats.reductions += 1
         if not self.needs_reparse and reuse_parent:
-            logging.debug("   Reusing parent: %s (%s)", reuse_parent, id(reuse_parent))
+            stats.reused += 1
             new_node = reuse_parent
             new_node.changed = False
             new_node.deleted = False
@@ -695,16 +732,17 @@ class IncParser(object):
             new_node.state = goto.action # XXX need to save state using hisotry service
             new_node.mark_changed()
         else:
-            new_node = Node(element.action.left.copy(), goto.action, children)
-            logging.debug("   No reuse parent. Make new %s (%s)", new_node, id(new_node))
+            stats.created += 1
+            new_node = Node(element.action.left, goto.action, children)
         new_node.nested_errors = has_errors
         new_node.calc_textlength()
         new_node.position = self.stack[-1].position + self.stack[-1].textlen
-        logging.debug("   Add %s to stack and goto state %s", new_node.symbol, new_node.state)
         self.stack.append(new_node)
         new_node.exists = True
         self.current_state = new_node.state # = goto.action
-        logging.debug("Reduce: set state to %s (%s)", self.current_state, new_node.symbol)
+        if self.tracer:
+            self.tracer("reduce", production=element, node=new_node, state=self.current_state,
+                        reused=new_node is reuse_parent)
         if getattr(element.action.annotation, "interpret", None):
             # eco grammar annotations
             self.interpret_annotation(new_node, element.action)
@@ -761,7 +799,7 @@ class IncParser(object):
         previous.children = list(current.children)
         for c in current.children:
             c.parent = previous
-        previous.symbol.name = current.symbol.name
+        previous.symbol = current.symbol # interned, must not be renamed
         previous.changed = False
         previous.deleted = False
         previous.isolated = False
@@ -793,6 +831,24 @@ class IncParser(object):
             astnode = annotation.interpret(node)
             if not self.is_reusable_astnode(node.alternate, astnode):
                 node.alternate = astnode
+            if self.analysis_changes is not None:
+                self.analysis_changes.add(id(node.alternate))
+
+    def take_changes(self):
+        """Returns the ids of all AST nodes that have been built or reused
+        by reductions since the last call, or None if they are unknown.
+        Changes are only tracked after this has been called once."""
+        changes = self.analysis_changes
+        self.analysis_changes = set()
+        return changes
+
+    def restore_changes(self, changes):
+        """Adds changes returned by `take_changes` back, e.g. because the
+        analysis they were taken for was dropped."""
+        if changes is None or self.analysis_changes is None:
+            self.analysis_changes = None
+        else:
+            self.analysis_changes.update(changes)
 
     def is_reusable_astnode(self, old, new):
         from grammar_parser.bootstrap import AstNode, ListNode
@@ -819,6 +875,7 @@ class IncParser(object):
             return False
 
     def left_breakdown(self, la):
+        self.stats.left_breakdowns += 1
         la.exists = False
         if len(la.children) > 0:
             return la.children[0]
@@ -826,13 +883,15 @@ class IncParser(object):
             return self.pop_lookahead(la)
 
     def right_breakdown(self):
+        self.stats.right_breakdowns += 1
         node = self.stack.pop() # optimistically shifted Nonterminal
         node.exists = False
         # after the breakdown, we need to properly shift the left over terminal
         # using the (correct) current state from before the optimistic shift of
         # it's parent tree
         self.current_state = self.stack[-1].state
-        logging.debug("right breakdown(%s): set state to %s", node.symbol.name, self.current_state)
+        if self.tracer:
+            self.tracer("breakdown", node=node, state=self.current_state)
         while(isinstance(node.symbol, Nonterminal)):
             # Right_breakdown reverts wrong optimistic shifts including
             # subsequent reductions. These reductions may contain nodes that
@@ -870,15 +929,14 @@ class IncParser(object):
                 node.exists = True
                 return
             else:
-                logging.debug("right breakdown else: set state to %s", self.stack[-1].state)
                 self.current_state = self.stack[-1].state
         self.shift(node, rb=True) # pushes previously popped terminal back on stack
 
     def shift(self, la, element=None, rb=False):
         if not element:
-            lookup_symbol = self.get_lookup(la)
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[32m" + "%sShift(%s)" + "\x1b[0m" + ": %s -> %s", "rb" if rb else "", self.current_state, la, element)
+            element = self.syntaxtable.lookup_id(self.current_state, self.get_lookup_id(la))
+        if self.tracer:
+            self.tracer("shift", node=la, state=self.current_state, action=element, rb=rb)
         la.state = element.action
         la.exists = True
         la.position = self.stack[-1].position + self.stack[-1].textlen
@@ -901,7 +959,7 @@ class IncParser(object):
         return node.right_sibling(self.prev_version)
 
     def shiftable(self, la):
-        if self.syntaxtable.lookup(self.current_state, la.symbol):
+        if self.syntaxtable.lookup_id(self.current_state, self.syntaxtable.symbol_id(la.symbol)):
             return True
         return False
 
@@ -957,11 +1015,14 @@ class IncParser(object):
         self.validating = False
         self.last_status = False
         tmp = self.previous_version.parent.name
+        self.analysis_changes = None
         self.previous_version = None
         self.init_ast()
         self.previous_version.parent.name = tmp
 
     def load_status(self, version):
+        # Loading a version changes the tree without parsing it
+        self.analysis_changes = None
         try:
             self.last_status = self.status_by_version[version]
         except KeyError:
@@ -22,7 +22,7 @@
 from grammar_parser.gparser import Parser, Nonterminal, Terminal
 from .syntaxtable import SyntaxTable, FinishSymbol, Reduce, Goto, Accept, Shift
 from .stategraph import StateGraph
-from .constants import LR0, LALR
+from .constants import LR0
 from .astree import AST, Node
 
 class LRParser(object):
@@ -34,9 +34,6 @@ class LRParser(object):
         self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
         self.graph.build()
 
-        if lr_type == LALR:
-            self.graph.convert_lalr()
-
         self.syntaxtable = SyntaxTable(lr_type)
         self.syntaxtable.build(self.graph)
 
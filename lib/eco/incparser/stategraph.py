@@ -21,217 +21,400 @@
 
 
 
-from .state import StateSet, State, LR0Element
+from .state import StateSet, LR0Element
 from .production import Production
 from .helpers import Helper
 from .syntaxtable import FinishSymbol
-from grammar_parser.gparser import Terminal
-from .constants import LR0, LR1, LALR
+from grammar_parser.gparser import Nonterminal, Epsilon
+from .constants import LR0, LALR
 from time import time
 import logging
 
+epsilon = Epsilon()
+
+class LRItems(object):
+    """Integer encoding of the LR items of a grammar.
+
+    Every production gets an id and occupies `len(right) + 1` consecutive
+    item numbers, one for each position of the dot, so an item is an integer
+    and moving the dot over a symbol adds one to it. For every item the next
+    symbol and FIRST of the symbols following the next symbol are
+    precomputed. Terminals are numbered as well (the end of file being 0),
+    which allows to store sets of lookaheads as bitmasks.
+
+    Productions are created lazily, the first time a closure reaches their
+    nonterminal."""
+
+    def __init__(self, start_symbol, grammar):
+        self.grammar = grammar
+        self.helper = Helper(grammar)
+        self.productions = []
+        self.item_production = []
+        self.item_dot = []
+        self.item_next = []
+        self.item_first = []
+        self.item_nullable = []
+        self.starts = {}
+        self.known = {}
+        self.terminals = [FinishSymbol()]
+        self.terminal_bits = {FinishSymbol(): 1}
+        self.add_production(Production(None, [start_symbol]))
+        self.closures = {}
+        self.masks = {}
+
+    def terminal_bit(self, symbol):
+        try:
+            return self.terminal_bits[symbol]
+        except KeyError:
+            bit = self.terminal_bits[symbol] = 1 << len(self.terminals)
+            self.terminals.append(symbol)
+            return bit
+
+    def first(self, symbol):
+        """Returns FIRST of `symbol` as a bitmask and whether `symbol` is
+        nullable."""
+        if isinstance(symbol, Nonterminal):
+            mask = 0
+            nullable = False
+            for s in self.helper.first(symbol):
+                if isinstance(s, Epsilon):
+                    nullable = True
+                else:
+                    mask |= self.terminal_bit(s)
+            return mask, nullable
+        if isinstance(symbol, Epsilon):
+            return 0, True
+        return self.terminal_bit(symbol), False
+
+    def add_production(self, production):
+        """Adds the items of `production` and returns its first item."""
+        start = len(self.item_production)
+        right = production.right
+        pid = len(self.productions)
+        self.productions.append(production)
+        self.item_production.extend([pid] * (len(right) + 1))
+        self.item_dot.extend(range(len(right) + 1))
+        self.item_next.extend(right)
+        self.item_next.append(None)
+        # FIRST of the suffixes, from the back
+        firsts = [0]
+        nullables = [True]
+        mask, nullable = 0, True
+        for symbol in reversed(right[1:]):
+            f, n = self.first(symbol)
+            mask = f | mask if n else f
+            nullable = nullable and n
+            firsts.append(mask)
+            nullables.append(nullable)
+        firsts.reverse()
+        nullables.reverse()
+        self.item_first.extend(firsts)
+        self.item_nullable.extend(nullables)
+        self.item_first.append(0)
+        self.item_nullable.append(True)
+        if right == [epsilon]:
+            return start + 1
+        return start
+
+    def get_starts(self, symbol):
+        """Returns the items with the dot at the beginning of all productions
+        of `symbol`."""
+        try:
+            return self.starts[symbol]
+        except KeyError:
+            pass
+        rule = self.grammar[symbol]
+        starts = []
+        for i, a in enumerate(rule.alternatives):
+            if a == []:
+                a = [epsilon]
+            key = (symbol, tuple(a))
+            if key in self.known: # same alternative twice
+                continue
+            p = Production(symbol, a, rule.annotations[i], rule.precs[i])
+            if i in rule.inserts:
+                insert = rule.inserts[i]
+                p.inserts[insert[0]] = insert[1]
+            self.known[key] = item = self.add_production(p)
+            starts.append(item)
+        starts = self.starts[symbol] = tuple(starts)
+        return starts
+
+    def closure(self, kernel):
+        """Returns the closure of the kernel `kernel`, a sorted tuple of
+        items, as `(items, nonterminals, slots, gotos)`. Results are cached.
+
+        `items` starts with the kernel items, which are followed by the items
+        added by the closure. All items added for the same nonterminal have
+        the same lookahead, which consists of the terminals in `spontaneous`
+        and the lookaheads of the kernel items listed in `sources` for the
+        entry `(spontaneous, sources)` of the nonterminal in `nonterminals`.
+        `slots` maps the added items to their nonterminal. `gotos` is a list
+        of `(symbol, kernel, origins)` giving the kernel reached by `symbol`
+        and for every item in it the index of the item it came from."""
+        try:
+            return self.closures[kernel]
+        except KeyError:
+            pass
+        item_next = self.item_next
+        item_first = self.item_first
+        item_nullable = self.item_nullable
+        ids = {}
+        order = []
+        spontaneous = []
+        sources = []
+        preds = []
+        def reach(symbol):
+            try:
+                return ids[symbol]
+            except KeyError:
+                ids[symbol] = i = len(order)
+                order.append(symbol)
+                spontaneous.append(0)
+                sources.append(0)
+                preds.append(set())
+                return i
+        for k, item in enumerate(kernel):
+            symbol = item_next[item]
+            if isinstance(symbol, Nonterminal):
+                i = reach(symbol)
+                spontaneous[i] |= item_first[item]
+                if item_nullable[item]:
+                    sources[i] |= 1 << k
+        items = list(kernel)
+        slots = []
+        j = 0
+        while j < len(order):
+            for item in self.get_starts(order[j]):
+                items.append(item)
+                slots.append(j)
+                symbol = item_next[item]
+                if isinstance(symbol, Nonterminal):
+                    i = reach(symbol)
+                    spontaneous[i] |= item_first[item]
+                    if item_nullable[item]:
+                        preds[i].add(j)
+            j += 1
+        # lookaheads flow along nullable suffixes
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(order)):
+                for j in preds[i]:
+                    s = spontaneous[i] | spontaneous[j]
+                    k = sources[i] | sources[j]
+                    if s != spontaneous[i] or k != sources[i]:
+                        spontaneous[i] = s
+                        sources[i] = k
+                        changed = True
+        nonterminals = []
+        for s, k in zip(spontaneous, sources):
+            nonterminals.append((s, tuple(i for i in range(len(kernel)) if k >> i & 1)))
+
+        targets = {}
+        for i, item in enumerate(items):
+            symbol = item_next[item]
+            if symbol is not None:
+                targets.setdefault(symbol, []).append((item + 1, i))
+        gotos = []
+        for symbol, target in targets.items():
+            target.sort()
+            gotos.append((symbol, tuple(t[0] for t in target), tuple(t[1] for t in target)))
+
+        result = self.closures[kernel] = (tuple(items), nonterminals, slots, gotos)
+        return result
+
+    def lookaheads(self, kernel, lookaheads):
+        """Returns the lookaheads of all items in the closure of `kernel`
+        given the lookaheads of the kernel items."""
+        _, nonterminals, slots, _ = self.closure(kernel)
+        las = []
+        for spontaneous, sources in nonterminals:
+            for k in sources:
+                spontaneous |= lookaheads[k]
+            las.append(spontaneous)
+        result = list(lookaheads)
+        result.extend([las[i] for i in slots])
+        return result
+
+    def symbols(self, mask):
+        """Converts a bitmask of terminals back into a set."""
+        try:
+            return set(self.masks[mask])
+        except KeyError:
+            pass
+        result = []
+        m = mask
+        while m:
+            bit = m & -m
+            result.append(self.terminals[bit.bit_length() - 1])
+            m ^= bit
+        self.masks[mask] = result = frozenset(result)
+        return set(result)
+
 class StateGraph(object):
+    """Builds the LR automaton of a grammar.
+
+    With `lr_type` LR1 states whose kernels only differ in lookaheads are
+    merged if they are weakly compatible (Pager's method), which results in
+    LR(1) tables that are often as small as LALR(1) tables. With LALR all
+    states with the same kernel are merged and the lookaheads are propagated
+    through the resulting LR(0) automaton, which is faster and never results
+    in more states, but may introduce reduce/reduce conflicts. With LR0
+    lookaheads are ignored. After `build`, `state_sets` contains the closures
+    of all states, and `edges` maps `(state, symbol)` to the following state.
+    """
+
+    # Part of the key of cached graphs: must be increased whenever the
+    # pickled graph changes (see incparser/cache.py)
+    FORMAT = 2
 
     def __init__(self, start_symbol, grammar, lr_type=0):
         self.grammar = grammar
         self.start_symbol = start_symbol
+        self.lr_type = lr_type
         self.state_sets = []
         self.edges = {}
-        self.ids = {}
-        self.todo = []
-        self.done = set()
-        self.maybe_compatible = {}
-
-        self.goto_time = 0
-        self.add_time = 0
-        self.closure_time = 0
-        self.closure_count = 0
-        self.addcount = 0
-        self.weakly = 0
-        self.weakly_count = 0
-        self.mergetime = 0
-
-        helper = Helper(grammar)
-        self.helper = helper
-        if lr_type == LR0:
-            self.closure = helper.closure_0
-            self.goto = helper.goto_0
-            self.start_set = StateSet([LR0Element(Production(None, [self.start_symbol]), 0)])
-        elif lr_type == LR1 or lr_type == LALR:
-            self.closure = helper.closure_1
-            self.goto = helper.goto_1
-            self.start_set = StateSet()
-            self.start_set.add(LR0Element(Production(None, [self.start_symbol]), 0), set([FinishSymbol()]))
 
     def build(self):
-        State._hashtime = 0
         start = time()
-        start_set = self.start_set
-        closure = start_set
-        self.state_sets.append(closure)
-        self.ids[closure] = 0
-        _id = 0
-        self.todo.append(_id)
+        items = LRItems(self.start_symbol, self.grammar)
+        self.kernels = []
+        self.lookaheads = []
+        self.by_kernel = {}
+        self.todo = []
+        self.done = set()
+        # without lookaheads all states with the same kernel are merged. For
+        # LALR the lookaheads are computed afterwards.
+        lr0 = self.lr_type in (LR0, LALR)
+        self.add(None, None, (0,), (0,) if lr0 else (1,))
         while self.todo:
-            self.addcount += 1
             _id = self.todo.pop()
             self.done.add(_id)
-            closure_start = time()
-            state_set = self.closure(self.state_sets[_id])
-            self.closure_count += 1
-            closure_end = time()
-            self.closure_time += closure_end - closure_start
-            new_gotos = {}
-            goto_start = time()
-            # create new sets first, then calculate closure
-            for lrelement in state_set.elements:
-                symbol = lrelement.next_symbol()
-                if not symbol: # state is final
-                    continue
-                #XXX optimisation: create all configurations before building
-                new_element = lrelement.clone()
-                new_element.d += 1
-                new_element_la = state_set.get_lookahead(lrelement)
-                stateset = new_gotos.setdefault(symbol, StateSet())
-                stateset.add(new_element, new_element_la)
-
-            # now calculate closure and add result to state_sets
-            goto_end = time()
-            self.goto_time += goto_end - goto_start
-
-            for ss in new_gotos:
-                new_state_set = new_gotos[ss]
-                add_start = time()
-                self.add(_id, ss, new_state_set)
-                add_end = time()
-                self.add_time += add_end - add_start
-
-        end = time()
-        logging.info("add time %s", self.add_time)
-        logging.info("closure time %s", self.closure_time)
-        logging.info("closure time helper %s", self.helper.closure_time)
-        logging.info("goto time %s", self.goto_time)
-        logging.info("hashtime %s", StateSet._hashtime)
-        logging.info("addcount %s", self.addcount)
-        logging.info("states %s", len(self.state_sets))
-        logging.info("weakly %s", self.weakly)
-        logging.info("weakly count %s", self.weakly_count)
-        logging.info("mergetime %s", self.mergetime)
-
-        # apply closure
-        logging.info("Apply closure to states")
-        clstart = time()
-        new_state_sets = []
-        new_ids = {}
-        for state in self.state_sets:
-            _id = self.ids[state]
-            new_state = self.closure(state)
-            new_state_sets.append(new_state)
-            new_ids[new_state] = new_state
-        self.state_sets = new_state_sets
-        logging.info("after closure %s", len(new_state_sets))
-        logging.info("edges %s", len(set(self.edges.values())))
-        self.ids = new_ids
-        logging.info(time() - clstart)
-
-        logging.info("Finished building Stategraph in %s", end-start)
-        self.closure = None
-        self.goto = None
-
-    def weakly_compatible(self, s1, s2):
-        self.weakly_count += 1
-        core = s1.elements
-        if core != s2.elements:
-            return False
-        if len(core) == 1:
+            kernel = self.kernels[_id]
+            if lr0:
+                for symbol, target, _ in items.closure(kernel)[3]:
+                    self.add(_id, symbol, target, (0,) * len(target))
+                continue
+            las = items.lookaheads(kernel, self.lookaheads[_id])
+            for symbol, target, origins in items.closure(kernel)[3]:
+                self.add(_id, symbol, target, tuple([las[i] for i in origins]))
+        if self.lr_type == LALR:
+            self.propagate(items)
+            lr0 = False
+        logging.info("Built %s states from %s kernels in %s", len(self.kernels), len(items.closures), time() - start)
+
+        # create the closures of all states
+        elements = {}
+        productions = items.productions
+        for kernel, las in zip(self.kernels, self.lookaheads):
+            state_set = StateSet()
+            for item, la in zip(items.closure(kernel)[0], items.lookaheads(kernel, las)):
+                try:
+                    element = elements[item]
+                except KeyError:
+                    element = elements[item] = LR0Element(productions[items.item_production[item]], items.item_dot[item])
+                state_set.add(element, set() if lr0 else items.symbols(la))
+            self.state_sets.append(state_set)
+        logging.info("Finished building Stategraph in %s", time() - start)
+        del self.kernels, self.lookaheads, self.by_kernel, self.todo, self.done
+
+    def propagate(self, items):
+        """Computes the LALR(1) lookaheads of the kernel items of the LR(0)
+        automaton by propagating them along the goto edges (see the dragon
+        book, section 4.7.5).
+
+        Every kernel item of every state gets a node. A kernel item reached
+        via a goto gets lookaheads generated spontaneously by the closure of
+        the state the goto comes from, and the lookaheads of the kernel items
+        of that state from which they propagate. The latter are recorded as
+        links between nodes, along which lookaheads are pushed until nothing
+        changes."""
+        offsets = []
+        n = 0
+        for kernel in self.kernels:
+            offsets.append(n)
+            n += len(kernel)
+        las = [0] * n
+        links = [[] for _ in range(n)]
+        las[0] = items.terminal_bit(FinishSymbol())
+        for _id, kernel in enumerate(self.kernels):
+            offset = offsets[_id]
+            size = len(kernel)
+            _, nonterminals, slots, gotos = items.closure(kernel)
+            for symbol, _, origins in gotos:
+                target = offsets[self.edges[(_id, symbol)]]
+                for j, origin in enumerate(origins):
+                    if origin < size:
+                        links[offset + origin].append(target + j)
+                    else:
+                        spontaneous, sources = nonterminals[slots[origin - size]]
+                        las[target + j] |= spontaneous
+                        for k in sources:
+                            links[offset + k].append(target + j)
+        todo = [i for i in range(n) if las[i] and links[i]]
+        while todo:
+            i = todo.pop()
+            la = las[i]
+            for j in links[i]:
+                if la & ~las[j]:
+                    las[j] |= la
+                    if links[j]:
+                        todo.append(j)
+        for _id, kernel in enumerate(self.kernels):
+            self.lookaheads[_id] = tuple(las[offsets[_id]:offsets[_id] + len(kernel)])
+
+    def weakly_compatible(self, las1, las2):
+        """Checks if two states with the same kernel, whose items have the
+        lookaheads `las1` and `las2`, can be merged without introducing
+        reduce/reduce conflicts."""
+        n = len(las1)
+        if n == 1 or las1 == las2:
             return True
-        self.weakly -= time()
-        core = list(core)
-        for i in range(0, len(core)-1):
-            I = core[i]
-            for j in range(i+1, len(core)):
-                J = core[j]
-                if ((s1.lookaheads[I] & s2.lookaheads[J] or s1.lookaheads[J] & s2.lookaheads[I])
-                    and not s1.lookaheads[I] & s1.lookaheads[J]
-                    and not s2.lookaheads[I] & s2.lookaheads[J]):
-                    self.weakly += time()
+        # only items sharing a lookahead with another item after merging can
+        # be incompatible
+        seen = shared = 0
+        for I1, I2 in zip(las1, las2):
+            union = I1 | I2
+            shared |= seen & union
+            seen |= union
+        if not shared:
+            return True
+        candidates = [i for i in range(n) if (las1[i] | las2[i]) & shared]
+        for x in range(len(candidates) - 1):
+            i = candidates[x]
+            I1 = las1[i]
+            I2 = las2[i]
+            for j in candidates[x + 1:]:
+                if ((I1 & las2[j] or las1[j] & I2)
+                    and not I1 & las1[j]
+                    and not I2 & las2[j]):
                     return False
-        self.weakly += time()
         return True
 
-    def find_stateset_without_lookahead(self, state_set):
-        for ss in self.state_sets:
-            if state_set.equals(ss, True):
-                return ss
-        return None
-
-    def merge_lookahead(self, old, new):
-        self.mergetime -= time()
-        changed = False
-        for element in new.elements:
-            la1 = new.get_lookahead(element)
-            la2 = old.get_lookahead(element)
-            if la1 - la2:
-                changed = True
-                new_la = la2 | la1
-                old.lookaheads[element] = new_la
-
-        self.mergetime += time()
-        return changed
-
-    def add(self, from_id, symbol, state_set):
+    def add(self, from_id, symbol, kernel, las):
         merged = False
-        #for candidate in self.state_sets: # only check states that can be reached by symbol
-        for _id in self.maybe_compatible.setdefault(symbol,set()):
-            candidate = self.state_sets[_id]
-            if self.weakly_compatible(state_set, candidate):
-                # merge them
+        candidates = self.by_kernel.setdefault(kernel, [])
+        for _id in candidates:
+            old = self.lookaheads[_id]
+            if self.weakly_compatible(las, old):
                 merged = True
-                changed = self.merge_lookahead(candidate, state_set)
+                new = tuple([a | b for a, b in zip(old, las)])
+                if new != old:
+                    self.lookaheads[_id] = new
+                    if _id in self.done:
+                        self.todo.append(_id)
+                        self.done.remove(_id)
                 self.edges[(from_id, symbol)] = _id
-                if changed and _id in self.done:
-                    # move state to todo list
-                    self.todo.append(_id) #XXX only need to to that if this state is already done (moving not necessary if it hasn't been looked at anyway (e.g. state at the end of list)
-                    self.done.remove(_id)
 
         if not merged:
-            # add normally and put on todo list
-            self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.edges[(from_id, symbol)] = _id
-            self.ids[state_set] = _id
+            _id = len(self.kernels)
+            self.kernels.append(kernel)
+            self.lookaheads.append(las)
+            candidates.append(_id)
             self.todo.append(_id)
-
-            # add to maybe compatible
-            mc = self.maybe_compatible.setdefault(symbol, set())
-            mc.add(_id)
-
-    def oldadd(self, from_id, symbol, state_set):
-        # LALR way
-       #ss = self.find_stateset_without_lookahead(state_set)
-       #if ss:
-       #    #print("found existing stateset -> merging")
-       #    #print(ss)
-       #    #print(state_set)
-       #    self.merge_lookahead(ss, state_set)
-       #    _id = self.state_sets.index(ss)
-       #else:
-       #    self.state_sets.append(state_set)
-       #    _id = len(self.state_sets)-1
-       #self.edges[(from_id, symbol)] = _id
-
-        # normal LR(1) way
-        add_start = time()
-        _id = self.ids.get(state_set)
-        if _id is None: # new state
-            self.addcount += 1
-            self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.ids[state_set] = _id
-            self.todo.append(_id)
-        self.edges[(from_id, symbol)] = _id
-        add_end = time()
-        self.add_time += add_end - add_start
+            if from_id is not None:
+                self.edges[(from_id, symbol)] = _id
 
     def follow(self, from_id, symbol):
         try:
@@ -248,34 +431,3 @@ class StateGraph(object):
 
     def get_state_set(self, i):
         return self.state_sets[i]
-
-    def convert_lalr(self):
-        removelist = set([])
-        l = len(self.state_sets)
-        for i in range(l):
-            if i in removelist:
-                continue
-            for j in range(l):
-                if j in removelist:
-                    continue
-                s1 = self.state_sets[i]
-                s2 = self.state_sets[j]
-                if s1 is not s2 and s1.equals(s2, False):
-                    for e in s2:
-                        s1.add(e) # this should automatically merge the lookahead of the states
-                    s1.merge()
-                    for key in self.edges:
-                        fromid, symbol = key
-                        to = self.edges[key]
-                        if fromid == j:
-                            fromid == i
-                        if to == j:
-                            to == i
-                        self.edges.pop(key)
-                        self.edges[(fromid, symbol)] = to
-                    removelist.add(j)
-        l = list(removelist)
-        l.sort()
-        l.reverse()
-        for j in l:
-            self.state_sets.pop(j)
@@ -0,0 +1,76 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Statistics about incremental parses.
+
+Every call of `IncParser.inc_parse` starts a new ParseStats object, which is
+stored in the parser's `stats` attribute and counts the work done by the
+parse. The parsers used for out-of-context analyses count into the stats of
+the parse that started them. Counters:
+
+  lookaheads        nodes processed by the parser's main loop
+  shifts            terminals shifted (excluding right breakdowns)
+  optshifts         nonterminals shifted optimistically
+  left_breakdowns   nonterminals broken down into their children
+  right_breakdowns  optimistic shifts that had to be reverted
+  reductions        reductions (reused + created)
+  reused            reductions that reused a node of the previous tree
+  created           reductions that created a new node
+  ooc_attempts      subtrees reparsed out of context
+  ooc_successes     out-of-context analyses that kept the subtree
+  isolations        subtrees isolated due to errors
+
+The wall time of each phase is stored in `times` (in seconds): "parse" is
+the time of the whole parse, which includes the time spent in error
+"recovery" and in the "refine"ment of isolated subtrees (which in turn
+includes out-of-context analyses). TreeManager adds the time spent reusing
+AST nodes top down ("reuse") and saving versions of the tree ("save")."""
+
+COUNTERS = ("lookaheads", "shifts", "optshifts", "left_breakdowns",
+            "right_breakdowns", "reductions", "reused", "created",
+            "ooc_attempts", "ooc_successes", "isolations")
+
+PHASES = ("parse", "recovery", "refine", "reuse", "save")
+
+class ParseStats(object):
+
+    def __init__(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.times = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, other):
+        """Adds the counters and times of `other` to these stats."""
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase in PHASES:
+            self.times[phase] += other.times[phase]
+
+    def as_dict(self):
+        d = dict((name, getattr(self, name)) for name in COUNTERS)
+        d["times"] = dict(self.times)
+        return d
+
+    def __str__(self):
+        counters = " ".join("%s=%s" % (name, getattr(self, name)) for name in COUNTERS)
+        times = " ".join("%s=%.2fms" % (phase, self.times[phase] * 1000) for phase in PHASES)
+        return "%s %s" % (counters, times)
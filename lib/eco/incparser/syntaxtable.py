@@ -19,8 +19,11 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import re
+from array import array
+
 from .production import Production
-from grammar_parser.gparser import Terminal, Nonterminal, Epsilon
+from grammar_parser.gparser import Terminal, Nonterminal, Epsilon, SymbolTable
 from .constants import LR0, LR1, LALR
 
 class SyntaxTableElement(object):
@@ -67,6 +70,17 @@ class Accept(SyntaxTableElement):
         self.action = None
 
 class SyntaxTable(object):
+    """LR syntax table.
+
+    `self.table` is a list (indexed by state) of dictionaries mapping symbols
+    to actions. Since hashing symbols is expensive and happens for every
+    token during parsing, `compile` additionally packs the table into integer
+    arrays using row displacement: every symbol is interned to a small
+    integer id and the action for (state, id) is found at index
+    `base[state] + id` of `value`, if `check` at that index holds the row of
+    `state`. Parsers should map symbols to ids once (`symbol_id`,
+    `terminal_id`) and then use `lookup_id`.
+    """
 
     def __init__(self, prod_ids, lr_type=LR0):
         self.lr_type = lr_type
@@ -111,6 +125,122 @@ class SyntaxTable(object):
                         self.table[i][s] = action
                     else:
                         del self.table[i][s]
+        self.compile()
+
+    def compile(self):
+        """Interns all symbols of the table and packs the actions into
+        integer arrays."""
+        # id 0 is reserved for FinishSymbol which equals all of its instances
+        self.symboltable = SymbolTable()
+        self.symboltable.intern(FinishSymbol())
+        intern = self.symboltable.intern
+        self.table = [dict((intern(s), a) for s, a in row.items()) for row in self.table]
+        self.symbols = self.symboltable.symbols
+        self.symbol_ids = {}
+        for symbol in self.symbols[1:]:
+            self.symbol_ids.setdefault(symbol.__class__, {})[symbol.name] = symbol.id
+        self.terminal_ids = self.symbol_ids.setdefault(Terminal, {})
+        self.nonterminal_ids = self.symbol_ids.setdefault(Nonterminal, {})
+
+        self.actions = []
+        rowids = {}
+        rows = []
+        self.rowids = array("i", [0] * len(self.table))
+        for state, row in enumerate(self.table):
+            # states with identical actions share a row
+            key = []
+            for symbol, element in row.items():
+                action = id(element.action) if isinstance(element, Reduce) else element.action
+                key.append((self.symbol_id(symbol), element.__class__, action))
+            key = tuple(sorted(key, key=lambda k: k[0]))
+            if key not in rowids:
+                rowids[key] = len(rows)
+                entries = []
+                for symbol, element in row.items():
+                    if isinstance(element, Reduce):
+                        element.length = element.amount()
+                        element.action.left = intern(element.action.left)
+                        element.left_id = element.action.left.id
+                    entries.append((self.symbol_id(symbol), len(self.actions)))
+                    self.actions.append(element)
+                rows.append(sorted(entries))
+            self.rowids[state] = rowids[key]
+
+        # place densest rows first, each at the lowest displacement where it
+        # doesn't overlap with previously placed rows. The search is done by
+        # matching a bytes pattern of the row against the occupied slots.
+        self.base = array("i", [0] * len(rows))
+        slack = len(self.symbols)
+        occupied = bytearray(slack)
+        check = array("i", [-1] * slack)
+        value = array("i", [0] * slack)
+        for rowid in sorted(range(len(rows)), key=lambda r: -len(rows[r])):
+            entries = rows[rowid]
+            if not entries:
+                continue
+            first = entries[0][0]
+            pattern = [b"\\x00"]
+            for (prev, _), (sid, _) in zip(entries, entries[1:]):
+                if sid - prev > 1:
+                    pattern.append(b".{%d}" % (sid - prev - 1))
+                pattern.append(b"\\x00")
+            m = re.compile(b"".join(pattern), re.DOTALL).search(occupied, first)
+            offset = m.start() - first
+            end = offset + entries[-1][0] + 1
+            if end + slack > len(occupied):
+                grow = end + slack - len(occupied)
+                occupied.extend(bytearray(grow))
+                check.extend([-1] * grow)
+                value.extend([0] * grow)
+            self.base[rowid] = offset
+            for sid, a in entries:
+                occupied[offset + sid] = 1
+                check[offset + sid] = rowid
+                value[offset + sid] = a
+        while check and check[-1] == -1:
+            check.pop()
+        self.check = check
+        self.value = value[:len(check)]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "symboltable" not in state and "table" in state:
+            # pickled by an older version of Eco
+            self.compile()
+
+    def symbol_id(self, symbol):
+        """Returns the interned id of `symbol` or -1 if it doesn't appear in
+        this table."""
+        if symbol.__class__ is FinishSymbol:
+            return 0
+        i = symbol.id
+        if 0 <= i < len(self.symbols) and self.symbols[i] is symbol:
+            return i
+        try:
+            return self.symbol_ids[symbol.__class__][symbol.name]
+        except KeyError:
+            return -1
+
+    def terminal_id(self, name):
+        """Returns the id of `Terminal(name)` without creating the symbol."""
+        return self.terminal_ids.get(name, -1)
+
+    def terminal(self, name):
+        """Returns the interned `Terminal(name)`, or a new terminal if `name`
+        is not part of this table."""
+        i = self.terminal_ids.get(name, -1)
+        if i >= 0:
+            return self.symbols[i]
+        return Terminal(name)
+
+    def lookup_id(self, state_id, symbol_id):
+        if symbol_id < 0:
+            return None
+        rowid = self.rowids[state_id]
+        pos = self.base[rowid] + symbol_id
+        if pos < len(self.check) and self.check[pos] == rowid:
+            return self.actions[self.value[pos]]
+        return None
 
     def resolve_conflict(self, state, symbol, oldaction, newaction, precedences):
         # input: old_action, lookup_symbol, new_action
@@ -196,7 +326,4 @@ class SyntaxTable(object):
         return None
 
     def lookup(self, state_id, symbol):
-        try:
-            return self.table[state_id][symbol]
-        except KeyError:
-            return None
+        return self.lookup_id(state_id, self.symbol_id(symbol))
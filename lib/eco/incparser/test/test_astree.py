@@ -0,0 +1,132 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from incparser.astree import TextNode, NodeHistory, BOS, EOS
+from grammar_parser.gparser import Terminal, Nonterminal
+from incparser.syntaxtable import FinishSymbol
+
+class Test_NodeHistory(object):
+
+    def setup_method(self, method):
+        self.a = TextNode(Terminal("a"))
+        self.b = TextNode(Terminal("b"))
+        self.root = TextNode(Nonterminal("Root"), 0, [self.a])
+
+    def test_save_load(self):
+        self.root.save(1)
+        self.a.save(1)
+        self.root.set_children([self.a, self.b])
+        self.root.changed = True
+        self.root.save(4)
+        assert self.root.get_attr("children", 3) == [self.a]
+        assert self.root.get_attr("children", 4) == [self.a, self.b]
+        assert self.root.get_attr("children", 10) == [self.a, self.b]
+        assert self.root.get_attr("version", 3) == 1
+        self.root.load(2)
+        assert self.root.children == [self.a]
+        assert self.root.changed is False
+        assert self.root.version == 1
+
+    def test_missing_version(self):
+        self.a.save(3)
+        try:
+            self.a.get_attr("parent", 2)
+            assert False
+        except AttributeError:
+            pass
+
+    def test_text(self):
+        self.a.save(1)
+        self.a.symbol.name = "abc"
+        self.a.save(2)
+        assert self.a.get_text(1) == "a"
+        assert self.a.get_text(5) == "abc"
+        self.a.load(1)
+        assert self.a.symbol.name == "a"
+
+    def test_shared_records(self):
+        self.root.save(1)
+        self.root.save(2)
+        log = self.root.log
+        assert list(log.versions) == [1, 2]
+        assert log.records[0] is log.records[1]
+        self.root.changed = True
+        self.root.save(3)
+        assert log.records[2] is not log.records[1]
+        assert log.records[2][0] is log.records[1][0] # children
+
+    def test_new(self):
+        self.a.save(2)
+        assert self.a.is_new(2)
+        self.a.save(3)
+        assert not self.a.is_new(3)
+
+    def test_set_and_truncate(self):
+        self.a.save(1)
+        self.a.log.set("left", 3, self.b)
+        assert self.a.get_attr("left", 2) is None
+        assert self.a.get_attr("left", 3) is self.b
+        assert self.a.get_attr("parent", 3) is self.root
+        self.a.log.truncate(2)
+        assert self.a.get_attr("left", 3) is None
+        assert self.a.log.latest() == 1
+
+    def test_delete_version(self):
+        self.a.save(1)
+        self.a.save(2)
+        self.a.delete_version(2)
+        assert self.a.max_version == 1
+        assert not self.a.log.has_version(2)
+        assert ("parent", 1) in self.a.log
+        assert self.a.log[("parent", 1)] is self.root
+
+class Test_Offsets(object):
+
+    def setup_method(self, method):
+        self.a = TextNode(Terminal("ab"))
+        self.b = TextNode(Terminal(""))
+        self.c = TextNode(Terminal("cde"))
+        self.bos = BOS(Terminal(""))
+        self.eos = EOS(FinishSymbol())
+        self.x = TextNode(Nonterminal("x"), 0, [self.b, self.c])
+        self.root = TextNode(Nonterminal("Root"), 0, [self.bos, self.a, self.x, self.eos])
+        for node in [self.bos, self.a, self.b, self.c, self.x, self.eos, self.root]:
+            node.calc_textlength()
+            node.save(1)
+
+    def test_get_offset(self):
+        assert [n.get_offset() for n in [self.bos, self.a, self.x, self.b, self.c, self.eos]] == \
+               [0, 0, 2, 2, 2, 5]
+        self.root.set_children([self.bos, self.x, self.eos])
+        self.root.calc_textlength()
+        self.root.changed = True
+        self.root.save(2)
+        assert self.c.get_offset() == 0
+        assert self.c.get_offset(1) == 2
+
+    def test_find_terminal(self):
+        assert self.root.find_terminal(0) == (self.bos, 0)
+        assert self.root.find_terminal(1) == (self.a, 1)
+        assert self.root.find_terminal(2) == (self.a, 2)
+        assert self.root.find_terminal(3) == (self.c, 1)
+        assert self.root.find_terminal(5) == (self.c, 3)
+        assert self.root.find_terminal(100) == (self.c, 3)
+        assert self.x.find_terminal(1) == (self.c, 1)
@@ -0,0 +1,99 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from incparser.cache import GrammarCache, digest
+from incparser.incparser import IncParser
+from incparser.constants import LR1
+import os
+
+grammar = """
+    S ::= "b" A "d"
+    A ::= "c"
+        |
+"""
+
+class Test_GrammarCache(object):
+
+    def test_digest_is_stable(self):
+        assert digest("stategraph", grammar, False, LR1) == digest("stategraph", grammar, False, LR1)
+        assert digest("stategraph", grammar, False, LR1) != digest("stategraph", grammar, True, LR1)
+        assert digest(grammar, LR1) != digest(grammar, 0)
+
+    def test_store_load(self, tmpdir):
+        cache = GrammarCache(str(tmpdir))
+        assert cache.load("abc") is None
+        assert cache.store("abc", {"a": [1, 2, 3]})
+        assert cache.load("abc") == {"a": [1, 2, 3]}
+        assert os.listdir(str(tmpdir)) == ["abc.pcl"]
+
+    def test_corrupt_entry(self, tmpdir):
+        cache = GrammarCache(str(tmpdir))
+        cache.store("abc", [1, 2, 3])
+        with open(cache.path("abc"), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        assert cache.load("abc") is None
+        assert not os.path.exists(cache.path("abc"))
+
+    def test_evict(self, tmpdir):
+        cache = GrammarCache(str(tmpdir), max_entries=2)
+        for i, key in enumerate(["a", "b", "c"]):
+            cache.store(key, i)
+            os.utime(cache.path(key), (i, i))
+        cache.evict()
+        assert sorted(os.listdir(str(tmpdir))) == ["b.pcl", "c.pcl"]
+
+    def test_incparser_uses_cache(self, tmpdir, monkeypatch):
+        import config
+        monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+        p1 = IncParser(grammar, LR1, False)
+        assert len(os.listdir(str(tmpdir))) == 1
+        p2 = IncParser(grammar, LR1, False)
+        assert len(os.listdir(str(tmpdir))) == 1
+        assert len(p1.syntaxtable.table) == len(p2.syntaxtable.table)
+
+    def test_format(self, tmpdir, monkeypatch):
+        # graphs pickled in an older format aren't loaded
+        import config
+        from incparser.stategraph import StateGraph
+        monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+        IncParser(grammar, LR1, False)
+        monkeypatch.setattr(StateGraph, "FORMAT", StateGraph.FORMAT + 1)
+        IncParser(grammar, LR1, False)
+        assert len(os.listdir(str(tmpdir))) == 2
+
+    def test_lexer_uses_cache(self, tmpdir, monkeypatch):
+        import config
+        from treelexer.lexer import Lexer
+        monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+        rules = [("name", "[a-z]+"), ("num", "[0-9]+")]
+        l1 = Lexer(rules)
+        # compiling may also have cached the regex grammar
+        entries = len(os.listdir(str(tmpdir)))
+        l2 = Lexer(rules)
+        assert len(os.listdir(str(tmpdir))) == entries
+        assert l2.patterns == l1.patterns
+        assert l2.lex("abc123") == l1.lex("abc123") == [("abc", "name", 1), ("123", "num", 1)]
+        Lexer(rules[::-1])
+        assert len(os.listdir(str(tmpdir))) == entries + 1
+        monkeypatch.setattr(Lexer, "FORMAT", Lexer.FORMAT + 1)
+        Lexer(rules)
+        assert len(os.listdir(str(tmpdir))) == entries + 2
@@ -0,0 +1,160 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+from grammar_parser.gparser import Parser, Terminal, Nonterminal, Epsilon
+from incparser.state import StateSet
+from incparser.production import Production
+from incparser.stategraph import StateGraph, LRItems
+from incparser.helpers import Helper
+from incparser.syntaxtable import FinishSymbol
+from incparser.constants import LR0, LR1, LALR
+
+import pytest
+
+grammar = """
+    S ::= A B "c"
+        | "x" S
+        | S "y"
+    A ::= "a" A
+        |
+    B ::= "b"
+        | A
+"""
+
+p = Parser(grammar)
+p.parse()
+
+a = Terminal("a")
+b = Terminal("b")
+c = Terminal("c")
+x = Terminal("x")
+y = Terminal("y")
+S = Nonterminal("S")
+A = Nonterminal("A")
+B = Nonterminal("B")
+
+class Test_LRItems:
+
+    def setup_method(self, method):
+        self.items = LRItems(p.start_symbol, p.rules)
+
+    def test_encoding(self):
+        items = self.items
+        first = items.get_starts(S)
+        assert len(first) == 3
+        i = first[0]
+        production = items.productions[items.item_production[i]]
+        assert production == Production(S, [A, B, c])
+        assert [items.item_dot[j] for j in range(i, i + 4)] == [0, 1, 2, 3]
+        assert [items.item_next[j] for j in range(i, i + 4)] == [A, B, c, None]
+        # empty alternatives start behind the epsilon
+        e = items.get_starts(A)[1]
+        assert items.productions[items.item_production[e]].right == [Epsilon()]
+        assert items.item_dot[e] == 1
+        assert items.item_next[e] is None
+        assert items.get_starts(S) is first
+
+    def test_first_of_suffix(self):
+        items = self.items
+        i = items.get_starts(S)[0]
+        # S ::= .A B "c": FIRST(B "c") = {a, b, c}
+        assert items.symbols(items.item_first[i]) == set([a, b, c])
+        assert not items.item_nullable[i]
+        # S ::= A .B "c"
+        assert items.symbols(items.item_first[i + 1]) == set([c])
+        assert items.item_nullable[i + 2]
+        # A ::= "a" .A
+        j = items.get_starts(A)[0]
+        assert items.item_first[j + 1] == 0
+        assert items.item_nullable[j + 1]
+
+    def test_closure_cached(self):
+        items = self.items
+        closure = items.closure((0,))
+        assert items.closure((0,)) is closure
+        kernel = closure[0][:1]
+        assert kernel == (0,)
+        las = items.lookaheads((0,), (items.terminal_bit(FinishSymbol()),))
+        assert len(las) == len(closure[0])
+
+def kernel(state_set):
+    result = StateSet()
+    for e in state_set.elements:
+        if e.p.left is None or (e.d > 0 and e.p.right != [Epsilon()]):
+            result.add(e, state_set.lookaheads[e])
+    return result
+
+class Test_StateGraph:
+
+    @pytest.mark.parametrize("lr_type", [LR1, LALR])
+    def test_closures(self, lr_type):
+        # all states are the LR(1) closures of their kernels
+        graph = StateGraph(p.start_symbol, p.rules, lr_type)
+        graph.build()
+        helper = Helper(p.rules)
+        assert len(graph.state_sets) > 10
+        for state_set in graph.state_sets:
+            closure = helper.closure_1(kernel(state_set))
+            assert closure.elements == state_set.elements
+            for e in closure.elements:
+                assert closure.lookaheads[e] == state_set.lookaheads[e]
+
+    def test_deterministic(self):
+        g1 = StateGraph(p.start_symbol, p.rules, LR1)
+        g1.build()
+        g2 = StateGraph(p.start_symbol, p.rules, LR1)
+        g2.build()
+        assert g1.edges == g2.edges
+        for s1, s2 in zip(g1.state_sets, g2.state_sets):
+            assert s1.elements == s2.elements
+
+    def test_lr0(self):
+        g0 = StateGraph(p.start_symbol, p.rules, LR0)
+        g0.build()
+        g1 = StateGraph(p.start_symbol, p.rules, LR1)
+        g1.build()
+        assert len(g0.state_sets) <= len(g1.state_sets)
+        cores = set(frozenset(s.elements) for s in g1.state_sets)
+        assert cores == set(frozenset(s.elements) for s in g0.state_sets)
+        for state_set in g0.state_sets:
+            assert not any(state_set.lookaheads.values())
+
+    def test_lalr(self):
+        # grammar is LALR(1), so merging all states with the same kernel
+        # gives the same automaton
+        g1 = StateGraph(p.start_symbol, p.rules, LR1)
+        g1.build()
+        g2 = StateGraph(p.start_symbol, p.rules, LALR)
+        g2.build()
+        assert g1.edges == g2.edges
+        for s1, s2 in zip(g1.state_sets, g2.state_sets):
+            assert s1.lookaheads == s2.lookaheads
+
+    def test_weakly_compatible(self):
+        graph = StateGraph(p.start_symbol, p.rules, LR1)
+        assert graph.weakly_compatible((1,), (2,))
+        assert graph.weakly_compatible((1, 2), (1, 2))
+        assert graph.weakly_compatible((1, 2, 4), (1, 2, 8))
+        # merging would make the first two items share a lookahead
+        assert not graph.weakly_compatible((1, 2, 4), (2, 1, 4))
+        # ... unless they already did
+        assert graph.weakly_compatible((3, 2, 4), (2, 1, 4))
@@ -23,7 +23,8 @@ from grammar_parser.gparser import Parser, Terminal, Nonterminal
 from incparser.state import StateSet, State, LR1Element
 from incparser.production import Production
 from incparser.stategraph import StateGraph
-from incparser.syntaxtable import FinishSymbol
+from incparser.syntaxtable import SyntaxTable, FinishSymbol
+from incparser.constants import LR1, LALR
 
 import pytest
 
@@ -44,9 +45,13 @@ S = Nonterminal("S")
 A = Nonterminal("A")
 f = FinishSymbol()
 
+def find(graph, expected):
+    for state_set in graph.state_sets:
+        if state_set.elements == set(expected.elements):
+            return state_set
+
 def test_graph():
-    pytest.skip("conversion is not working yet")
-    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph = StateGraph(p.start_symbol, p.rules, LALR)
     graph.build()
 
     s0 = StateSet([
@@ -54,66 +59,6 @@ def test_graph():
         LR1Element(Production(S, [b, A, c]), 0, set([f])),
     ])
 
-    s1 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 1, set([f])),
-        LR1Element(Production(A, [S]), 0, set([c])),
-        LR1Element(Production(A, [a]), 0, set([c])),
-        LR1Element(Production(S, [b, A, c]), 0, set([c])),
-    ])
-
-    s2 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 1, set([c])),
-        LR1Element(Production(A, [S]), 0, set([c])),
-        LR1Element(Production(A, [a]), 0, set([c])),
-        LR1Element(Production(S, [b, A, c]), 0, set([c])),
-    ])
-
-    s3 = StateSet([
-        LR1Element(Production(A, [a]), 1, set([c])),
-    ])
-
-    s4 = StateSet([
-        LR1Element(Production(None, [S]), 1, set([f])),
-    ])
-
-    s5 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 2, set([f])),
-    ])
-
-    s6 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 2, set([c])),
-    ])
-
-    s7 = StateSet([
-        LR1Element(Production(A, [S]), 1, set([c])),
-    ])
-
-    s8 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 3, set([f])),
-    ])
-
-    s9 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 3, set([c])),
-    ])
-
-    assert len(graph.state_sets) == 10
-    assert s0 in graph.state_sets
-    assert s1 in graph.state_sets
-    assert s2 in graph.state_sets
-    assert s3 in graph.state_sets
-    assert s4 in graph.state_sets
-    assert s6 in graph.state_sets
-    assert s7 in graph.state_sets
-    assert s8 in graph.state_sets
-    assert s9 in graph.state_sets
-
-    graph.convert_lalr()
-
-    s0 = StateSet([
-        LR1Element(Production(None, [S]), 0, set([f])),
-        LR1Element(Production(S, [b, A, c]), 0, set([f])),
-    ])
-
     s1 = StateSet([
         LR1Element(Production(S, [b, A, c]), 1, set([f, c])),
         LR1Element(Production(A, [S]), 0, set([c])),
@@ -142,12 +87,36 @@ def test_graph():
     ])
 
     assert len(graph.state_sets) == 7
-    assert s0 in graph.state_sets
-    assert s1 in graph.state_sets
-    assert s2 in graph.state_sets
-    assert s3 in graph.state_sets
-    assert s4 in graph.state_sets
-    assert s6 in graph.state_sets
+    for expected in [s0, s1, s2, s3, s4, s5, s6]:
+        state_set = find(graph, expected)
+        assert state_set is not None
+        for e in expected.elements:
+            assert state_set.lookaheads[e] == e.lookahead
+
+grammar2 = """
+    S ::= "a" A "d"
+        | "b" B "d"
+        | "a" B "e"
+        | "b" A "e"
+    A ::= "c"
+    B ::= "c"
+"""
+
+def test_reduce_reduce(capsys):
+    # LALR(1) merges the states after "a c" and "b c", which LR(1) keeps
+    # apart
+    p2 = Parser(grammar2)
+    p2.parse()
+    lr1 = StateGraph(p2.start_symbol, p2.rules, LR1)
+    lr1.build()
+    lalr = StateGraph(p2.start_symbol, p2.rules, LALR)
+    lalr.build()
+    assert len(lalr.state_sets) == len(lr1.state_sets) - 1
+
+    SyntaxTable(None, LR1).build(lr1)
+    assert "Reduce/Reduce" not in capsys.readouterr().out
+    SyntaxTable(None, LALR).build(lalr)
+    assert capsys.readouterr().out.count("Reduce/Reduce") == 2
 
 def test_edges():
     pass
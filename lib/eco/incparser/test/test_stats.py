@@ -0,0 +1,106 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+from incparser.stats import ParseStats, COUNTERS, PHASES
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from utils import KEY_LEFT as LEFT
+
+calc = lang_dict["Basic Calculator"]
+python = lang_dict["Python 2.7.5"]
+
+class Test_ParseStats:
+
+    def setup_method(self, method):
+        self.parser, lexer = calc.load()
+        self.tm = TreeManager()
+        self.tm.add_parser(self.parser, lexer, calc.name)
+
+    def type(self, text):
+        stats = []
+        for c in text:
+            self.tm.key_normal(c)
+            stats.append(self.tm.parse_stats)
+        return stats
+
+    def test_counters(self):
+        stats = self.type("1+2")
+        assert len(set(map(id, stats))) == 3
+        s = stats[-1]
+        assert s is self.parser.stats
+        assert s.shifts >= 1
+        assert s.reductions == s.reused + s.created > 0
+        assert s.lookaheads == self.parser.loopcount
+        assert s.isolations == s.ooc_attempts == 0
+        assert s.times["parse"] > 0
+        assert s.times["recovery"] == s.times["refine"] == 0
+
+    def test_errors(self):
+        self.tm.import_file("1+2")
+        self.tm.key_end()
+        self.tm.cursor_movement(LEFT)
+        s, = self.type("*")
+        assert s.isolations >= 1
+        assert s.times["recovery"] > 0
+        assert s.times["parse"] >= s.times["recovery"] + s.times["refine"]
+        self.tm.key_end()
+        stats = self.type("*3")
+        # the subtree after the error is reparsed out of context
+        assert sum(s.ooc_attempts for s in stats) > 0
+        assert sum(s.ooc_successes for s in stats) > 0
+
+    def test_add(self):
+        stats = self.type("1+2")
+        total = ParseStats()
+        for s in stats:
+            total.add(s)
+        d = total.as_dict()
+        assert sorted(d) == sorted(COUNTERS + ("times",))
+        assert d["shifts"] == sum(s.shifts for s in stats)
+        assert sorted(d["times"]) == sorted(PHASES)
+        assert d["times"]["parse"] == sum(s.times["parse"] for s in stats)
+        assert "shifts=%s" % total.shifts in str(total)
+
+    def test_report(self):
+        reported = []
+        TreeManager.report_stats = reported.append
+        try:
+            stats = self.type("1+2")
+        finally:
+            TreeManager.report_stats = None
+        assert reported == stats
+
+    def test_proportional(self):
+        # the work done when editing a single statement doesn't depend on the
+        # number of tokens in the file
+        shifts = []
+        for n in (10, 100):
+            parser, lexer = python.load()
+            tm = TreeManager()
+            tm.add_parser(parser, lexer, python.name)
+            tm.import_file("".join("def f%s(x):\n    return x + %s\n\n" % (i, i) for i in range(n)))
+            tm.cursor.line = 1
+            tm.key_end()
+            tm.key_normal("1")
+            assert parser.last_status
+            shifts.append(tm.parse_stats.shifts)
+        assert shifts[0] == shifts[1] < 20
@@ -0,0 +1,70 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from incparser.incparser import IncParser
+from incparser.trace import Tracer, set_tracer
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+
+calc = lang_dict["Basic Calculator"]
+
+class Test_Tracer:
+
+    def setup_method(self, method):
+        self.parser, lexer = calc.load()
+        self.tm = TreeManager()
+        self.tm.add_parser(self.parser, lexer, calc.name)
+
+    def test_disabled(self):
+        assert IncParser.tracer is None
+        assert self.parser.tracer is None
+
+    def test_events(self):
+        tracer = Tracer()
+        self.parser.tracer = tracer
+        for c in "1+2":
+            self.tm.key_normal(c)
+        events = [e for e, _ in tracer.events]
+        assert events[0] == "parse"
+        assert events[-1] == "accept"
+        shifted = [f["node"].symbol.name for e, f in tracer.events if e == "shift"]
+        assert shifted[-3:] == ["1", "+", "2"]
+        for e, fields in tracer.events:
+            if e == "reduce":
+                assert fields["node"].symbol == fields["production"].action.left
+                assert fields["state"] == fields["node"].state
+
+    def test_error(self):
+        for c in "1+2":
+            self.tm.key_normal(c)
+        tracer = Tracer()
+        set_tracer(tracer)
+        try:
+            self.tm.key_normal("+")
+        finally:
+            set_tracer(None)
+        assert not self.parser.last_status
+        events = [e for e, _ in tracer.events]
+        assert "recover" in events
+        assert events[-1] == "error"
+        self.tm.key_normal("3")
+        assert self.parser.last_status
+        assert len(tracer.events) == len(events)
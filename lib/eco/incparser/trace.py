@@ -0,0 +1,69 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Tracing of parse events.
+
+Parsers don't log anything while parsing. Instead, every place that used to
+write a debug message checks the parser's `tracer` attribute first, which is
+None unless tracing has been enabled, so a disabled tracer only costs an
+attribute lookup. Tracers are called with the name of the event and its
+fields as keyword arguments, e.g. `tracer("shift", node=la, state=3,
+action=element, rb=False)`. Fields contain the parse tree nodes and syntax
+table entries themselves rather than their string representations.
+
+Events:
+
+  parse         a (possibly out-of-context) parse starts: ooc, state
+  lookahead     the parser processes a node: node, state
+  optshift      a nonterminal was shifted optimistically: node, state, goto
+  terminal      action for a terminal: node, state, action
+  shift         a terminal was shifted: node, state, action, rb
+  reduce        a reduction: production, node, state, reused
+  breakdown     right breakdown of an optimistic shift: node, state
+  recover       error recovery starts: node
+  isolate       error recovery found a subtree to isolate: node
+  refine        refinement after an isolation: node, offset, error_offset
+  retain        a subtree was retained during refinement: node, parent
+  ooc           out-of-context analysis of a subtree: node, result
+  accept/error  the parse ended: loopcount"""
+
+import logging
+
+class Tracer(object):
+    """Records all events as (event, fields) tuples."""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event, **fields):
+        self.events.append((event, fields))
+
+class LoggingTracer(object):
+    """Writes all events to the debug log."""
+
+    def __call__(self, event, **fields):
+        logging.debug("%s %s", event, " ".join("%s=%s" % (k, fields[k]) for k in sorted(fields)))
+
+def set_tracer(tracer):
+    """Traces all parsers that don't have their own tracer using `tracer`.
+    Passing None disables tracing."""
+    from .incparser import IncParser
+    IncParser.tracer = tracer
@@ -0,0 +1,127 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Benchmarks the IndentationManager on large generated Python files.
+
+Files are only lexed (not parsed), so the timings only include the work of
+the IndentationManager: a full repair (as done when importing a file) and
+incremental repairs of single lines (as done after each edit)."""
+
+from optparse import OptionParser
+import sys, time
+
+def generate(lines, depth, body):
+    """Generates about `lines` lines of Python code consisting of functions
+    that nest if-statements `depth` levels deep. Each function ends with
+    statements at every level, so all lines following a block need to find
+    their indentation level across the whole block."""
+    out = []
+    n = 0
+    while len(out) < lines:
+        out.append("def f%s(x):" % n)
+        for level in range(1, depth):
+            out.append("    " * level + "if x > %s:" % level)
+        for i in range(body):
+            out.append("    " * depth + "x = x + %s" % i)
+        for level in range(depth - 1, 0, -1):
+            out.append("    " * level + "x = x - %s" % level)
+        out.append("")
+        out.append("f%s(1)" % n)
+        n += 1
+    return "\n".join(out)
+
+def setup(text):
+    """Returns a TreeManager containing the lexed (but unparsed) text and its
+    IndentationManager."""
+    from grammars.grammars import lang_dict
+    from grammar_parser.gparser import Terminal, Nonterminal
+    from incparser.astree import TextNode
+    from treemanager import TreeManager
+
+    python = lang_dict["Python 2.7.5"]
+    parser, lexer = python.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, python.name)
+    bos = parser.previous_version.parent.children[0]
+    new = TextNode(Terminal(text.replace("\n", "\r")))
+    bos.insert_after(new)
+    lexer.relex_import(new)
+    # Without a parse tree all tokens are children of the root, which makes
+    # inserting indentation tokens slow. Group them into lines instead.
+    root = bos.parent
+    children = [bos]
+    line = []
+    for node in root.children[1:-1]:
+        line.append(node)
+        if node.lookup == "<return>":
+            children.append(TextNode(Nonterminal("line")))
+            children[-1].set_children(line)
+            line = []
+    if line:
+        children.append(TextNode(Nonterminal("line")))
+        children[-1].set_children(line)
+    children.append(root.children[-1])
+    root.set_children(children)
+    return tm, tm.parsers[0][4]
+
+def line_starts(im):
+    bol = im.bos
+    while bol is not None:
+        yield bol
+        bol = im.next_line(bol)
+
+def bench(lines, depth, body, repeat, step):
+    tm, im = setup(generate(lines, depth, body))
+    # insert the indentation tokens
+    im.repair_full()
+    full = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        im.repair_full()
+        full.append(time.perf_counter() - start)
+    bols = list(line_starts(im))
+    incremental = []
+    for bol in bols[::step]:
+        start = time.perf_counter()
+        im.repair(bol)
+        incremental.append(time.perf_counter() - start)
+    return len(bols), min(full), incremental
+
+def main(argv=None):
+    optp = OptionParser(usage="usage: %prog [options]\n\n"
+                        "Benchmarks the IndentationManager on generated Python files.")
+    optp.add_option("-l", "--lines", default="1000,2000,4000,8000", help="Comma separated file sizes in lines [default: %default]")
+    optp.add_option("-d", "--depth", type="int", default=8, help="Nesting depth of the generated code [default: %default]")
+    optp.add_option("-b", "--body", type="int", default=50, help="Number of statements in the innermost blocks [default: %default]")
+    optp.add_option("-r", "--repeat", type="int", default=3, help="Number of full repairs per file [default: %default]")
+    optp.add_option("-s", "--step", type="int", default=7, help="Repair every n-th line incrementally [default: %default]")
+    (options, args) = optp.parse_args(argv)
+    sys.setrecursionlimit(10000)
+
+    print("%8s %12s %12s %14s %14s" % ("lines", "full (ms)", "per line (us)", "incr mean (us)", "incr max (us)"))
+    for lines in options.lines.split(","):
+        n, full, incremental = bench(int(lines), options.depth, options.body, options.repeat, options.step)
+        print("%8s %12.1f %12.1f %14.1f %14.1f" % (n, full * 1000, full / n * 1e6,
+              sum(incremental) / len(incremental) * 1e6, max(incremental) * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,8 +19,8 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from grammar_parser.gparser import IndentationTerminal
-from incparser.astree import TextNode, BOS
+from grammar_parser.gparser import Terminal, IndentationTerminal
+from incparser.astree import TextNode, BOS, MultiTextNode
 
 def println(node):
     l = []
@@ -32,17 +32,40 @@ def println(node):
     return repr("".join(l))
 
 class IndentationManager:
+    """Generates the INDENT, DEDENT, NEWLINE and UNBALANCED tokens at the
+    beginning of logical lines. Lines are identified by the node they start
+    with (a <return> node or BOS). For each logical line we cache its
+    whitespace, its indentation level and its enclosing line, i.e. the closest
+    previous logical line with less whitespace. Following the enclosing lines
+    from a line gives the stack of indentation levels that are open at that
+    line, so finding the level a line dedents to only needs to look at one
+    line per level instead of scanning back over the whole block."""
 
     def __init__(self, root):
         self.bos = root.children[0]
         self.eos = root.children[-1]
         self.whitespaces = {}
         self.indentation = {}
+        self.enclosing = {}
         self.changed = False
+        # lines restored by undo/redo, which are repaired on the next repair
+        self.invalid = []
+        # loaded trees already contain indentation tokens, but we don't know
+        # the indentation of their lines yet
+        self.outdated = self.bos.next_term is not self.eos
 
     def repair(self, node):
-        self.changed = False
         """Repair indentation in the line given by node."""
+        self.changed = False
+        if self.outdated:
+            self.repair_full()
+            return self.changed
+        if self.invalid:
+            self.repair_invalid()
+        self.repair_line(node)
+        return self.changed
+
+    def repair_line(self, node):
         bol = self.get_line_start(node)
         # if line is not logical, skip ahead to next logical line
         if not self.is_logical_line(bol):
@@ -53,123 +76,177 @@ class IndentationManager:
             else:
                 while True:
                     if bol is None:
-                        return False # nothing has been changed
+                        return # nothing has been changed
                     if self.is_logical_line(bol):
                         break
                     bol = self.next_line(bol)
 
-        before = self.get_whitespace(bol)
-        self.calculate_indentation(bol)
-        self.fix_tokens(bol)
-        after = self.get_whitespace(bol)
-        # XXX we don't need to update following lines if no indent tokens were
-        # inserted in `fix_tokens(bol)`
-
-        # update following lines that dependant
-        search_threshold = min(before, after)
-
-        current_indent = self.get_indentation(bol)
-        current_ws = self.count_whitespace(bol)
-        bol = self.next_line(bol)
+        # Update following lines until we reach a line whose indentation and
+        # enclosing lines are the same as before. All lines after that
+        # depend only on that line and its enclosing lines and thus don't
+        # change either.
+        repaired = set()
+        changed = set()
         while bol is not None:
-            ws = self.count_whitespace(bol)
-            if ws is None and bol.prev_term and bol.prev_term.symbol.name != "\\":
-                bol = self.next_line(bol)
-                continue
-            if ws is None:
-                return self.changed
-            if ws > current_ws:
-                self.indentation[bol] = current_indent + 1
-            if ws == current_ws:
-                self.indentation[bol] = current_indent
-            if ws < current_ws:
-                self.calculate_indentation(bol)
-
-            self.fix_tokens(bol)
-
-            if self.get_whitespace(bol) <= search_threshold:
-                # repair everything up to the line that has smaller indentation/whitespace
-                # than the changed line
+            if self.fix_tokens(bol):
+                changed.add(bol)
+            elif repaired and not self.encloses_changes(bol, repaired, changed):
                 break
-
-            current_ws = ws
-            current_indent = self.get_indentation(bol)
+            repaired.add(bol)
             bol = self.next_line(bol)
-        return self.changed
+            while bol is not None and not self.is_logical_line(bol):
+                if bol.prev_term and bol.prev_term.symbol.name == "\\":
+                    return
+                bol = self.next_line(bol)
+
+    def encloses_changes(self, bol, repaired, changed):
+        """Checks if any of the enclosing lines of bol that have been repaired
+        during the current repair have changed."""
+        line = self.enclosing.get(bol)
+        while line in repaired:
+            if line in changed:
+                return True
+            line = self.enclosing.get(line)
+        return False
 
     def repair_full(self):
         self.whitespaces = {}
         self.indentation = {}
+        self.enclosing = {}
         bol = self.bos
         while bol is not None:
-            self.calculate_indentation(bol)
             self.fix_tokens(bol)
             bol = self.next_line(bol)
-
-    def calculate_indentation(self, bol):
-        """Scans whitespaces in previous lines and sets the indentation of the
-        line given by bol accordingly."""
-        # calculate indentation by scanning previous lines
-        ws = self.count_whitespace(bol)
-        if ws is None:
-            return
-        temp = bol
-        found_smaller = False
-        while bol is not self.bos:
-            bol = self.prev_line(bol)
-            if not self.is_logical_line(bol):
+        self.outdated = False
+
+    def invalidate(self, nodes, lines):
+        """Marks the lines containing `nodes` as outdated, e.g. after undo
+        restored older versions of them. The next repair repairs these lines
+        first, in the order given by the editor's LineIndex `lines`. All other
+        lines only depend on them through their cached enclosing lines, which
+        the repair follows as usual."""
+        bols = set(self.invalid)
+        for node in nodes:
+            if type(node.parent) is MultiTextNode:
+                # the parts of multi-line strings aren't part of the token
+                # stream, only the string is
+                node = node.parent
+            if node.deleted or not isinstance(node.symbol, Terminal):
                 continue
-            prev_ws = self.count_whitespace(bol)
-            if ws < prev_ws:
-                found_smaller = True
+            if not self.is_attached(node):
                 continue
-            if ws == prev_ws:
-                self.indentation[temp] = self.get_indentation(bol)
-                return
-            if ws > prev_ws:
-                if not found_smaller:
-                    self.indentation[temp] = self.get_indentation(bol) + 1
-                return
+            bols.add(self.get_line_start(node))
+        def position(bol):
+            if bol is self.bos:
+                return -1
+            i = lines.find(bol)
+            return -1 if i is None else i
+        self.invalid = sorted(bols, key=position)
+
+    def repair_invalid(self):
+        invalid = self.invalid
+        self.invalid = []
+        for bol in invalid:
+            if bol is self.bos or (not bol.deleted and self.is_attached(bol)):
+                self.repair_line(bol)
+
+    def is_attached(self, node):
+        """Checks if node is still linked into the token stream. Nodes that
+        were inserted in a version that undo reverted are not marked as
+        deleted, but their neighbours no longer point to them."""
+        if node is self.bos:
+            return True
+        prev = node.prev_term
+        return prev is not None and prev.next_term is node
 
-    def fix_tokens(self, bol):#XXX redundant (remove and add import method that fixes each line)
-        """Update (add/remove) indentation tokens."""
-        new_tokens = []
-        temp = bol
+    def calculate_indentation(self, bol):
+        """Updates the whitespace, indentation and enclosing line of the line
+        given by bol and returns the indentation tokens it needs."""
+        this_ws = self.count_whitespace(bol)
         if bol is self.bos:
-            this_ws = self.count_whitespace(bol)
             if this_ws is None:
                 this_ws = 0
             self.indentation[bol] = this_ws
-        elif self.is_logical_line(bol):
-            this_ws = self.count_whitespace(bol)
-            self.whitespaces[bol] = this_ws
-            bol = self.prev_line(bol)
-            while bol is not self.bos and not self.is_logical_line(bol):
-                bol = self.prev_line(bol)
-            prev_ws = self.count_whitespace(bol)
-            if prev_ws is None and type(bol) is BOS:
-                prev_ws = 0
-
-            if prev_ws == this_ws:
-                self.indentation[temp] = self.get_indentation(bol) # this is only needed when calling fix_tokens separately (e.g. import)
-                new_tokens.append(self.create_token("newline"))
-            elif prev_ws < this_ws:
-                self.indentation[temp] = self.get_indentation(bol) + 1
-                new_tokens.append(self.create_token("indent"))
-                new_tokens.append(self.create_token("newline"))
-            elif prev_ws > this_ws:
-                this_indent = self.find_indentation(temp)
-                if this_indent is None:
-                    new_tokens.append(self.create_token("unbalanced"))
-                else:
-                    self.indentation[temp] = this_indent
-                    prev_indent = self.get_indentation(bol)
-                    indent_diff = prev_indent - this_indent
-                    for i in range(indent_diff):
-                        new_tokens.append(self.create_token("dedent"))
-                    new_tokens.append(self.create_token("newline"))
-
-        self.apply_nodes(new_tokens, temp)
+            self.enclosing[bol] = None
+            return []
+        if this_ws is None:
+            return []
+
+        self.whitespaces[bol] = this_ws
+        prev = self.prev_line(bol)
+        while prev is not self.bos and not self.is_logical_line(prev):
+            prev = self.prev_line(prev)
+        prev_ws = self.count_whitespace(prev)
+        if prev_ws is None and type(prev) is BOS:
+            prev_ws = 0
+            prev_logical = False
+        else:
+            prev_logical = True
+
+        if prev_ws == this_ws:
+            self.indentation[bol] = self.get_indentation(prev)
+            self.enclosing[bol] = self.get_enclosing(prev, prev_ws) if prev_logical else None
+            return [self.create_token("newline")]
+        if prev_ws < this_ws:
+            self.indentation[bol] = self.get_indentation(prev) + 1
+            self.enclosing[bol] = prev if prev_logical else None
+            return [self.create_token("indent"), self.create_token("newline")]
+
+        # dedent: pop indentation levels until we find the line this line
+        # returns to
+        line, line_ws = prev, prev_ws
+        while line_ws > this_ws:
+            line = self.get_enclosing(line, line_ws)
+            if line is None:
+                break
+            line_ws = self.count_whitespace(line)
+        if line is None or line_ws < this_ws:
+            self.indentation.pop(bol, None)
+            self.enclosing[bol] = line
+            return [self.create_token("unbalanced")]
+        this_indent = self.get_indentation(line)
+        self.indentation[bol] = this_indent
+        self.enclosing[bol] = self.get_enclosing(line, line_ws)
+        tokens = []
+        for i in range(self.get_indentation(prev) - this_indent):
+            tokens.append(self.create_token("dedent"))
+        tokens.append(self.create_token("newline"))
+        return tokens
+
+    def get_enclosing(self, bol, ws):
+        """Returns the closest logical line before the line given by bol whose
+        whitespace is smaller than ws, or None if there is no such line."""
+        try:
+            line = self.enclosing[bol]
+            if line is None:
+                return None
+            if not line.deleted and (line.lookup == "<return>" or line is self.bos):
+                line_ws = self.count_whitespace(line)
+                if line_ws is not None and line_ws < ws:
+                    return line
+        except KeyError:
+            pass
+        # cache is missing or outdated: scan previous lines
+        line = bol
+        while line is not self.bos:
+            line = self.prev_line(line)
+            line_ws = self.count_whitespace(line)
+            if line_ws is not None and line_ws < ws:
+                break
+        else:
+            line = None
+        self.enclosing[bol] = line
+        return line
+
+    def fix_tokens(self, bol):
+        """Update (add/remove) indentation tokens. Returns True if the
+        whitespace, indentation or enclosing line of bol has changed."""
+        before = self.get_line_data(bol)
+        self.apply_nodes(self.calculate_indentation(bol), bol)
+        return self.get_line_data(bol) != before
+
+    def get_line_data(self, bol):
+        return (self.whitespaces.get(bol), self.indentation.get(bol), self.enclosing.get(bol, False))
 
     def apply_nodes(self, new, bol):
         """Insert generated indentation tokens into the token stream if they
@@ -241,20 +318,6 @@ class IndentationManager:
             node = node.next_term
         return node
 
-    def find_indentation(self, bol):
-        # indentation level
-        this_ws = self.count_whitespace(bol)
-        while not bol is self.bos:
-            bol = self.prev_line(bol)
-            prev_ws = self.count_whitespace(bol)
-            if prev_ws is None:
-                continue
-            if prev_ws == this_ws:
-                return self.get_indentation(bol)
-            if prev_ws < this_ws:
-                return None
-        return None
-
     def create_token(self, name):
         if name == "newline":
             return TextNode(IndentationTerminal("NEWLINE"))
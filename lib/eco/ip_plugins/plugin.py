@@ -1,33 +1,68 @@
-import pkgutil, importlib
+import os, pkgutil, importlib
+
+def noop(*args, **kwargs):
+    pass
 
 class PluginManager:
+    """Dispatches hooks (accessed as `do_<name>`) to the loaded plugins.
+
+    Hooks are resolved once, on first access (or ahead of time using
+    `resolve`), and are then stored as attributes of the manager. A hook that
+    no plugin implements resolves to a no-op, a hook implemented by a single
+    plugin to the plugin's bound method, and a hook implemented by several
+    plugins to a function that calls them in the order the plugins were loaded
+    and returns the first result that isn't None."""
 
     def __init__(self):
         self.loaded = []
 
     def loadplugins(self, caller):
-        modules = [name for _, name, _ in pkgutil.iter_modules(['ip_plugins'])]
+        path = os.path.dirname(__file__)
+        modules = [name for _, name, _ in pkgutil.iter_modules([path])]
         modules.remove("plugin")
-        for m in modules:
+        for m in sorted(modules):
             m = importlib.import_module("." + m, "ip_plugins")
             p = m.load(caller)
             if p:
                 self.loaded.append(p)
+        self.reset()
+
+    def add(self, plugin):
+        self.loaded.append(plugin)
+        self.reset()
 
-    def __getattr__(self, attr, *args, **kwargs):
+    def reset(self):
+        """Forgets all resolved hooks, e.g. after plugins have been added."""
+        for attr in list(self.__dict__):
+            if attr.startswith("do_"):
+                del self.__dict__[attr]
 
+    def resolve(self, *names):
+        for name in names:
+            getattr(self, "do_" + name)
+
+    def get_hook(self, name):
         funcs = []
+        for p in self.loaded:
+            f = getattr(p, name, None)
+            if callable(f):
+                funcs.append(f)
+        if not funcs:
+            return noop
+        if len(funcs) == 1:
+            return funcs[0]
+        def chain(*args, **kwargs):
+            result = None
+            for f in funcs:
+                r = f(*args, **kwargs)
+                if result is None:
+                    result = r
+            return result
+        return chain
+
+    def __getattr__(self, attr):
         if attr.startswith("do_"):
-            fname = attr[3:]
-            for p in self.loaded:
-                try:
-                    f = p.__getattribute__(fname)
-                    funcs.append(f)
-                except AttributeError:
-                    print("WARNING: Plugin %s has no method '%s'" % (type(p), fname))
-            def func(*args, **kwargs):
-                for f in funcs:
-                    return f(*args, **kwargs)
+            func = self.get_hook(attr[3:])
+            setattr(self, attr, func)
             return func
-        else:
-            return object.__getattribute__(self, attr)
+        raise AttributeError(attr)
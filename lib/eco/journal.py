@@ -0,0 +1,416 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Binary input journals.
+
+A journal is a compact, typed version of the input logs TreeManager records
+in `input_log` (see `TreeManager.log_input`). Every entry consists of an
+opcode and its arguments. Replaying a journal calls the TreeManager methods
+directly instead of evaluating each line of the log as Python code, and can
+optionally batch edits so they are parsed only once.
+
+Journals are stored as MAGIC followed by the entries: a byte for the
+opcode followed by the arguments, where strings are stored as their length
+and UTF-8 encoding, integers (and lengths) as unsigned LEB128 varints and
+booleans and cursor keys as single bytes.
+
+Text logs written by the editor and by the fuzzy tester can be converted
+using `Journal.from_inputlog`."""
+
+from optparse import OptionParser
+import ast, sys, time
+
+MAGIC = b"ECOJ\x01"
+
+# Opcodes are indices into OPS. Each entry contains the name of the operation
+# (a TreeManager method unless stated otherwise), its arguments and their
+# types (s: string, i: integer, b: boolean, k: cursor key) and the default
+# values of trailing arguments. New operations must be appended to keep
+# existing journals readable.
+OPS = [
+    ("language", "s", ()),          # main language of the log, not replayed
+    ("key_normal", "s", ()),
+    ("key_backspace", "", ()),
+    ("key_delete", "", ()),
+    ("key_shift", "", ()),
+    ("key_escape", "", ()),
+    ("key_home", "b", (False,)),
+    ("key_end", "b", (False,)),
+    ("key_cursors", "kb", (False,)),
+    ("ctrl_cursor", "kb", (False,)),
+    ("key_ctrl_z", "", ()),
+    ("key_shift_ctrl_z", "", ()),
+    ("undo_snapshot", "", ()),
+    ("add_languagebox", "s", ()),
+    ("leave_languagebox", "", ()),
+    ("surround_with_languagebox", "s", ()),
+    ("change_languagebox", "s", ()),
+    ("copySelection", "", ()),
+    ("cutSelection", "", ()),
+    ("pasteText", "s", ()),
+    ("pasteCompletion", "s", ()),
+    ("import_file", "s", ()),
+    ("save_current_version", "", ()),
+    ("find_next", "", ()),
+    ("cursor_reset", "", ()),
+    ("cursor_movement", "k", ()),
+    ("cursor.line", "i", ()),       # self.cursor.line = i
+    ("cursor.move_to_x", "i", ()),
+    ("selection_start", "", ()),    # self.selection_start = self.cursor.copy()
+    ("selection_end", "", ()),
+    ("move", "ki", ()),             # fuzzy tester: cursor_movement i times
+]
+
+OPCODES = dict((name, op) for op, (name, _, _) in enumerate(OPS))
+
+KEYS = ("up", "down", "left", "right")
+# Names of the cursor keys in logs. Older logs used the bare key names.
+KEY_NAMES = {"KEY_UP": "up", "KEY_DOWN": "down", "KEY_LEFT": "left", "KEY_RIGHT": "right",
+             "UP": "up", "DOWN": "down", "LEFT": "left", "RIGHT": "right"}
+KEY_NAMES.update((k, k) for k in KEYS)
+
+# Operations that only edit text or move the cursor. Their reparses can be
+# deferred when replaying batches of edits.
+BATCHABLE = set(OPCODES[name] for name in [
+    "key_normal", "key_backspace", "key_delete", "key_shift", "key_escape",
+    "key_home", "key_end", "key_cursors", "ctrl_cursor", "copySelection",
+    "cutSelection", "pasteText", "cursor_reset", "cursor_movement",
+    "cursor.line", "cursor.move_to_x", "selection_start", "selection_end",
+    "move"])
+
+class JournalError(Exception):
+    pass
+
+class Journal(object):
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else []
+
+    def append(self, name, *args):
+        self.entries.append((OPCODES[name], args))
+
+    def get_language(self):
+        for op, args in self.entries:
+            if op == OPCODES["language"]:
+                return args[0]
+
+    # ============================== CONVERSION ============================== #
+
+    @classmethod
+    def from_inputlog(cls, inputlog):
+        journal = cls()
+        for lineno, line in enumerate(inputlog.split("\n"), 1):
+            line = line.replace("\r", "\\r")
+            if line.startswith("# Main language: "):
+                journal.append("language", line[len("# Main language: "):].strip())
+                continue
+            if line.startswith("#") or not line.strip():
+                continue
+            try:
+                journal.entries.append(parse_line(line))
+            except (SyntaxError, ValueError) as e:
+                raise JournalError("line %s: %s: %r" % (lineno, e, line))
+        return journal
+
+    def to_inputlog(self):
+        lines = []
+        for op, args in self.entries:
+            name = OPS[op][0]
+            if name == "language":
+                lines.append("# Main language: %s" % args[0])
+            elif name == "cursor.line":
+                lines.append("self.cursor.line = %s" % args[0])
+            elif name in ("selection_start", "selection_end"):
+                lines.append("self.%s = self.cursor.copy()" % name)
+            elif name == "move":
+                lines.extend(["self.cursor_movement(KEY_%s)" % args[0].upper()] * args[1])
+            else:
+                args = [("KEY_" + a.upper()) if t == "k" else repr(a) for a, t in zip(args, OPS[op][1])]
+                lines.append("self.%s(%s)" % (name, ", ".join(args)))
+        return "\n".join(lines)
+
+    # ============================= SERIALISATION ============================ #
+
+    def to_bytes(self):
+        out = bytearray(MAGIC)
+        for op, args in self.entries:
+            out.append(op)
+            for arg, t in zip(args, OPS[op][1]):
+                if t == "s":
+                    data = arg.encode("utf-8")
+                    write_varint(out, len(data))
+                    out += data
+                elif t == "i":
+                    write_varint(out, arg)
+                elif t == "b":
+                    out.append(1 if arg else 0)
+                else:
+                    out.append(KEYS.index(arg))
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data.startswith(MAGIC):
+            raise JournalError("not a journal")
+        entries = []
+        pos = len(MAGIC)
+        end = len(data)
+        try:
+            while pos < end:
+                op = data[pos]
+                pos += 1
+                args = []
+                for t in OPS[op][1]:
+                    if t == "s":
+                        length, pos = read_varint(data, pos)
+                        if pos + length > end:
+                            raise IndexError
+                        args.append(data[pos:pos+length].decode("utf-8"))
+                        pos += length
+                    elif t == "i":
+                        value, pos = read_varint(data, pos)
+                        args.append(value)
+                    elif t == "b":
+                        args.append(data[pos] == 1)
+                        pos += 1
+                    else:
+                        args.append(KEYS[data[pos]])
+                        pos += 1
+                entries.append((op, tuple(args)))
+        except (IndexError, UnicodeDecodeError):
+            raise JournalError("truncated or corrupt journal at byte %s" % pos)
+        return cls(entries)
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    # ================================ REPLAY ================================ #
+
+    def replay(self, tm, batch=0):
+        """Replays the journal on TreeManager `tm`. If `batch` is given, up to
+        `batch` consecutive edits are reparsed only once, after the last of
+        them. This results in the same text, but parse trees containing errors
+        may differ, as error recovery depends on the previous parse. Batching
+        is disabled if language boxes are inserted automatically, as these
+        depend on the result of every reparse."""
+        handlers = get_handlers()
+        if tm.option_autolbox_insert:
+            batch = 0
+        pending = 0
+        try:
+            for op, args in self.entries:
+                if batch:
+                    if op in BATCHABLE:
+                        if pending == 0:
+                            tm.defer_reparse()
+                        pending += 1
+                    elif pending:
+                        tm.flush_reparse()
+                        pending = 0
+                handlers[op](tm, *args)
+                if pending >= batch > 0:
+                    tm.flush_reparse()
+                    pending = 0
+        finally:
+            if pending:
+                tm.flush_reparse()
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def parse_line(line):
+    """Converts a line of a text log into a journal entry."""
+    body = ast.parse(line).body
+    if len(body) != 1:
+        raise ValueError("expected a single statement")
+    stmt = body[0]
+    if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+        target = attribute_path(stmt.targets[0])
+        if target == "cursor.line":
+            line = literal(stmt.value)
+            if type(line) is not int:
+                raise ValueError("invalid line %r" % (line,))
+            return OPCODES[target], (line,)
+        if target in ("selection_start", "selection_end") and \
+                isinstance(stmt.value, ast.Call) and attribute_path(stmt.value.func) == "cursor.copy":
+            return OPCODES[target], ()
+    elif isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call):
+        call = stmt.value
+        name = attribute_path(call.func)
+        if name == "key_escape" and len(call.args) == 1:
+            # older logs recorded ctrl_cursor like this
+            name = "ctrl_cursor"
+        if name in OPCODES and name != "language":
+            _, types, defaults = OPS[OPCODES[name]]
+            args = [literal(a) for a in call.args]
+            if call.keywords:
+                raise ValueError("keyword arguments are not supported")
+            missing = len(types) - len(args)
+            if missing < 0 or missing > len(defaults):
+                raise ValueError("wrong number of arguments")
+            args.extend(defaults[len(defaults)-missing:])
+            for arg, t in zip(args, types):
+                expected = {"s": str, "i": int, "b": bool, "k": str}[t]
+                if type(arg) is not expected or (t == "k" and arg not in KEYS):
+                    raise ValueError("invalid argument %r" % (arg,))
+            return OPCODES[name], tuple(args)
+    raise ValueError("unsupported statement")
+
+def attribute_path(node):
+    """Returns the attributes of `self` (or of the fuzzy tester's
+    `self.treemanager`) accessed by `node`, e.g. "cursor.line"."""
+    names = []
+    while isinstance(node, ast.Attribute):
+        names.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name) or node.id != "self":
+        return None
+    names.reverse()
+    if names[:1] == ["treemanager"]:
+        names = names[1:]
+    return ".".join(names)
+
+def literal(node):
+    if isinstance(node, ast.Name) and node.id in KEY_NAMES:
+        return KEY_NAMES[node.id]
+    return ast.literal_eval(node)
+
+_handlers = None
+
+def get_handlers():
+    """Returns the function replaying each opcode, indexed by opcode."""
+    global _handlers
+    if _handlers is not None:
+        return _handlers
+    from treemanager import TreeManager
+    from grammars.grammars import lang_dict
+    from utils import KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT
+    keys = {"up": KEY_UP, "down": KEY_DOWN, "left": KEY_LEFT, "right": KEY_RIGHT}
+
+    def move(tm, key, times):
+        key = keys[key]
+        for i in range(times):
+            tm.cursor_movement(key)
+
+    def set_selection(name):
+        def handler(tm):
+            setattr(tm, name, tm.cursor.copy())
+        return handler
+
+    def with_language(method):
+        return lambda tm, name: method(tm, lang_dict[name])
+
+    def with_key(method):
+        return lambda tm, key, *args: method(tm, keys[key], *args)
+
+    special = {
+        "language": lambda tm, name: None,
+        "cursor.line": lambda tm, line: setattr(tm.cursor, "line", line),
+        "cursor.move_to_x": lambda tm, x: tm.cursor.move_to_x(x),
+        "selection_start": set_selection("selection_start"),
+        "selection_end": set_selection("selection_end"),
+        "move": move,
+        "key_cursors": with_key(TreeManager.key_cursors),
+        "ctrl_cursor": with_key(TreeManager.ctrl_cursor),
+        "cursor_movement": with_key(TreeManager.cursor_movement),
+        "add_languagebox": with_language(TreeManager.add_languagebox),
+        "surround_with_languagebox": with_language(TreeManager.surround_with_languagebox),
+        "change_languagebox": with_language(TreeManager.change_languagebox),
+    }
+    _handlers = [special.get(name) or getattr(TreeManager, name) for name, _, _ in OPS]
+    return _handlers
+
+def main(argv=None):
+    optp = OptionParser(usage="usage: %prog convert LOGFILE JOURNAL\n"
+                        "       %prog dump JOURNAL\n"
+                        "       %prog replay [options] JOURNAL|LOGFILE\n\n"
+                        "Converts text input logs into journals, prints journals as text logs and\n"
+                        "replays journals or logs.")
+    optp.add_option("-l", "--language", default=None, help="Language to replay logs without a '# Main language' line in")
+    optp.add_option("-b", "--batch", type="int", default=0, help="Reparse up to this many consecutive edits at once [default: %default]")
+    optp.add_option("-t", "--text", action="store_true", default=False, help="Print the text after replaying")
+    (options, args) = optp.parse_args(argv)
+    if not args or args[0] not in ("convert", "dump", "replay") or \
+            len(args) != {"convert": 3, "dump": 2, "replay": 2}[args[0]]:
+        optp.print_help()
+        return 2
+    command = args[0]
+
+    def read(filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+        if data.startswith(MAGIC):
+            return Journal.from_bytes(data)
+        return Journal.from_inputlog(data.decode("utf-8"))
+
+    try:
+        journal = read(args[1])
+    except JournalError as e:
+        sys.stderr.write("%s: %s\n" % (args[1], e))
+        return 1
+
+    if command == "convert":
+        journal.save(args[2])
+        return 0
+    if command == "dump":
+        print(journal.to_inputlog())
+        return 0
+
+    from grammars.grammars import lang_dict
+    from treemanager import TreeManager
+    language = journal.get_language() or options.language
+    if not language:
+        optp.error("the log has no '# Main language' line, use --language")
+    sys.setrecursionlimit(10000)
+    lang = lang_dict[language]
+    parser, lexer = lang.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, lang.name)
+    start = time.perf_counter()
+    journal.replay(tm, options.batch)
+    sys.stderr.write("Replayed %s entries in %.2fs, parse %s\n" % (len(journal.entries),
+                     time.perf_counter() - start, "ok" if parser.last_status else "failed"))
+    if options.text:
+        print(tm.export_as_text())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,8 +19,20 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-import json, gzip, sys
-sys.setrecursionlimit(2000)
+"""Loading and saving of .eco files.
+
+Files are gzipped JSON documents of the form {"root": node, "language": ...,
+"whitespaces": ...}, where each node is an object containing its class,
+symbol and text, some state, its children and, for language boxes, the root
+of the nested tree. Both directions work incrementally and use an explicit
+stack instead of recursion, so neither the depth of the tree nor the size of
+the file is limited by the recursion limit or by having to hold the whole
+document in memory. Nodes are created as soon as their JSON object has been
+read, which also means that the order of the keys within an object doesn't
+matter (files written by older versions of Eco use a different order)."""
+
+import json, gzip, io, re
+from json.decoder import scanstring
 
 from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal
 from incparser.astree import TextNode, BOS, EOS, ImageNode, FinishSymbol, MultiTextNode
@@ -29,70 +41,182 @@ try:
 except ImportError:
     from PyQt5.QtGui import QImage
 
+CHUNKSIZE = 1 << 16
+_WS = r'[ \t\n\r]*'
+_STRING = r'"((?:[^"\\]|\\.)*)"'
+_LITERAL = r'([^ \t\n\r{}\[\]:,"]+)'
+# Commas are skipped, and keys are read together with their value (or the
+# bracket that opens it), which roughly halves the number of tokens. A string
+# is only taken to be a value if it isn't followed by a colon or the end of
+# the buffer, so a key whose value is cut off by the end of a chunk is never
+# mistaken for one.
+TOKEN = re.compile(r'[ \t\n\r,]*(?:' + _STRING + _WS + ':' + _WS + r'(?:' + _STRING + '|' + _LITERAL + r'|([{\[]))'
+                   + r'|([{}\[\]])|' + _STRING + r'(?!' + _WS + r'(?::|\Z))|' + _LITERAL + ')')
+LITERALS = {"true": True, "false": False, "null": None}
+
+def _literal(s):
+    try:
+        return LITERALS[s]
+    except KeyError:
+        return json.loads(s)
+
 class JsonManager(object):
     def __init__(self, unescape=False):
         self.last_terminal = None
         self.language_boxes = []
         self.unescape = unescape
+        self.terminal_stack = []
 
-    def save(self, root, language, whitespaces, filename):
-        main = {}
-        root_json = self.node_to_json(root)
-        main["root"] = root_json
-        main["language"] = language
-        main["whitespaces"] = whitespaces
-
+    def save(self, root, language, whitespaces, filename, version=None):
         z = gzip.open(str(filename), "wb")
-        z.write(json.dumps(main).encode("ascii"))
-        z.close()
-
-    def load(self, filename):
         try:
-            z = gzip.open(str(filename), "rb")
-            main = json.loads(z.read())
+            self.write(root, language, whitespaces, z, version)
+        finally:
             z.close()
-        except IOError:
+
+    def write(self, root, language, whitespaces, fp, version=None):
+        """Writes the tree below `root` to the binary file `fp` in chunks.
+        The output is the same as `json.dumps` would produce for the nested
+        dictionaries that older versions of Eco built for the whole tree. If
+        `version` is given, the tree is written as it was in that version."""
+        dumps = json.dumps
+        buf = ['{"root": ']
+        stack = ['}', dumps(whitespaces), ', "whitespaces": ', dumps(language), ', "language": ', root]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                buf.append(item)
+                if len(buf) > 4096:
+                    fp.write("".join(buf).encode("ascii"))
+                    buf = []
+                continue
+            node = item
+            children, nested_errors, local_error, textlen, text, lookup, _ = node.saved_state(version)
+            head = dumps({
+                "class": node.__class__.__name__,
+                "symbol": node.symbol.__class__.__name__,
+                "text": text,
+                "lookup": lookup,
+                "local_error": local_error,
+                "nested_errors": nested_errors,
+                "image_src": node.image_src,
+                "textlen": textlen,
+            })
+            buf.append(head[:-1])
+            stack.append("]}")
+            for i in range(len(children) - 1, -1, -1):
+                stack.append(children[i])
+                if i > 0:
+                    stack.append(", ")
+            if isinstance(node.symbol, MagicTerminal):
+                stack.append(', "language": %s, "whitespaces": true, "children": [' % dumps(text[1:-1]))
+                stack.append(node.symbol.ast)
+                stack.append(', "lbox": ')
+            else:
+                stack.append(', "children": [')
+        fp.write("".join(buf).encode("ascii"))
+
+    def load(self, filename):
+        import binarymanager
+        with open(filename, "rb") as fp:
+            magic = fp.read(len(binarymanager.MAGIC))
+        if magic == binarymanager.MAGIC:
+            return binarymanager.BinaryManager().load(filename)
+        if magic[:2] == b"\x1f\x8b":
+            fp = io.TextIOWrapper(gzip.open(str(filename), "rb"), encoding="utf-8")
+        else:
             # backwards compatibility
             fp = open(filename, "r")
-            main = json.load(fp)
+        try:
+            main = self.read(fp)
+        finally:
             fp.close()
 
         language = main["language"]
-        root_json = main["root"]
+        root = main["root"]
         whitespaces = main["whitespaces"]
-        root = self.json_to_node(root_json)
         self.language_boxes.append((root, language, whitespaces))
         self.language_boxes.reverse()
         return self.language_boxes
 
-    # XXX create Class for this task
-    def node_to_json(self, node):
-        # need lookup, image, symbol
-        jsnode = {}
-        jsnode["class"] = node.__class__.__name__
-        jsnode["symbol"] = node.symbol.__class__.__name__
-        jsnode["text"] = node.symbol.name
-        jsnode["lookup"] = node.lookup
-        jsnode["local_error"] = node.local_error
-        jsnode["nested_errors"] = node.nested_errors
-        jsnode["image_src"] = node.image_src
-        jsnode["textlen"] = node.textlen
-
-        children = []
-        for c in node.children:
-            c_json = self.node_to_json(c)
-            children.append(c_json)
-
-        if isinstance(node.symbol, MagicTerminal):
-            root = self.node_to_json(node.symbol.ast)
-            jsnode["lbox"] = root
-            jsnode["language"] = node.symbol.name[1:-1]
-            jsnode["whitespaces"] = True
-
-        jsnode["children"] = children
-        return jsnode
-
-    def json_to_node(self, jsnode):
+    def read(self, fp):
+        """Reads a JSON document from the text file `fp`, turning every node
+        object into a node as soon as it has been read. Returns the outermost
+        object."""
+        match = TOKEN.match
+        buf = ""
+        buflen = pos = 0
+        eof = False
+        stack = []  # objects and arrays that are being read
+        keys = []   # the current key of each object on the stack
+        while True:
+            m = match(buf, pos)
+            if m is None or (m.end() == buflen and not eof):
+                # The next token may continue in the next chunk
+                if eof:
+                    if buf[pos:].strip():
+                        raise ValueError("Invalid JSON at: %r" % buf[pos:pos+20])
+                    raise ValueError("Unexpected end of JSON data")
+                data = fp.read(CHUNKSIZE)
+                if not data:
+                    eof = True
+                buf = buf[pos:] + data
+                buflen = len(buf)
+                pos = 0
+                continue
+            pos = m.end()
+            key, string, literal, opening, punct, string2, literal2 = m.groups()
+            if key is not None:
+                if "\\" in key:
+                    key = scanstring(buf, m.start(1))[0]
+                if opening is None:
+                    if string is not None:
+                        if "\\" in string:
+                            string = scanstring(buf, m.start(2))[0]
+                        stack[-1][key] = string
+                    else:
+                        stack[-1][key] = _literal(literal)
+                    continue
+                keys[-1] = key
+                if key == "lbox":
+                    # Language boxes are linked separately
+                    self.terminal_stack.append(self.last_terminal)
+                    self.last_terminal = None
+                punct = opening
+            if punct is not None:
+                if punct == "{":
+                    stack.append({})
+                    keys.append(None)
+                    continue
+                if punct == "[":
+                    stack.append([])
+                    keys.append(None)
+                    continue
+                keys.pop()
+                value = stack.pop()
+                if punct == "}":
+                    value = self.object_to_node(value)
+            elif string2 is not None:
+                if "\\" in string2:
+                    string2 = scanstring(buf, m.start(6))[0]
+                value = string2
+            else:
+                value = _literal(literal2)
+
+            if not stack:
+                return value
+            top = stack[-1]
+            if type(top) is list:
+                top.append(value)
+            else:
+                key = keys[-1]
+                top[key] = value
+                if key == "lbox":
+                    self.last_terminal = self.terminal_stack.pop()
+
+    def object_to_node(self, jsnode):
+        if "class" not in jsnode:
+            return jsnode
         node_class = globals()[jsnode["class"]]
         node_symbol = globals()[jsnode["symbol"]]
 
@@ -114,6 +238,14 @@ class JsonManager(object):
         if node.image_src is not None:
             node.image = QImage(node.image_src)
 
+        children = jsnode["children"]
+        first = None
+        if node_class is MultiTextNode and children:
+            # The children have been linked before their parent was created,
+            # but the parent needs to come first
+            first = children[0]
+            self.last_terminal = first.prev_term
+
         if isinstance(symbol, Terminal) or isinstance(symbol, FinishSymbol):
             node.prev_term = self.last_terminal
             if self.last_terminal is not None:
@@ -121,27 +253,23 @@ class JsonManager(object):
                 self.last_terminal.save(0)
             self.last_terminal = node
 
+        if first is not None:
+            first.prev_term = self.last_terminal
+            if self.last_terminal is not None:
+                self.last_terminal.next_term = first
+                self.last_terminal.save(0)
+
         if "lbox" in jsnode:
-            temp = self.last_terminal
-            self.last_terminal = None
-            lbox_root = self.json_to_node(jsnode["lbox"])
-            lbox_root.magic_backpointer = node
-            node.symbol.ast = lbox_root
-            node.symbol.parser = lbox_root
-            self.last_terminal = temp
-            self.language_boxes.append((lbox_root, jsnode["language"], jsnode["whitespaces"]))
-
-        children = []
+            self.add_language_box(node, jsnode["lbox"], jsnode["language"], jsnode["whitespaces"])
+
         last_child = None
-        for c in jsnode["children"]:
-            cnode = self.json_to_node(c)
+        for cnode in children:
             cnode.parent = node
             cnode.left = last_child
             if last_child:
                 last_child.right = cnode
                 last_child.save(0)
             cnode.save(0)
-            children.append(cnode)
             last_child = cnode
         node.children = children
         if node_class is MultiTextNode:
@@ -151,3 +279,9 @@ class JsonManager(object):
         node.save(0)
 
         return node
+
+    def add_language_box(self, node, lbox_root, language, whitespaces):
+        lbox_root.magic_backpointer = node
+        node.symbol.ast = lbox_root
+        node.symbol.parser = lbox_root
+        self.language_boxes.append((lbox_root, language, whitespaces))
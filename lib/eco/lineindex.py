@@ -0,0 +1,456 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Index of the lines shown in the editor.
+
+Lines are kept in a treap (a randomly balanced binary search tree ordered by
+line number) whose nodes are the `Line` objects themselves. Every line knows
+its parent, and every subtree stores its number of lines, the sum of their
+heights and their maximum width. This gives O(log n) access by line number,
+O(log n) line numbers for lines and their newline nodes, O(log n) conversion
+between line numbers and visual rows (lines containing images are higher than
+one row), and O(log n) inserts and deletes.
+
+Instead of copying all lines whenever they are saved, the index records
+inserts and deletes. Saving a version stores the changes made since the
+previous save, linked to the state they were made on, so all versions share
+the same lines. Loading a version reverts and reapplies the changes between
+the current state and that version."""
+
+from random import random
+
+def compact_dict(d, version):
+    """Removes all entries of a version keyed dictionary that are older than
+    `version`, except for the one that is still valid at `version`."""
+    older = [v for v in d if v < version]
+    if version in d or not older:
+        keep = None
+    else:
+        keep = max(older)
+    for v in older:
+        if v != keep:
+            del d[v]
+
+INSERT = 0
+DELETE = 1
+
+class Line(object):
+    """Representation of a source code line.
+
+    Has a reference to the node at the beginning of that line and stores the
+    lines width and height values.
+    """
+    def __init__(self, node, height=1):
+        self.node = node        # this lines newline node
+        self._height = height   # line height
+        self._width = 0         # line width
+        self.indent = 0         # line indentation
+        self.ws = 0
+
+        # treap node
+        self._index = None
+        self._parent = None
+        self._left = None
+        self._right = None
+        self._priority = random()
+        self._size = 1
+        self._rows = height
+        self._maxwidth = 0
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, height):
+        if height != self._height:
+            self._height = height
+            self._update()
+
+    @property
+    def width(self):
+        return self._width
+
+    @width.setter
+    def width(self, width):
+        if width != self._width:
+            self._width = width
+            self._update()
+
+    def _update(self):
+        if self._index is not None:
+            line = self
+            while line is not None:
+                line._pull()
+                line = line._parent
+
+    def _pull(self):
+        """Recomputes the values of this subtree from its children."""
+        size = 1
+        rows = self._height
+        width = self._width
+        left = self._left
+        if left is not None:
+            size += left._size
+            rows += left._rows
+            if left._maxwidth > width:
+                width = left._maxwidth
+        right = self._right
+        if right is not None:
+            size += right._size
+            rows += right._rows
+            if right._maxwidth > width:
+                width = right._maxwidth
+        self._size = size
+        self._rows = rows
+        self._maxwidth = width
+
+    def __repr__(self):
+        return "Line(%s, width=%s, height=%s)" % (self.node, self.width, self.height)
+
+class Snapshot(object):
+    """The lines of a saved version, stored as the changes made to the lines
+    of the parent snapshot."""
+
+    def __init__(self, parent, changes):
+        self.parent = parent
+        self.changes = changes
+        self.depth = parent.depth + 1 if parent else 0
+
+class LineIndex(object):
+    """List-like sequence of `Line` objects. See the module docstring."""
+
+    def __init__(self):
+        self.root = None
+        self.nodes = {}         # newline node -> line
+        self.changes = []       # changes since the last save or load
+        self.base = Snapshot(None, [])
+        self.saved = {}         # version -> snapshot
+
+    def __len__(self):
+        if self.root is None:
+            return 0
+        return self.root._size
+
+    def __iter__(self):
+        stack = []
+        line = self.root
+        while stack or line is not None:
+            while line is not None:
+                stack.append(line)
+                line = line._left
+            line = stack.pop()
+            yield line
+            line = line._right
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        return self.get(i)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for j in sorted(range(*i.indices(len(self))), reverse=True):
+                self.remove(j)
+            return
+        self.remove(i)
+
+    def __repr__(self):
+        return "LineIndex(%s)" % (list(self),)
+
+    @property
+    def rows(self):
+        """Total number of visual rows."""
+        if self.root is None:
+            return 0
+        return self.root._rows
+
+    @property
+    def width(self):
+        """Width of the longest line."""
+        if self.root is None:
+            return 0
+        return self.root._maxwidth
+
+    def get(self, i):
+        size = len(self)
+        if i < 0:
+            i += size
+        if not 0 <= i < size:
+            raise IndexError("line index out of range")
+        line = self.root
+        while True:
+            left = line._left
+            lsize = left._size if left is not None else 0
+            if i < lsize:
+                line = left
+            elif i == lsize:
+                return line
+            else:
+                i -= lsize + 1
+                line = line._right
+
+    def index(self, line):
+        """Returns the line number of `line`."""
+        if line._index is not self:
+            raise ValueError("%r is not in the index" % (line,))
+        i = line._left._size if line._left is not None else 0
+        while line._parent is not None:
+            parent = line._parent
+            if parent._right is line:
+                i += 1
+                if parent._left is not None:
+                    i += parent._left._size
+            line = parent
+        return i
+
+    def find(self, node):
+        """Returns the number of the line starting with the newline node
+        `node` (or None)."""
+        line = self.nodes.get(node)
+        if line is None or line._index is not self or line.node is not node:
+            return None
+        return self.index(line)
+
+    def row_of(self, i):
+        """Returns the first visual row of line `i`."""
+        if i >= len(self):
+            return self.rows
+        rows = 0
+        line = self.root
+        while True:
+            left = line._left
+            lsize = left._size if left is not None else 0
+            if i < lsize:
+                line = left
+                continue
+            if left is not None:
+                rows += left._rows
+            if i == lsize:
+                return rows
+            rows += line._height
+            i -= lsize + 1
+            line = line._right
+
+    def line_at_row(self, row):
+        """Returns the number of the line shown at visual row `row` and the
+        first row of that line. Rows below the last line map to the last
+        line."""
+        if self.root is None:
+            raise IndexError("no lines")
+        if row <= 0:
+            return 0, 0
+        if row >= self.rows:
+            last = self.get(-1)
+            return len(self) - 1, self.rows - last._height
+        i = start = 0
+        line = self.root
+        while True:
+            left = line._left
+            if left is not None:
+                if row < left._rows:
+                    line = left
+                    continue
+                row -= left._rows
+                start += left._rows
+                i += left._size
+            if row < line._height:
+                return i, start
+            row -= line._height
+            start += line._height
+            i += 1
+            line = line._right
+
+    # Modifications are recorded so they can be saved
+
+    def insert(self, i, line):
+        size = len(self)
+        if i < 0:
+            i = max(0, i + size)
+        i = min(i, size)
+        self._insert(i, line)
+        self.changes.append((INSERT, i, line))
+
+    def append(self, line):
+        self.insert(len(self), line)
+
+    def remove(self, i):
+        if i < 0:
+            i += len(self)
+        line = self.get(i)
+        self._remove(line)
+        self.changes.append((DELETE, i, line))
+
+    def _insert(self, i, line):
+        assert line._index is None
+        line._index = self
+        line._left = line._right = line._parent = None
+        line._pull()
+        self.nodes[line.node] = line
+        if self.root is None:
+            self.root = line
+            return
+        parent = self.root
+        while True:
+            left = parent._left
+            lsize = left._size if left is not None else 0
+            if i <= lsize:
+                if left is None:
+                    parent._left = line
+                    break
+                parent = left
+            else:
+                i -= lsize + 1
+                if parent._right is None:
+                    parent._right = line
+                    break
+                parent = parent._right
+        line._parent = parent
+        while parent is not None:
+            parent._pull()
+            parent = parent._parent
+        while line._parent is not None and line._priority < line._parent._priority:
+            self._rotate_up(line)
+
+    def _remove(self, line):
+        while line._left is not None and line._right is not None:
+            if line._left._priority < line._right._priority:
+                self._rotate_up(line._left)
+            else:
+                self._rotate_up(line._right)
+        child = line._left if line._left is not None else line._right
+        parent = line._parent
+        if child is not None:
+            child._parent = parent
+        if parent is None:
+            self.root = child
+        elif parent._left is line:
+            parent._left = child
+        else:
+            parent._right = child
+        while parent is not None:
+            parent._pull()
+            parent = parent._parent
+        line._index = line._parent = line._left = line._right = None
+        if self.nodes.get(line.node) is line:
+            del self.nodes[line.node]
+
+    def _rotate_up(self, line):
+        parent = line._parent
+        grandparent = parent._parent
+        if parent._left is line:
+            parent._left = line._right
+            if line._right is not None:
+                line._right._parent = parent
+            line._right = parent
+        else:
+            parent._right = line._left
+            if line._left is not None:
+                line._left._parent = parent
+            line._left = parent
+        parent._parent = line
+        line._parent = grandparent
+        if grandparent is None:
+            self.root = line
+        elif grandparent._left is parent:
+            grandparent._left = line
+        else:
+            grandparent._right = line
+        parent._pull()
+        line._pull()
+
+    # Versions
+
+    def save(self, version):
+        if self.changes:
+            self.base = Snapshot(self.base, self.changes)
+            self.changes = []
+        self.saved[version] = self.base
+
+    def load(self, version):
+        """Restores the lines of `version` (or of the closest earlier version
+        that was saved)."""
+        while True:
+            if version == 0:
+                return
+            if version in self.saved:
+                break
+            version -= 1
+        target = self.saved[version]
+        self._revert(self.changes)
+        self.changes = []
+        # Walk up to the common ancestor of both snapshots
+        current = self.base
+        redo = []
+        other = target
+        while current.depth > other.depth:
+            self._revert(current.changes)
+            current = current.parent
+        while other.depth > current.depth:
+            redo.append(other)
+            other = other.parent
+        while current is not other:
+            self._revert(current.changes)
+            current = current.parent
+            redo.append(other)
+            other = other.parent
+        for snapshot in reversed(redo):
+            self._apply(snapshot.changes)
+        self.base = target
+
+    def truncate(self, version):
+        """Forgets all versions after `version`."""
+        for v in list(self.saved):
+            if v > version:
+                del self.saved[v]
+
+    def compact(self, version):
+        """Forgets all versions before `version`, except for the one that is
+        still valid at `version`. Changes that are no longer needed to move
+        between the remaining versions are discarded."""
+        compact_dict(self.saved, version)
+        root = self.base
+        for snapshot in self.saved.values():
+            other = snapshot
+            while root.depth > other.depth:
+                root = root.parent
+            while other.depth > root.depth:
+                other = other.parent
+            while root is not other:
+                root = root.parent
+                other = other.parent
+        root.parent = None
+        root.changes = []
+
+    def _apply(self, changes):
+        for kind, i, line in changes:
+            if kind == INSERT:
+                self._insert(i, line)
+            else:
+                self._remove(self.get(i))
+
+    def _revert(self, changes):
+        for kind, i, line in reversed(changes):
+            if kind == INSERT:
+                self._remove(self.get(i))
+            else:
+                self._insert(i, line)
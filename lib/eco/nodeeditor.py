@@ -34,6 +34,8 @@ from grammar_parser.gparser import MagicTerminal, IndentationTerminal
 from grammar_parser.bootstrap import ListNode, AstNode
 from incparser.astree import BOS, EOS, MultiTextNode
 from jsonmanager import JsonManager
+from binarymanager import BinaryManager, is_binary
+from backgroundworker import BackgroundWorker, WriteJob, AnalysisJob
 from utils import KeyPress
 from overlay import Overlay
 from incparser.annotation import Footnote, Heatmap, Railroad, ToolTip
@@ -43,7 +45,9 @@ from incparser.astree import TextNode
 import syntaxhighlighter
 import renderers
 
-import logging
+from collections import deque
+import logging, time
+import config
 
 whitelist = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890!\"$%^&*()_-+=;:'@#~[]{},.<>/?|\\`\r ")
 
@@ -72,6 +76,8 @@ class NodeEditor(QFrame):
         self.viewport_y = 0 # top visible line
         self.imagemode = False
         self.image = None
+        self.binaryfile = False # save in the format the file was loaded from
+        self.unparsed_boxes = set() # painted boxes that still need parsing
 
         self.scroll_height = 0
         self.scroll_width = 0
@@ -81,6 +87,10 @@ class NodeEditor(QFrame):
         self.timer.timeout.connect(self.analysis_timer)
         self.backuptimer.timeout.connect(self.backup_timer)
         self.backuptimer.start(30000)
+        # analysis, swap and backup files are done in the background
+        self.worker = BackgroundWorker()
+        self.workertimer = QTimer(self)
+        self.workertimer.timeout.connect(self.poll_worker)
         self.undotimer = QTimer(self)
         self.undotimer.timeout.connect(self.trigger_undotimer)
 
@@ -106,6 +116,37 @@ class NodeEditor(QFrame):
 
         self.autolboxlines = {}
 
+        self.paint_start = (0, 0)   # first line in the viewport and its row
+        self.paint_origin = (0, 0)  # first line of the last repaint and its row
+        self.end_line = 0
+        self.frame_times = deque(maxlen=100) # milliseconds per repaint
+        self.slow_frames = 0
+        # Pictures of the painted lines (see paint_cached_lines). Entries are
+        # keyed by Line and discarded when one of their nodes changes.
+        self.line_cache = {}
+        self.line_cache_nodes = {}  # id(node) -> Line it was painted in
+        self.line_cache_key = None
+        self.line_cache_errors = set()
+        self.read_settings()
+
+    def read_settings(self):
+        """Reads the settings needed for painting, so that they don't have to
+        be read on every repaint."""
+        settings = QSettings("softdev", "Eco")
+        if settings.value("app_theme", "Light", type=str) in ["Dark", "Gruvbox"]:
+            self.lbox_alpha = 100
+            self.highlight_line_color = QColor(250,250,250,20)
+        else:
+            self.lbox_alpha = 60
+            self.highlight_line_color = QColor(0,0,0,10)
+        self.show_highlight_line = settings.value("highlight_line", False, type=bool)
+
+    def update_theme(self):
+        syntaxhighlighter.reset_highlighters()
+        self.read_settings()
+        self.invalidate_layout()
+        self.update()
+
     def hud_show_callgraph(self):
         self.hud_callgraph = True
         self.hud_eval = False
@@ -150,9 +191,7 @@ class NodeEditor(QFrame):
 
     def analysis_timer(self):
         if self.getWindow().show_namebinding():
-            if self.tm.analyse() is not False:
-                self.update()
-                self.getWindow().updateASTOutline()
+            self.submit("analysis", AnalysisJob(self.tm, self.analysis_finished))
         self.timer.stop()
 
         # save swap
@@ -160,6 +199,10 @@ class NodeEditor(QFrame):
         if filename:
             self.saveToJson(filename + ".swp", True)
 
+    def analysis_finished(self, outline):
+        self.update()
+        self.getWindow().updateASTOutline(outline)
+
     def backup_timer(self):
         filename = self.getEditorTab().filename
         if filename:
@@ -170,7 +213,7 @@ class NodeEditor(QFrame):
             self.show_cursor = True
             return
         self.show_cursor ^= True
-        self.update()
+        self.update_lines(self.tm.cursor.line)
 
     def trigger_undotimer(self):
         self.tm.undo_snapshot()
@@ -267,21 +310,35 @@ class NodeEditor(QFrame):
         self.update()
 
     def getScrollSizes(self):
-        total_lines = 0
-        max_width = 0
-        for l in self.lines:
-            total_lines += l.height
-            max_width = max(max_width, l.width)
+        total_lines = self.lines.rows
+        max_width = self.lines.width
         max_visible_lines = self.geometry().height() / self.fontht
         self.scroll_height = max(0, total_lines - max_visible_lines)
 
         current_width = self.parentWidget().geometry().width() / self.fontwt
         self.scroll_width = max(0, max_width - current_width)
 
+    def update_lines(self, first, last=None):
+        """Repaints lines `first` to `last` only. Each line is painted within
+        the rows it occupies, starting 3 pixels down."""
+        if last is None:
+            last = first
+        lines = self.tm.lines
+        if first >= len(lines):
+            return
+        fontht = QApplication.instance().gfont.fontht
+        top = lines.row_of(first) - self.viewport_y
+        bottom = lines.row_of(last + 1) - self.viewport_y
+        self.update(QRect(0, 3 + top * fontht, self.width(), (bottom - top) * fontht))
+
     def paintEvent(self, event):
-        # Clear data in the visualisation overlay
-        self.overlay.clear_data()
-        self.autolboxlines.clear()
+        start = time.time()
+        full = event.rect().contains(self.rect())
+        if full:
+            # Clear data in the visualisation overlay
+            self.overlay.clear_data()
+            self.autolboxlines.clear()
+        rows = self.tm.lines.rows
 
         gfont = QApplication.instance().gfont
         self.font = gfont.font
@@ -302,37 +359,37 @@ class NodeEditor(QFrame):
         # calculate how many lines we need to show
         self.init_height = self.geometry().height()
 
-        self.paintLines(paint, self.viewport_y)
+        if full or self.imagemode:
+            self.paintLines(paint, self.viewport_y)
+        else:
+            self.paintLines(paint, self.viewport_y, event.rect())
 
         paint.end()
 
-        total_lines = 0
-        max_width = 0
-        for l in self.lines:
-            total_lines += l.height
-            max_width = max(max_width, l.width)
-        max_visible_lines = self.geometry().height() / self.fontht
-        self.scroll_height = max(0, total_lines - max_visible_lines)
-
-        current_width = self.parentWidget().geometry().width() / self.fontwt
-        self.scroll_width = max(0, max_width - current_width)
+        self.getScrollSizes()
 
-        railroad_annotations = self.tm.get_all_annotations_with_hint(Railroad)
-        self.overlay.add_railroad_data(railroad_annotations)
+        if full and self.hud_callgraph:
+            railroad_annotations = self.tm.get_all_annotations_with_hint(Railroad)
+            self.overlay.add_railroad_data(railroad_annotations)
+        elif not full and self.tm.lines.rows != rows:
+            # A line changed its height, so all lines below it moved
+            self.update()
 
         self.sig_painted.emit()
+        self.record_frame(time.time() - start)
+
+    def record_frame(self, seconds):
+        ms = seconds * 1000
+        self.frame_times.append(ms)
+        if ms > config.FRAME_BUDGET:
+            self.slow_frames += 1
+            logging.debug("Repaint took %.1fms (budget: %sms)" % (ms, config.FRAME_BUDGET))
 
     # paint lines using new line manager
-    def paintLines(self, paint, startline):
+    def paintLines(self, paint, startline, rect=None):
 
         # find internal line corresponding to visual line
-        visual_line = 0
-        internal_line = 0
-        for l in self.tm.lines:
-            if visual_line + l.height > startline:
-                break
-            visual_line += l.height
-            internal_line += 1
+        internal_line, visual_line = self.tm.lines.line_at_row(startline)
 
         x = 0
         y = visual_line - startline # start drawing outside of viewport to display partial images
@@ -340,10 +397,128 @@ class NodeEditor(QFrame):
 
         max_y = self.geometry().height() / self.fontht
 
-        line = internal_line
-        node = self.tm.lines[line].node
+        if rect is not None:
+            # only repaint the lines within rect
+            internal_line, visual_line = self.tm.lines.line_at_row(startline + (rect.top() - 3) // self.fontht)
+            y = visual_line - startline
+            max_y = min(max_y, (rect.bottom() - 2) / self.fontht)
+        self.paint_origin = (internal_line, y)
 
-        _, _, self.end_line = self.paint_nodes(paint, node, x, y, line, max_y)
+        line = internal_line
+        if self.caches_lines():
+            end_line = self.paint_cached_lines(paint, line, y, max_y, rect is None)
+        else:
+            node = self.tm.lines[line].node
+            _, _, end_line = self.paint_nodes(paint, node, x, y, line, max_y, partial=rect is not None)
+        if rect is None:
+            self.end_line = end_line
+
+    def caches_lines(self):
+        """Lines are only cached if their pictures don't depend on the
+        selection or on tool data shown in the HUD."""
+        return not (self.imagemode or self.tm.hasSelection() or self.hud_callgraph
+                    or self.hud_eval or self.hud_heat_map or self.hud_types)
+
+    def paint_cached_lines(self, paint, line, y, max_y, full):
+        """Paints the lines from `line` on. Lines that haven't changed since
+        they were last painted are replayed from their cached pictures. The
+        cursor line is always painted directly."""
+        key = self.layout_key()
+        if key != self.line_cache_key:
+            self.invalidate_layout()
+            self.line_cache_key = key
+        self.invalidate_damage(repaint=not full)
+        lines = self.tm.lines
+        cursor_line = self.tm.cursor.line
+        painted = set()
+        while y < max_y and line < len(lines):
+            l = lines[line]
+            if line == cursor_line:
+                self.paint_nodes(paint, l.node, 0, y, line, max_y, partial=True, last_line=line)
+            else:
+                entry = self.line_cache.get(l)
+                if entry is None:
+                    entry = self.record_line(l, line)
+                picture, height, width, autobox, _ = entry
+                paint.drawPicture(QPointF(0, y * self.fontht), picture)
+                l.height = height
+                l.width = width
+                if autobox:
+                    self.autolboxlines[line] = list(autobox)
+                else:
+                    self.autolboxlines.pop(line, None)
+            painted.add(l)
+            y += l.height
+            line += 1
+        if full:
+            # only keep the lines that are visible
+            for l in list(self.line_cache):
+                if l not in painted:
+                    self.uncache_line(l)
+        return line
+
+    def record_line(self, l, line):
+        picture = QPicture()
+        paint = QtGui.QPainter()
+        paint.begin(picture)
+        paint.setFont(self.font)
+        nodes = []
+        self.paint_nodes(paint, l.node, 0, 0, line, float("inf"), partial=True, last_line=line, painted=nodes)
+        paint.end()
+        entry = (picture, l.height, l.width, self.autolboxlines.get(line), nodes)
+        self.line_cache[l] = entry
+        for node in nodes:
+            self.line_cache_nodes[id(node)] = l
+        return entry
+
+    def uncache_line(self, l):
+        entry = self.line_cache.pop(l)
+        for node in entry[4]:
+            if self.line_cache_nodes.get(id(node)) is l:
+                del self.line_cache_nodes[id(node)]
+
+    def invalidate_layout(self):
+        """Discards all cached lines."""
+        self.line_cache.clear()
+        self.line_cache_nodes.clear()
+
+    def layout_key(self):
+        """Returns the state the pictures of all lines depend on."""
+        window = self.getWindow()
+        return (self.tm, self.font, self.fontwt, self.fontht, self.width(), self.lbox_alpha,
+                self.tm.get_languagebox(self.tm.cursor.node),
+                window.show_languageboxes(), window.show_namebinding())
+
+    def get_error_nodes(self):
+        errors = set()
+        for parser, _, _, analyser, _ in self.tm.parsers:
+            errors.update(parser.error_nodes)
+            errors.update(node for node, _ in parser.error_pres)
+            if analyser:
+                errors.update(analyser.errors)
+        return errors
+
+    def invalidate_damage(self, repaint=True):
+        """Discards the cached lines containing nodes that have been changed
+        (or whose errors changed) since the last call. If `repaint` is set,
+        their rows are repainted."""
+        damage = self.tm.take_damage()
+        errors = self.get_error_nodes()
+        if damage is None:
+            self.invalidate_layout()
+            damage = []
+        damage.extend(errors.symmetric_difference(self.line_cache_errors))
+        self.line_cache_errors = errors
+        damaged = set()
+        for node in damage:
+            l = self.line_cache_nodes.get(id(node))
+            if l is not None:
+                damaged.add(l)
+        lines = self.tm.lines
+        for l in damaged:
+            self.uncache_line(l)
+            if repaint and l._index is lines:
+                self.update_lines(lines.index(l))
 
 
     #XXX if starting node is inside language box, init lbox with amount of language boxes
@@ -357,25 +532,16 @@ class NodeEditor(QFrame):
         self.cursor = self.tm.cursor
         return np.x, np.y, np.line
 
-    def paint_nodes(self, paint, node, x, y, line, max_y, lbox=0):
+    def paint_nodes(self, paint, node, x, y, line, max_y, lbox=0, partial=False, last_line=None, painted=None):
 
-        settings = QSettings("softdev", "Eco")
         colors = self.boxcolors
-        if settings.value("app_theme", "Light", type=str) in ["Dark"]:
-            alpha = 100
-            self.highlight_line_color = QColor(250,250,250,20)
-        elif settings.value("app_theme", "Light", type=str) in ["Gruvbox"]:
-            alpha = 100
-            self.highlight_line_color = QColor(250,250,250,20)
-        else:
-            alpha = 60
-            self.highlight_line_color = QColor(0,0,0,10)
-        self.show_highlight_line = settings.value("highlight_line", False, type=bool)
+        alpha = self.lbox_alpha
 
         first_node = node
         selected_language = self.tm.mainroot
 
         highlighter = self.get_highlighter(node)
+        self.box_painted(node.get_root())
         selection_start = min(self.tm.selection_start, self.tm.selection_end)
         selection_end = max(self.tm.selection_start, self.tm.selection_end)
         if selection_start.node is not selection_end.node:
@@ -396,8 +562,11 @@ class NodeEditor(QFrame):
         self.selected_lbox = self.tm.get_languagebox(self.tm.cursor.node)
         #XXX get initial x for langbox
 
-        if start_lbox:
+        # count the language boxes we start in
+        outer = start_lbox
+        while outer:
             lbox += 1
+            outer = self.get_languagebox(outer)
         if start_lbox and self.selected_lbox is start_lbox:
             draw_lbox = True
         else:
@@ -408,9 +577,13 @@ class NodeEditor(QFrame):
         self.lines = self.tm.lines
         self.cursor = self.tm.cursor
         self.lines[line].height = 1 # reset height
+        if partial:
+            self.autolboxlines.pop(line, None)
         draw_cursor = True
         show_namebinding = self.getWindow().show_namebinding()
         while y < max_y:
+            if painted is not None:
+                painted.append(node)
 
             # check if node is connected to auto lbox
             if node.autobox:
@@ -442,6 +615,7 @@ class NodeEditor(QFrame):
                     selected_language = lbnode
                 else:
                     draw_lbox = False
+                self.box_painted(lbnode)
                 node = lbnode.children[0]
                 highlighter = self.get_highlighter(node)
                 renderer = self.get_renderer(node)
@@ -547,10 +721,14 @@ class NodeEditor(QFrame):
                     paint.fillRect(QRectF(x,3+y*self.fontht, self.geometry().width()-x, self.fontht), color)
 
                 self.lines[line].width = x / self.fontwt
+                if line == last_line:
+                    break
                 x = 0
                 y += self.lines[line].height
                 line += 1
                 self.lines[line].height = 1 # reset height
+                if partial:
+                    self.autolboxlines.pop(line, None)
 
             if self.show_highlight_line:
                 if node.lookup == "<return>" or isinstance(node, BOS):
@@ -714,14 +892,14 @@ class NodeEditor(QFrame):
         if x1 + y1 + line1 + x2 + y2 + line2 == 0:
             # everything out of viewport, draw nothing
             # unless start and end are on opposite sides of the viewport
-            if not(start.line <= self.paint_start[0] and end.line >= self.paint_start[0] + max_y):
+            if not(start.line <= self.paint_origin[0] and end.line >= self.paint_origin[0] + max_y):
                     return
         if x1 + y1 + line1 == 0:
             # start outside of viewport
-            line1 = self.paint_start[0]
+            line1, y1 = self.paint_origin
         if x2 + y2 + line2 == 0:
             # end outside of viewport
-            line2 = self.paint_start[0] + max_y
+            line2 = self.paint_origin[0] + max_y
             y2 = max_y
         if y1 == y2:
             paint.fillRect(QRectF(x1, 3 + y1 * self.fontht, x2-x1, self.fontht), QColor(0,0,255,100))
@@ -737,6 +915,27 @@ class NodeEditor(QFrame):
                 y = y + self.tm.lines[i].height
             paint.fillRect(QRectF(0, 3 + y2 * self.fontht, x2, self.fontht), QColor(0,0,255,100))
 
+    def box_painted(self, root):
+        """Schedules the language box `root` to be parsed after painting if
+        it was loaded without being parsed (see TreeManager.load_file)."""
+        if not self.tm.unparsed or root in self.unparsed_boxes:
+            return
+        if self.tm.is_unparsed(self.tm.get_parser(root)):
+            if not self.unparsed_boxes:
+                QTimer.singleShot(0, self.parse_painted_boxes)
+            self.unparsed_boxes.add(root)
+
+    def parse_painted_boxes(self):
+        roots, self.unparsed_boxes = self.unparsed_boxes, set()
+        parsed = [root for root in roots if self.tm.parse_box(root)]
+        if not parsed:
+            return
+        # show the errors of the parsed boxes
+        self.update()
+        self.getWindow().btReparse([])
+        if self.getWindow().show_namebinding():
+            self.submit("analysis", AnalysisJob(self.tm, self.analysis_finished))
+
     def get_highlighter(self, node):
         root = node.get_root()
         base = lang_dict[self.tm.get_language(root)].base
@@ -780,6 +979,7 @@ class NodeEditor(QFrame):
                     lbox.plain_mode = True
                 else:
                     lbox.plain_mode = False
+                self.invalidate_layout()
                 self.update()
                 return
             elif node.image is None:
@@ -792,12 +992,11 @@ class NodeEditor(QFrame):
                 self.tm.cursor.pos = len(node.symbol.name)
             else:
                 node.plain_mode = False
+            self.invalidate_layout()
             self.update()
 
     def cursor_to_coordinate(self):
-        y = 0
-        for l in self.tm.lines[:self.cursor.line]:
-            y += l.height * self.fontht
+        y = self.tm.lines.row_of(self.cursor.line) * self.fontht
         x = self.tm.cursor.get_x() * self.fontwt
         y = y - self.getScrollArea().verticalScrollBar().value() * self.fontht
         return (x,y)
@@ -847,6 +1046,13 @@ class NodeEditor(QFrame):
         self.update()
         self.getEditorTab().keypress()
 
+    def damage_state(self):
+        """Returns the state that, if changed by a key press, requires the
+        whole editor to be repainted rather than just the cursor lines."""
+        cursor = self.tm.cursor
+        return (cursor.line, self.viewport_y, len(self.tm.lines),
+                self.tm.get_languagebox(cursor.node), self.tm.hasSelection())
+
     def keyPressEvent(self, e):
         self.timer.start(500)
         self.show_cursor = True
@@ -862,6 +1068,7 @@ class NodeEditor(QFrame):
         self.edit_rightnode = False
 
         reparse = True
+        before = self.damage_state()
 
         if key.escape:
             self.tm.key_escape()
@@ -903,7 +1110,16 @@ class NodeEditor(QFrame):
 
         if reparse:
             self.getWindow().btReparse([])
-        self.update()
+        if self.damage_state()[1:] == before[1:] and not self.autolboxlines and \
+                (not reparse or self.caches_lines()):
+            # repaint the lines whose nodes changed and the lines the cursor
+            # moved between
+            if reparse:
+                self.invalidate_damage()
+            self.update_lines(before[0])
+            self.update_lines(self.tm.cursor.line)
+        else:
+            self.update()
         self.sig_keypress.emit(e)
         self.getWindow().showLookahead()
 
@@ -1125,22 +1341,40 @@ class NodeEditor(QFrame):
         pass
 
     def saveToJson(self, filename, swap=False):
+        if swap:
+            self.submit(filename, WriteJob(filename, self.tm, self.write_file))
+            return
+        self.write_file(filename)
+        self.tm.changed = False
+        self.sig_painted.emit()
+
+    def write_file(self, filename, version=None):
         whitespaces = self.tm.get_mainparser().whitespaces
         root = self.tm.parsers[0][0].previous_version.parent
         language = self.tm.parsers[0][2]
-        manager = JsonManager()
-        manager.save(root, language, whitespaces, filename)
-        if not swap:
-            self.tm.changed = False
-            self.sig_painted.emit()
+        manager = BinaryManager() if self.binaryfile else JsonManager()
+        manager.save(root, language, whitespaces, filename, version)
+
+    def submit(self, key, job):
+        self.worker.submit(key, job)
+        if not self.workertimer.isActive():
+            self.workertimer.start(200)
+
+    def poll_worker(self):
+        if not self.worker.poll():
+            self.workertimer.stop()
 
     def loadFromJson(self, filename):
+        # The lines need the text of every language box, so all trees are
+        # built straight away. Only parsing the boxes is deferred until they
+        # are painted or edited.
         manager = JsonManager()
         language_boxes = manager.load(filename)
+        self.binaryfile = is_binary(filename)
 
         self.tm = TreeManager()
 
-        self.tm.load_file(language_boxes)
+        self.tm.load_file(language_boxes, defer=True)
         self.reset()
 
     def export(self, run=False, profile=False, source=None, debug=False):
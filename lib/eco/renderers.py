@@ -74,7 +74,7 @@ class NormalRenderer(Renderer):
             return dx, dy
         if isinstance(node.symbol, IndentationTerminal):
             paint.setPen(QPen(QColor("#aa3333")))
-            self.setStyle(paint, highlighter.get_style(node))
+            self.setStyle(paint, highlighter.fontstyles[highlighter.get_style_id(node)])
             if QApplication.instance().showindent is True:
                 if node.symbol.name == "INDENT":
                     text = ">"
@@ -87,8 +87,9 @@ class NormalRenderer(Renderer):
             else:
                 return dx, dy
         if isinstance(node, TextNode):
-            paint.setPen(QPen(QColor(highlighter.get_color(node))))
-            self.setStyle(paint, highlighter.get_style(node))
+            sid = highlighter.get_style_id(node)
+            paint.setPen(highlighter.pens[sid])
+            self.setStyle(paint, highlighter.fontstyles[sid])
             text = node.symbol.name
             if not (node.lookup == "<ws>" and node.symbol.name.startswith(" ")): # speedhack: don't draw invisible nodes
                 paint.drawText(QtCore.QPointF(x, 3 + self.fontht + y*self.fontht - self.fontd), text)
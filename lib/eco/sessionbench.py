@@ -0,0 +1,335 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Benchmarks editing sessions by replaying input logs.
+
+Input logs are what TreeManager records in `input_log` while editing (e.g.
+`self.key_normal('a')`, see View > Input log in the editor). This replays a
+set of canned sessions (or recorded logs given on the command line) against
+the bundled grammars and reports the latency of every action, the time spent
+relexing, parsing and saving versions, and the peak memory of each session.
+Each session runs in a separate process so that its peak memory isn't
+affected by the sessions before it. Results can be saved as JSON and
+compared with the results of a previous run."""
+
+from optparse import OptionParser
+import json, multiprocessing, resource, sys, time
+
+PYTHON = """class Account(object):
+    rate = 0.05
+
+    def __init__(self, owner, balance=0):
+        self.owner = owner
+        self.balance = balance
+        self.history = []
+
+    def deposit(self, amount):
+        if amount <= 0:
+            raise ValueError("invalid amount")
+        self.balance += amount
+        self.history.append(("deposit", amount))
+
+    def withdraw(self, amount):
+        if amount > self.balance:
+            return False
+        self.balance -= amount
+        self.history.append(("withdraw", amount))
+        return True
+
+    def interest(self, years):
+        total = self.balance
+        for i in range(years):
+            total = total * (1 + self.rate)
+        return total
+
+def transfer(a, b, amount):
+    if a.withdraw(amount):
+        b.deposit(amount)"""
+
+JAVA_METHOD = """    public int method%s(int x, int[] values) {
+        int sum = x;
+        for (int i = 0; i < values.length; i++) {
+            if (values[i] > %s) {
+                sum += values[i] * %s;
+            }
+        }
+        return sum;
+    }
+"""
+
+def type_text(text):
+    """Returns the log lines for typing `text` key by key. After a newline
+    the editor indents the new line like the previous one (unless that line
+    is blank), so the log corrects the indentation before typing the rest of
+    the line."""
+    lines = []
+    indent = 0
+    for i, line in enumerate(text.split("\n")):
+        stripped = line.lstrip(" ")
+        if i > 0:
+            lines.append("self.key_normal('\\r')")
+            if stripped:
+                wanted = len(line) - len(stripped)
+                lines.extend(["self.key_backspace()"] * (indent - wanted))
+                lines.extend(["self.key_normal(' ')"] * (wanted - indent))
+                indent = wanted
+            else:
+                indent = 0
+        lines.extend("self.key_normal(%r)" % c for c in stripped)
+    return lines
+
+def move_to(line, x):
+    return ["self.cursor.line = %s" % line, "self.cursor.move_to_x(%s)" % x]
+
+def python_typing():
+    """Types a Python program from start to finish."""
+    return type_text(PYTHON)
+
+def java_paste():
+    """Pastes methods into a Java class, editing each after pasting it."""
+    log = ["self.import_file(%r)" % "class Bench {\r\r}"]
+    for i in range(20):
+        log.extend(move_to(1 + 9 * i, 0))
+        log.append("self.pasteText(%r)" % (JAVA_METHOD % (i, i, i + 1)))
+        log.extend(move_to(2 + 9 * i, 19))
+        log.extend(["self.key_normal(' ')", "self.key_normal('+')",
+                    "self.key_normal(' ')", "self.key_normal('1')"])
+    return log
+
+def php_python_autolbox():
+    """Types Python functions into a PHP file, which are detected and put into
+    language boxes automatically."""
+    log = []
+    for i in range(5):
+        log.extend(type_text("$x%s = %s;\n" % (i, i)))
+        log.extend(type_text("def f%s(x):\n    return x * %s" % (i, i)))
+        log.append("self.leave_languagebox()")
+        log.append("self.key_normal('\\r')")
+    return log
+
+def undo_storm():
+    """Edits a Python program in many places and undoes and redoes all the
+    edits several times."""
+    log = ["self.import_file(%r)" % PYTHON.replace("\n", "\r")]
+    lines = PYTHON.split("\n")
+    edits = 0
+    for line in range(1, len(lines), 2):
+        if not lines[line].strip():
+            continue
+        log.extend(move_to(line, 0))
+        log.append("self.key_end()")
+        log.extend("self.key_normal(%r)" % c for c in "  # edit")
+        log.append("self.undo_snapshot()")
+        edits += 1
+    for i in range(3):
+        log.extend(["self.key_ctrl_z()"] * edits)
+        log.extend(["self.key_shift_ctrl_z()"] * edits)
+    return log
+
+# name: (language, session, autolbox)
+SESSIONS = {
+    "python": ("Python 2.7.5", python_typing, False),
+    "java-paste": ("Java", java_paste, False),
+    "php-python-autolbox": ("PHP + Python", php_python_autolbox, True),
+    "undo": ("Python 2.7.5", undo_storm, False),
+}
+
+def read_log(filename):
+    """Reads a recorded input log. The language is taken from the log's
+    "# Main language" comment."""
+    with open(filename) as f:
+        text = f.read()
+    language = None
+    for line in text.split("\n"):
+        if line.startswith("# Main language: "):
+            language = line[len("# Main language: "):].strip()
+            break
+    return language, text
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    k = (len(values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+def peak_rss():
+    """Peak resident set size of this process in KiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+def replay(language, log, autolbox=False):
+    """Replays an input log on a new TreeManager and returns the results as a
+    dictionary."""
+    from grammars.grammars import lang_dict
+    from incparser.stats import ParseStats
+    import treemanager
+    from treemanager import TreeManager, compile_inputlog
+
+    lang = lang_dict[language]
+    parser, lexer = lang.load()
+    if autolbox:
+        parser.setup_autolbox(lang.name, lexer)
+    tm = TreeManager()
+    tm.option_autolbox_insert = autolbox
+    tm.add_parser(parser, lexer, lang.name)
+    code = compile_inputlog(log)
+
+    stats = ParseStats()
+    TreeManager.report_stats = stats.add
+    relex = [0.0]
+    def timed_relex(node, relex_orig=tm.relex):
+        start = time.perf_counter()
+        try:
+            return relex_orig(node)
+        finally:
+            relex[0] += time.perf_counter() - start
+    tm.relex = timed_relex
+
+    env = {"self": tm}
+    setup_rss = peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    try:
+        for line, c in code:
+            t = time.perf_counter()
+            exec(c, treemanager.__dict__, env)
+            if not line.startswith(("self.cursor.", "self.selection_")):
+                latencies.append(time.perf_counter() - t)
+    finally:
+        TreeManager.report_stats = None
+    total = time.perf_counter() - start
+
+    phases = {"relex": relex[0]}
+    phases.update(stats.times)
+    counters = stats.as_dict()
+    del counters["times"]
+    return {
+        "language": language,
+        "actions": len(latencies),
+        "total": total,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0,
+        },
+        "phases": phases,
+        "counters": counters,
+        "status": bool(parser.last_status),
+        "setup_rss": setup_rss,
+        "peak_rss": peak_rss(),
+    }
+
+def run_job(job):
+    name, language, log, autolbox = job
+    sys.setrecursionlimit(10000)
+    return name, replay(language, log, autolbox)
+
+def run_sessions(jobs):
+    """Runs (name, language, log, autolbox) jobs, each in a fresh process."""
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for name, result in pool.imap(run_job, jobs):
+            yield name, result
+    finally:
+        pool.close()
+        pool.join()
+
+def report(name, result, previous=None, out=None):
+    out = out or sys.stdout
+    lat = result["latency"]
+    phases = result["phases"]
+    out.write("%-22s %6s %9.1f %8.2f %8.2f %8.2f %8.2f %8.1f %8.1f %8.1f %8s\n" % (
+        name, result["actions"], result["total"] * 1000,
+        lat["p50"] * 1000, lat["p90"] * 1000, lat["p99"] * 1000, lat["max"] * 1000,
+        phases["relex"] * 1000, (phases["parse"] + phases["reuse"]) * 1000,
+        phases["save"] * 1000, result["peak_rss"] // 1024))
+    if previous:
+        def change(key, old, new):
+            if old:
+                return "%s %+.1f%%" % (key, (new - old) / old * 100)
+            return "%s -" % key
+        plat = previous["latency"]
+        out.write("%-22s %s\n" % ("", ", ".join([
+            change("total", previous["total"], result["total"]),
+            change("p50", plat["p50"], lat["p50"]),
+            change("p90", plat["p90"], lat["p90"]),
+            change("p99", plat["p99"], lat["p99"]),
+            change("parse", previous["phases"]["parse"], phases["parse"]),
+            change("rss", previous["peak_rss"], result["peak_rss"])])))
+
+def main(argv=None):
+    optp = OptionParser(usage="usage: %prog [options] [LOGFILE ...]\n\n"
+                        "Replays editing sessions and reports their performance. Without log files the\n"
+                        "canned sessions are replayed: " + ", ".join(sorted(SESSIONS)) + ".")
+    optp.add_option("-s", "--sessions", default=None, help="Comma separated canned sessions to run [default: all]")
+    optp.add_option("-l", "--language", default=None, help="Language of log files without a '# Main language' line")
+    optp.add_option("-a", "--autolbox", action="store_true", default=False, help="Enable automatic language boxes for log files")
+    optp.add_option("-r", "--repeat", type="int", default=1, help="Run every session n times and keep the fastest run [default: %default]")
+    optp.add_option("-o", "--output", default=None, help="Write the results to this JSON file")
+    optp.add_option("-c", "--compare", default=None, help="Compare with the results in this JSON file")
+    (options, args) = optp.parse_args(argv)
+
+    jobs = []
+    if args:
+        for filename in args:
+            language, log = read_log(filename)
+            language = language or options.language
+            if not language:
+                optp.error("%s has no '# Main language' line, use --language" % filename)
+            jobs.append((filename, language, log, options.autolbox))
+    else:
+        names = options.sessions.split(",") if options.sessions else sorted(SESSIONS)
+        for name in names:
+            if name not in SESSIONS:
+                optp.error("unknown session '%s'" % name)
+            language, session, autolbox = SESSIONS[name]
+            jobs.append((name, language, "\n".join(session()), autolbox))
+
+    previous = {}
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)["sessions"]
+
+    print("%-22s %6s %9s %8s %8s %8s %8s %8s %8s %8s %8s" % ("session", "acts",
+          "total ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "relex", "parse", "save", "rss MiB"))
+    results = {}
+    for name, result in run_sessions([j for j in jobs for i in range(options.repeat)]):
+        if name not in results or result["total"] < results[name]["total"]:
+            results[name] = result
+    for name, _, _, _ in jobs:
+        report(name, results[name], previous.get(name))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({"python": sys.version.split()[0], "created": time.time(),
+                       "sessions": results}, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
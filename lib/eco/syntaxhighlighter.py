@@ -21,6 +21,7 @@
 
 from PyQt5.Qt import QPalette
 from PyQt5.QtCore import QSettings
+from PyQt5.QtGui import QColor, QPen
 
 class SyntaxHighlighter(object):
     colors = {
@@ -52,6 +53,41 @@ class SyntaxHighlighter(object):
         theme = settings.value("app_theme", "Light (Default)")
         if theme == "Gruvbox":
             self.colors = self.gb_colors
+        # Resolved styles. Tokens are mapped to an index into `pens` and
+        # `fontstyles` via their lookup, their parent's name and, if it is a
+        # keyword, their text. Other texts don't influence the style, so the
+        # table stays bounded by the size of the grammar.
+        self.keywords = set(k for k in self.keyword_colors if not isinstance(k, tuple))
+        self.keywords.update(self.keyword_style)
+        self.style_ids = {}
+        self.pens = []
+        self.fontstyles = []
+        self.style_table = {}
+
+    def get_style_id(self, node):
+        """Returns the id of the style used to paint `node`. The style is
+        only resolved the first time a token of the same kind is painted."""
+        name = node.symbol.name
+        if isinstance(name, list):
+            # multiline tokens aren't cached
+            return self.resolve_style(node)
+        key = (node.lookup, node.parent.symbol.name, name if name in self.keywords else None)
+        try:
+            return self.style_ids[key]
+        except KeyError:
+            sid = self.style_ids[key] = self.resolve_style(node)
+            return sid
+
+    def resolve_style(self, node):
+        color = QColor(self.get_color(node))
+        style = (color.rgba(), self.get_style(node))
+        try:
+            return self.style_table[style]
+        except KeyError:
+            self.pens.append(QPen(color))
+            self.fontstyles.append(style[1])
+            self.style_table[style] = len(self.pens) - 1
+            return len(self.pens) - 1
 
     def get_color(self, node):
         parent = node.parent
@@ -331,7 +367,22 @@ class RubyHighlighter(SyntaxHighlighter):
         "tCONSTANT": "green",
     }
 
+# Highlighters (and their resolved styles) by language and palette
+highlighters = {}
+
 def get_highlighter(parent, palette):
+    key = (parent, palette.cacheKey())
+    try:
+        return highlighters[key]
+    except KeyError:
+        h = highlighters[key] = create_highlighter(parent, palette)
+        return h
+
+def reset_highlighters():
+    """Forgets all resolved styles, e.g. after the theme was changed."""
+    highlighters.clear()
+
+def create_highlighter(parent, palette):
     if parent == "Java":
         return JavaHighlighter(palette)
     if parent == "JavaScript":
@@ -17,7 +17,9 @@ def pytest_runtest_setup(item):
 def pytest_configure(config):
     if config.getoption('--logs'):
         import logging
+        from incparser.trace import set_tracer, LoggingTracer
         logging.getLogger().setLevel(logging.DEBUG)
+        set_tracer(LoggingTracer())
     config.addinivalue_line(
         "markers", "slow: marks tests as slow (deselect with '-m \"not slow\"')"
     )
@@ -0,0 +1,63 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from astanalyser import AstAnalyser, path_key
+from utils import KEY_DOWN as DOWN
+
+python = lang_dict["Python 2.7.5"]
+
+class Test_AstAnalyser:
+
+    def setup_class(cls):
+        parser, lexer = python.load()
+        cls.tm = TreeManager()
+        cls.tm.add_parser(parser, lexer, python.name)
+        cls.tm.import_file("def f(a, b):\n    x = a + b\n    return g(x, y)\n\ndef g(c, d):\n    return c\n\nclass C:\n    z = 1\n")
+        cls.analyser = cls.tm.parsers[0][3]
+        cls.tm.analyse()
+
+    def test_errors(self):
+        errors = sorted(self.analyser.errors.values())
+        assert errors == ["'y' cannot be resolved to a variable."]
+
+    def test_get_reference(self):
+        f = self.analyser.data["method"][0]
+        assert f.name == "f"
+        x = self.analyser.get_reference("variable", f.as_path(), "x")
+        assert x.name == "x"
+        assert path_key(x.path) == path_key(f.as_path())
+        assert self.analyser.get_reference("variable", f.as_path(), "c") is None
+
+    def test_names(self):
+        g = [uri for uri in self.analyser.data["method"] if uri.name == "g"][0]
+        names = self.analyser.get_reachable_names_by_path(g.as_path())
+        assert [n.name for n in names] == ["c", "d", "f", "g", "C"]
+        assert [n.name for n in self.analyser.get_names_within_path(g.as_path())] == ["c", "d"]
+        assert self.analyser.find_uri_by_astnode(g.node) is g
+
+    def test_incremental(self):
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.import_file("def f(a, b):\n    return g(a, y)\n\nclass C:\n    z = 1\n")
+        analyser = tm.parsers[0][3]
+        full = AstAnalyser(python.nb_file)
+        def result(a):
+            data = dict((k, [(u.name, path_key(u.path), u.index) for u in v]) for k, v in a.data.items())
+            return data, sorted(a.errors.values())
+
+        tm.analyse()
+        assert parser.analysis_changes == set()
+        for i in range(5):
+            tm.key_cursors(DOWN)
+        tm.key_end()
+        checked = 0
+        for c in "\rdef y(e):\r    return e + f + w":
+            tm.key_normal(c)
+            if parser.last_status:
+                tm.analyse()
+                full.analyse(parser.previous_version.parent)
+                assert result(analyser) == result(full)
+                checked += 1
+        assert checked > 5
+        assert sorted(analyser.errors.values()) == ["'g' cannot be resolved to a variable.",
+                                                   "'w' cannot be resolved to a variable."]
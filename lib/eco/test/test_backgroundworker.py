@@ -0,0 +1,186 @@
+from backgroundworker import BackgroundWorker, Job, WriteJob, AnalysisJob
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from astanalyser import AstAnalyser, path_key
+from utils import KEY_DOWN as DOWN
+
+import os, time
+
+python = lang_dict["Python 2.7.5"]
+
+class FakeTree(object):
+    def __init__(self):
+        self.version = 1
+
+    def snapshot(self):
+        return self.version, 0
+
+    def is_current(self, snapshot):
+        return snapshot == (self.version, 0)
+
+def writer_for(text, delay=0):
+    def write(path, version):
+        time.sleep(delay)
+        with open(path, "w") as f:
+            f.write("%s %s" % (text, version))
+    return write
+
+def result(analyser):
+    data = dict((k, [(u.name, path_key(u.path), u.index) for u in v]) for k, v in analyser.data.items())
+    return data, sorted(analyser.errors.values())
+
+def read(filename):
+    with open(filename) as f:
+        return f.read()
+
+class Test_BackgroundWorker:
+
+    def test_write(self, tmpdir):
+        filename = str(tmpdir.join("a.swp"))
+        w = BackgroundWorker()
+        assert w.submit(filename, WriteJob(filename, FakeTree(), writer_for("abc")))
+        w.wait()
+        assert not w.poll()
+        assert read(filename) == "abc 1"
+        assert not os.path.exists(filename + ".tmp")
+
+    def test_poll(self, tmpdir):
+        filename = str(tmpdir.join("a.swp"))
+        w = BackgroundWorker()
+        w.submit(filename, WriteJob(filename, FakeTree(), writer_for("abc", 0.1)))
+        assert w.poll()
+        # results are only handed back when polling
+        time.sleep(0.3)
+        assert not os.path.exists(filename)
+        assert not w.poll()
+        assert read(filename) == "abc 1"
+
+    def test_stale_result(self, tmpdir):
+        # results are dropped if the tree has changed in the meantime
+        filename = str(tmpdir.join("a.swp"))
+        tree = FakeTree()
+        w = BackgroundWorker()
+        w.submit(filename, WriteJob(filename, tree, writer_for("old", 0.2)))
+        tree.version = 2
+        w.wait()
+        assert not os.path.exists(filename)
+        assert not os.path.exists(filename + ".tmp")
+
+    def test_latest_request_wins(self, tmpdir):
+        filename = str(tmpdir.join("a.swp"))
+        tree = FakeTree()
+        w = BackgroundWorker()
+        assert w.submit(filename, WriteJob(filename, tree, writer_for("1", 0.2)))
+        assert not w.submit(filename, WriteJob(filename, tree, writer_for("2")))
+        assert not w.submit(filename, WriteJob(filename, tree, writer_for("3")))
+        # waiting jobs take their snapshot when they are started
+        tree.version = 2
+        w.wait()
+        assert read(filename) == "3 2"
+
+    def test_discard(self, tmpdir):
+        filename = str(tmpdir.join("a.swp"))
+        tree = FakeTree()
+        w = BackgroundWorker()
+        w.submit(filename, WriteJob(filename, tree, writer_for("1", 0.2)))
+        w.submit(filename, WriteJob(filename, tree, writer_for("2")))
+        w.discard(filename)
+        w.wait()
+        assert not os.path.exists(filename)
+        assert not os.path.exists(filename + ".tmp")
+
+    def test_error(self, tmpdir):
+        class Failing(Job):
+            dropped = False
+            def run(self):
+                raise ValueError()
+            def finish(self, result):
+                assert False
+            def drop(self):
+                self.dropped = True
+        w = BackgroundWorker()
+        job = Failing()
+        w.submit("job", job)
+        w.wait()
+        assert job.dropped
+
+    def test_analysis(self):
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.import_file("class C:\n    def f(self, a):\n        return a + b\n\nclass D:\n    pass\n")
+        analyser = tm.parsers[0][3]
+        outlines = []
+        w = BackgroundWorker()
+        w.submit("analysis", AnalysisJob(tm, outlines.append))
+        w.wait()
+        assert sorted(analyser.errors.values()) == ["'b' cannot be resolved to a variable."]
+        assert analyser.parsers is None or analyser.parsers is tm.parsers
+        [outline] = outlines
+        def names(outline):
+            return [(uri.name, names(children)) for uri, children in outline]
+        assert names(outline) == [("C", [("f", [("self", []), ("a", [])])]), ("D", [])]
+
+    def test_analysis_snapshot(self):
+        # the job analyses the tree as it was when the job was started
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.import_file("class C:\n    def f(self, a):\n        return a + b\n")
+        analyser = tm.parsers[0][3]
+        tm.analyse()
+        uris = [(uri, uri.index) for uri in analyser.appended]
+        tm.key_cursors(DOWN)
+        tm.key_cursors(DOWN)
+        tm.key_end()
+        tm.key_normal("b")
+        job = AnalysisJob(tm, None)
+        job.start()
+        [(_, _, taken)] = job.taken
+        assert taken and parser.analysis_changes == set()
+        tm.key_backspace()
+        tm.key_backspace()
+        tm.key_normal("a")
+        assert parser.last_status
+
+        job.run()
+        assert sorted(job.copies[0][3].errors.values()) == ["'bb' cannot be resolved to a variable."]
+        # the results and URIs of the original analyser are unchanged
+        assert sorted(analyser.errors.values()) == ["'b' cannot be resolved to a variable."]
+        assert [(uri, uri.index) for uri, _ in uris] == uris
+        assert not set(id(uri) for uri, _ in uris) & set(id(uri) for uri in job.copies[0][3].appended)
+
+        # the result is dropped and the changes are given back to the parser
+        assert not job.is_current()
+        job.drop()
+        assert taken < parser.analysis_changes
+        tm.analyse()
+        assert analyser.errors == {}
+        full = AstAnalyser(python.nb_file)
+        full.analyse(parser.previous_version.parent)
+        assert result(analyser) == result(full)
+
+    def test_analysis_incremental(self):
+        # finished jobs leave the analysers in the same state as `analyse`
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.import_file("def f(a, b):\n    return g(a, y)\n\nclass C:\n    z = 1\n")
+        analyser = tm.parsers[0][3]
+        full = AstAnalyser(python.nb_file)
+        for i in range(5):
+            tm.key_cursors(DOWN)
+        tm.key_end()
+        checked = 0
+        for c in "\rdef y(e):\r    return e + f + w":
+            tm.key_normal(c)
+            if parser.last_status:
+                job = AnalysisJob(tm, lambda outline: None)
+                job.start()
+                job.finish(job.run())
+                full.analyse(parser.previous_version.parent)
+                assert result(analyser) == result(full)
+                checked += 1
+        assert checked > 5
+        assert sorted(analyser.errors.values()) == ["'g' cannot be resolved to a variable.",
+                                                   "'w' cannot be resolved to a variable."]
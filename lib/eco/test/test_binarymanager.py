@@ -0,0 +1,88 @@
+import sys
+
+from binarymanager import BinaryManager, is_binary, main
+from jsonmanager import JsonManager
+from grammar_parser.gparser import Terminal, MagicTerminal
+from incparser.astree import TextNode
+
+from .test_jsonmanager import nodes, terminals, text, make_root, make_tree, edit_tree
+
+def make_lboxes():
+    inner = make_root([TextNode(Terminal("2")), TextNode(Terminal("é\U0001F600"))])
+    lbox = TextNode(MagicTerminal("<Python 2.7.5>"))
+    lbox.symbol.ast = inner
+    lbox2 = TextNode(MagicTerminal("<SQL>"))
+    lbox2.symbol.ast = make_root([TextNode(Terminal("3"))])
+    return make_root([TextNode(Terminal("1")), lbox, lbox2])
+
+class Test_BinaryManager:
+
+    def test_same_tree(self, tmpdir):
+        filename = str(tmpdir.join("calc.eco"))
+        root, language, whitespaces = JsonManager().load("test/calcmultistring.eco")[0]
+        BinaryManager().save(root, language, whitespaces, filename)
+        assert is_binary(filename)
+        assert not is_binary("test/calcmultistring.eco")
+
+        # JsonManager recognises binary files
+        root2, language2, whitespaces2 = JsonManager().load(filename)[0]
+        assert (language2, whitespaces2) == (language, whitespaces)
+        assert text(root2) == text(root)
+        assert [(n.__class__, n.symbol, n.lookup, n.textlen, n.local_error) for n in nodes(root2)] == \
+               [(n.__class__, n.symbol, n.lookup, n.textlen, n.local_error) for n in nodes(root)]
+
+    def test_deep_tree(self, tmpdir):
+        filename = str(tmpdir.join("deep.eco"))
+        depth = sys.getrecursionlimit() * 5
+        BinaryManager().save(make_tree(depth), "Basic Calculator", True, filename)
+        root = BinaryManager().load(filename)[0][0]
+        assert text(root) == "x" * depth
+        assert root.textlen == depth
+
+    def test_language_boxes(self, tmpdir):
+        filename = str(tmpdir.join("lbox.eco"))
+        BinaryManager().save(make_lboxes(), "Basic Calculator", False, filename)
+        language_boxes = BinaryManager().load(filename)
+        assert [(l, w) for _, l, w in language_boxes] == \
+               [("Basic Calculator", False), ("SQL", True), ("Python 2.7.5", True)]
+        lbox = terminals(language_boxes[0][0])[2]
+        assert lbox.symbol.ast is language_boxes[2][0]
+        assert lbox.symbol.ast.magic_backpointer is lbox
+        assert text(lbox.symbol.ast) == "2é\U0001F600"
+
+    def test_lazy(self, tmpdir):
+        filename = str(tmpdir.join("lbox.eco"))
+        BinaryManager().save(make_lboxes(), "Basic Calculator", True, filename)
+        manager = BinaryManager(lazy=True)
+        language_boxes = manager.load(filename)
+        assert len(language_boxes) == 1
+        _, _, lbox, lbox2, _ = terminals(language_boxes[0][0])
+        assert "ast" not in lbox.symbol.__dict__
+
+        assert text(lbox2.symbol.ast) == "3"
+        assert lbox2.symbol.ast.magic_backpointer is lbox2
+        assert "ast" not in lbox.symbol.__dict__
+        assert [l for _, l, _ in manager.language_boxes] == ["Basic Calculator", "SQL"]
+
+        # Saving loads the remaining boxes
+        filename2 = str(tmpdir.join("lbox.json.eco"))
+        JsonManager().save(language_boxes[0][0], "Basic Calculator", True, filename2)
+        assert text(lbox.symbol.ast) == "2é\U0001F600"
+        language_boxes = JsonManager().load(filename2)
+        assert [l for _, l, _ in language_boxes] == ["Basic Calculator", "SQL", "Python 2.7.5"]
+
+    def test_version(self, tmpdir):
+        root, version, expected = edit_tree()
+        filename = str(tmpdir.join("calc.eco"))
+        BinaryManager().save(root, "Basic Calculator", True, filename, version)
+        root2 = BinaryManager().load(filename)[0][0]
+        assert text(root2) == expected
+        assert root2.textlen == len(expected)
+
+    def test_main(self, tmpdir):
+        binary = str(tmpdir.join("binary.eco"))
+        json = str(tmpdir.join("json.eco"))
+        assert main(["test/retaincalc.eco", binary]) == 0
+        assert main(["-j", binary, json]) == 0
+        assert is_binary(binary) and not is_binary(json)
+        assert text(JsonManager().load(json)[0][0]) == text(JsonManager().load("test/retaincalc.eco")[0][0])
@@ -24,7 +24,7 @@ from treemanager import TreeManager
 from incparser.incparser import IncParser
 from inclexer.inclexer import IncrementalLexer, IncrementalLexerCF
 from incparser.astree import BOS, EOS, TextNode, MultiTextNode
-from grammar_parser.gparser import MagicTerminal, Terminal
+from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from utils import KEY_UP as UP, KEY_DOWN as DOWN, KEY_LEFT as LEFT, KEY_RIGHT as RIGHT
 
 from PyQt5 import QtCore
@@ -268,6 +268,100 @@ class Test_General:
         t.key_delete()
         assert parser.last_status is True
 
+    def save_prolog_boxes(self, filename, boxes):
+        from jsonmanager import JsonManager
+        lang = lang_dict["Python + Prolog"]
+        parser, lexer = lang.load()
+        t = TreeManager()
+        t.add_parser(parser, lexer, lang.name)
+        for box in boxes:
+            for c in "x = ":
+                t.key_normal(c)
+            t.add_languagebox(lang_dict["Prolog"])
+            for c in box:
+                t.key_normal(c)
+            t.leave_languagebox()
+            t.key_normal("\r")
+        JsonManager().save(parser.previous_version.parent, lang.name, True, filename)
+
+    def load_prolog_boxes(self, filename, defer):
+        from jsonmanager import JsonManager
+        t = TreeManager()
+        t.load_file(JsonManager().load(filename), defer=defer)
+        return t
+
+    def test_load_file_defer(self, tmpdir):
+        def tree(node):
+            return (node.symbol.name, [tree(c) for c in node.children])
+        def boxes(t):
+            result = {}
+            for p in t.parsers[1:]:
+                node = p[0].previous_version.parent.children[0].next_term
+                text = ""
+                while not isinstance(node, EOS):
+                    text += node.symbol.name
+                    node = node.next_term
+                result[text] = p[0]
+            return result
+        filename = str(tmpdir.join("boxes.eco"))
+        self.save_prolog_boxes(filename, ["a(X) :- b(X).", "a(X) :- .", "c(1)."])
+        loaded = boxes(self.load_prolog_boxes(filename, False))
+        t = self.load_prolog_boxes(filename, True)
+        parsers = boxes(t)
+
+        assert not t.is_unparsed(t.get_mainparser())
+        assert all(t.is_unparsed(p) for p in parsers.values())
+        # boxes keep the status they were saved with
+        for text, p in parsers.items():
+            assert p.last_status is loaded[text].last_status is (text != "a(X) :- .")
+            assert p.error_nodes == []
+
+        root = parsers["a(X) :- b(X)."].previous_version.parent
+        assert t.parse_box(root)
+        assert not t.parse_box(root)
+        assert not t.is_unparsed(parsers["a(X) :- b(X)."])
+        assert tree(root) == tree(loaded["a(X) :- b(X)."].previous_version.parent)
+
+        # edits parse the box they are made in
+        t.key_cursors(DOWN)
+        t.key_cursors(DOWN)
+        t.key_end()
+        t.key_cursors(LEFT)
+        t.key_cursors(LEFT)
+        t.key_normal("2")
+        assert not t.is_unparsed(parsers["c(1)."])
+        assert parsers["c(1)."].last_status
+        assert t.is_unparsed(parsers["a(X) :- ."])
+
+        t.parse_boxes()
+        assert not any(t.is_unparsed(p) for p in parsers.values())
+        assert not parsers["a(X) :- ."].last_status
+        assert parsers["a(X) :- ."].error_nodes
+        assert t.export_as_text() == "x = a(X) :- b(X).\nx = a(X) :- .\nx = c(12).\n"
+
+    def test_load_file_defer_undo(self, tmpdir):
+        filename = str(tmpdir.join("boxes.eco"))
+        self.save_prolog_boxes(filename, ["a(X) :- b(X)."])
+        t = self.load_prolog_boxes(filename, True)
+        parser = t.parsers[1][0]
+        root = parser.previous_version.parent
+
+        t.key_end()
+        t.key_normal("\r")
+        t.undo_snapshot()
+        t.parse_box(root)
+        assert not t.is_unparsed(parser)
+        # the box isn't parsed in versions before the one it was parsed in
+        t.key_ctrl_z()
+        assert t.is_unparsed(parser)
+        t.key_shift_ctrl_z()
+        assert not t.is_unparsed(parser)
+        t.key_ctrl_z()
+        t.key_normal(" ")
+        assert t.is_unparsed(parser)
+        assert t.parse_box(root)
+        assert parser.last_status
+
     def test_lexing_save_load_bug(self):
         t = TreeManager()
 
@@ -1186,6 +1280,49 @@ class Test_Incremental_AST(Test_Python):
         assert newfuncdef is funcdef
         assert newfuncdef.alternate is oldastnode
 
+class Test_Offsets(Test_Python):
+
+    def terminals(self):
+        node = self.parser.previous_version.parent.children[0]
+        while not isinstance(node, EOS):
+            yield node
+            node = node.next_terminal()
+
+    def test_offsets(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        self.move(DOWN, 5)
+        self.treemanager.key_end()
+        self.treemanager.key_normal("\r")
+        for c in "x = 12":
+            self.treemanager.key_normal(c)
+        root = self.parser.previous_version.parent
+        offset = 0
+        for node in self.terminals():
+            assert self.treemanager.get_offset(node) == offset
+            if node.textlen > 0:
+                lastterminal = node
+            # indentation terminals aren't part of the text
+            if node.textlen > 0 and not isinstance(node.symbol, IndentationTerminal):
+                last = node
+                offset += node.textlen
+                assert self.treemanager.get_node_at_offset(offset) == (node, node.textlen)
+                if node.textlen > 1:
+                    assert self.treemanager.get_node_at_offset(offset - 1) == (node, node.textlen - 1)
+        assert self.treemanager.get_node_at_offset(0) == (root.children[0], 0)
+        assert self.treemanager.get_node_at_offset(offset + 10) == (last, last.textlen)
+        assert self.parser.previous_version.find_node_at_pos(root.textlen + 10) is lastterminal
+
+    def test_get_node_at(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        cursor = self.treemanager.cursor.copy()
+        for line in range(len(self.treemanager.lines)):
+            for column in [0, 1, 4, 5, 9, 30, 1000]:
+                cursor.line = line
+                cursor.move_to_x(column)
+                assert self.treemanager.get_node_at(line, column) == (cursor.node, cursor.pos)
+
 class Test_Relexing(Test_Python):
 
     def test_dont_stop_relexing_after_first_error(self):
@@ -1614,6 +1751,25 @@ class Test_Undo(Test_Python):
         self.treemanager.key_shift_ctrl_z()
         self.compare("1+2")
 
+    def test_damage(self):
+        self.reset()
+        tm = self.treemanager
+        assert tm.take_damage() is None
+        for c in "x = 1\ry = 2":
+            tm.key_normal(c)
+        tm.undo_snapshot()
+        tm.take_damage()
+        tm.key_normal("3")
+        names = [n.symbol.name for n in tm.take_damage()]
+        assert "23" in names
+        assert "x" not in names
+        assert tm.take_damage() == []
+        tm.key_ctrl_z()
+        self.compare("x = 1\ny = 2")
+        names = [n.symbol.name for n in tm.take_damage()]
+        assert "2" in names
+        assert "x" not in names
+
     def test_undo_indentation(self):
         self.reset()
         self.type_save("class")
@@ -1716,6 +1872,44 @@ class Test_Undo(Test_Python):
         self.treemanager.key_shift_ctrl_z()
         self.compare("12")
 
+    def test_undo_limit(self):
+        self.reset()
+        self.treemanager.undo_limit = 3
+        for c in "1+2+3+4+5":
+            self.type_save(c)
+        self.compare("1+2+3+4+5")
+        for i in range(10):
+            self.treemanager.key_ctrl_z()
+        self.compare("1+2+3+4")
+        assert len(self.treemanager.undo_snapshots) == 3
+        root = self.parser.previous_version.parent
+        assert root.log.versions[0] <= self.treemanager.min_version
+        assert root.log.versions[1] > self.treemanager.min_version
+        for i in range(10):
+            self.treemanager.key_shift_ctrl_z()
+        self.compare("1+2+3+4+5")
+
+    def test_undo_visits_nodes_once(self):
+        # nodes created between two snapshots can't be loaded when jumping
+        # back, but must still only be descended into once
+        self.reset()
+        for text in ["x = 1", "\rclass", " X:", "\r    ", "pass", "\ry = x"]:
+            for c in text:
+                self.treemanager.key_normal(c)
+            self.treemanager.undo_snapshot()
+        self.treemanager.key_home()
+        self.treemanager.key_delete()
+        self.treemanager.undo_snapshot()
+        calls = []
+        undo = self.treemanager.undo
+        def counted(node, *args):
+            calls.append(node)
+            return undo(node, *args)
+        self.treemanager.undo = counted
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.compare("x = 1\nclass X:\n    pass")
+        assert len(calls) < 1000
     def test_bug_lingering_nodes(self):
         self.reset()
         p = """class X:
@@ -1825,7 +2019,9 @@ class Test_Undo(Test_Python):
             assert original[i] == current[i]
 
     def copy(self):
-        import copy
+        import copy, sys
+        # deepcopy recurses on the depth of the tree
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 2000))
         return copy.deepcopy(self.parser.previous_version.parent)
 
     def test_import(self):
@@ -4063,6 +4259,22 @@ self.key_normal('e')"""
     def foo():
         x = SELECT * FROM table"""
 
+    def test_replay_own_log(self):
+        self.reset()
+        for c in "x = 12":
+            self.treemanager.key_normal(c)
+        self.treemanager.key_cursors(LEFT)
+        self.treemanager.key_cursors(LEFT)
+        self.treemanager.ctrl_cursor(RIGHT)
+        self.treemanager.key_normal("3")
+        log = "\n".join(self.treemanager.input_log)
+        assert "self.key_cursors(KEY_LEFT, False)" in log
+        assert self.treemanager.export_as_text() == "x = 123"
+
+        self.reset()
+        self.treemanager.apply_inputlog(log)
+        assert self.treemanager.export_as_text() == "x = 123"
+
 class Test_Comments_Indents(Test_Python):
     def test_newline(self):
         self.reset()
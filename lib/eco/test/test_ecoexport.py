@@ -0,0 +1,55 @@
+from ecoexport import find_files, destination, export_files, main
+
+import io, os, shutil
+
+class Test_EcoExport:
+
+    def test_find_files(self, tmpdir):
+        d = tmpdir.mkdir("src")
+        d.mkdir("sub").join("b.eco").write("")
+        d.join("a.eco").write("")
+        d.join("c.txt").write("")
+        files = find_files([str(d), "test/retaincalc.eco"])
+        assert files == [(str(d.join("a.eco")), str(d)),
+                         (str(d.join("sub").join("b.eco")), str(d)),
+                         ("test/retaincalc.eco", None)]
+
+    def test_destination(self):
+        assert destination("a/b.eco", None, None, ".txt") == "a/b.txt"
+        assert destination("a/b.eco", None, "out", ".txt") == "out/b.txt"
+        assert destination("a/b/c.eco", "a", "out", ".aterms") == "out/b/c.aterms"
+        assert destination("a/b", None, None, ".txt") == "a/b.txt"
+
+    def test_export_files(self, tmpdir):
+        jobs = [("test/retaincalc.eco", str(tmpdir.join("x").join("retaincalc.txt")), True, False),
+                ("test/retaincalc2.eco", str(tmpdir.join("retaincalc2.txt")), True, False)]
+        status = io.StringIO()
+        assert export_files(jobs, 2, status=status) == 0
+        with open(jobs[0][1]) as f:
+            assert f.read().startswith('E ::= T\n    | E "plus" T')
+        assert os.path.exists(jobs[1][1])
+        lines = status.getvalue().splitlines()
+        assert lines[0].startswith("OK    test/retaincalc.eco -> ")
+        assert lines[1].startswith("OK    test/retaincalc2.eco -> ")
+        assert lines[2].startswith("Exported 2 of 2 file(s)")
+
+    def test_export_stdout(self):
+        out = io.StringIO()
+        status = io.StringIO()
+        jobs = [("test/retaincalc.eco", "retaincalc.txt", True, True),
+                ("test/doesnotexist.eco", "doesnotexist.txt", True, True),
+                ("test/retaincalc.eco", "retaincalc.aterms", False, True)]
+        assert export_files(jobs, 1, out=out, status=status) == 1
+        text = out.getvalue()
+        assert text.startswith('E ::= T\n    | E "plus" T')
+        assert "Root(" in text
+        lines = status.getvalue().splitlines()
+        assert lines[1].startswith("FAIL  test/doesnotexist.eco")
+        assert lines[3].startswith("Exported 2 of 3 file(s)")
+
+    def test_main(self, tmpdir):
+        src = tmpdir.mkdir("src")
+        shutil.copy("test/retaincalc.eco", str(src.join("calc.eco")))
+        out = tmpdir.join("out")
+        assert main(["-j", "1", "-o", str(out), "-a", str(src)]) == 0
+        assert out.join("calc.aterms").check()
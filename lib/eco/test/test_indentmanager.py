@@ -0,0 +1,155 @@
+from grammars.grammars import lang_dict
+from grammar_parser.gparser import IndentationTerminal
+from treemanager import TreeManager
+from utils import KEY_DOWN as DOWN
+from indentbench import generate
+
+import random
+
+python = lang_dict["Python 2.7.5"]
+
+def new_treemanager(text):
+    parser, lexer = python.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, python.name)
+    tm.import_file(text)
+    return tm
+
+def tokens(tm):
+    node = tm.get_bos()
+    result = []
+    while node is not None:
+        result.append(node.symbol.name)
+        node = node.next_term
+    return result
+
+def indentation_tokens(tm):
+    """Returns the indentation tokens following each line break (including
+    those before EOS)."""
+    result = []
+    for name in tokens(tm):
+        if name == "\r":
+            result.append([])
+        elif name in ("NEWLINE", "INDENT", "DEDENT", "UNBALANCED"):
+            result[-1].append(name)
+    return result
+
+class Test_IndentationManager:
+
+    def test_repair_full(self):
+        tm = new_treemanager(generate(16, 3, 1))
+        assert indentation_tokens(tm) == [
+            ["NEWLINE", "INDENT"],  # if x > 1:
+            ["NEWLINE", "INDENT"],  # if x > 2:
+            ["NEWLINE", "INDENT"],  # x = x + 0
+            ["NEWLINE", "DEDENT"],  # x = x - 2
+            ["NEWLINE", "DEDENT"],  # x = x - 1
+            [],                     # empty line
+            ["NEWLINE", "DEDENT"],  # f0(1)
+            ["NEWLINE"],            # def f1(x):
+            ["NEWLINE", "INDENT"],
+            ["NEWLINE", "INDENT"],
+            ["NEWLINE", "INDENT"],
+            ["NEWLINE", "DEDENT"],
+            ["NEWLINE", "DEDENT"],
+            [],
+            ["NEWLINE", "DEDENT", "NEWLINE"],  # f1(1) and EOS
+        ]
+        assert tm.parsers[0][0].last_status
+
+    def test_unbalanced(self):
+        tm = new_treemanager("class C:\n    def f():\n        x\n   y\n")
+        assert indentation_tokens(tm) == [["NEWLINE", "INDENT"], ["NEWLINE", "INDENT"],
+                                              ["UNBALANCED"], ["NEWLINE"]]
+        assert not tm.parsers[0][0].last_status
+
+    def test_repair(self):
+        # Incremental repairs yield the same tokens as repairing the whole
+        # file from scratch
+        rnd = random.Random(0)
+        tm = new_treemanager(generate(40, 4, 3))
+        checked = 0
+        for i in range(20):
+            tm.cursor_reset()
+            for j in range(rnd.randrange(len(tm.lines))):
+                tm.key_cursors(DOWN)
+            op = rnd.randrange(4)
+            if op == 0:
+                for j in range(rnd.randrange(1, 5)):
+                    tm.key_normal(" ")
+            elif op == 1:
+                tm.key_end()
+                for c in rnd.choice(["\rx = 1", "\rif x:\r    y", "\r# comment"]):
+                    tm.key_normal(c)
+            elif op == 2:
+                tm.key_end()
+                for j in range(rnd.randrange(1, 8)):
+                    tm.key_backspace()
+            else:
+                tm.key_ctrl_z()
+            expected = new_treemanager(tm.export_as_text())
+            if [t for t in tokens(tm) if t not in ("NEWLINE", "INDENT", "DEDENT", "UNBALANCED")] != \
+               [t for t in tokens(expected) if t not in ("NEWLINE", "INDENT", "DEDENT", "UNBALANCED")]:
+                # the incremental lexer may split unfinished code differently
+                continue
+            assert tokens(tm) == tokens(expected)
+            checked += 1
+        assert checked > 10
+
+    def test_undo_redo(self):
+        # Undo and redo only invalidate the lines they restored, so the next
+        # repair doesn't need to repair the whole file
+        from indentbench import line_starts
+        from indentmanager import IndentationManager
+        tm = new_treemanager(generate(400, 4, 3))
+        im = tm.parsers[0][4]
+        tm.cursor_reset()
+        for i in range(200):
+            tm.key_cursors(DOWN)
+        tm.key_end()
+        for c in "\rif x:\r    y":
+            tm.key_normal(c)
+        tm.undo_snapshot()
+
+        repaired = []
+        fix_tokens = im.fix_tokens
+        def count(bol):
+            repaired.append(bol)
+            return fix_tokens(bol)
+        im.fix_tokens = count
+
+        def check():
+            assert not im.outdated
+            assert 0 < len(im.invalid) < 20
+            del repaired[:]
+            tm.key_normal(" ")
+            assert len(repaired) < len(tm.lines) / 8
+            expected = new_treemanager(tm.export_as_text())
+            assert tokens(tm) == tokens(expected)
+            full = IndentationManager(tm.get_bos().parent)
+            full.repair_full()
+            assert tokens(tm) == tokens(expected)
+            for bol in line_starts(im):
+                assert im.get_line_data(bol) == full.get_line_data(bol)
+
+        tm.key_ctrl_z()
+        assert im.invalid
+        tm.key_shift_ctrl_z()
+        check()
+        tm.undo_snapshot()
+        tm.key_ctrl_z()
+        check()
+
+    def test_undo_redo_multiline_string(self):
+        # Undo and redo recover the parts of multi-line strings, which aren't
+        # in the token stream themselves
+        tm = new_treemanager("def f():\n    x = \"\"\"a\nb\"\"\"\n    return x\n")
+        tm.key_cursors(DOWN)
+        tm.key_cursors(DOWN)
+        tm.key_home()
+        tm.key_normal("z")
+        tm.undo_snapshot()
+        tm.key_ctrl_z()
+        tm.key_shift_ctrl_z()
+        tm.key_normal(" ")
+        assert indentation_tokens(tm) == [["NEWLINE", "INDENT"], ["NEWLINE"], ["NEWLINE", "DEDENT"]]
@@ -0,0 +1,143 @@
+from journal import Journal, JournalError, OPCODES, MAGIC, main
+from sessionbench import type_text
+from treemanager import TreeManager
+from grammars.grammars import lang_dict
+
+import io, contextlib
+import pytest
+
+python = lang_dict["Python 2.7.5"]
+
+LOG = """# Main language: Python 2.7.5
+self.key_normal('x')
+self.key_normal('\\r')
+self.key_home(False)
+self.key_end()
+self.key_cursors(KEY_LEFT, True)
+self.key_cursors(up, False)
+self.key_escape(left)
+# mousePressEvent
+self.cursor.line = 12
+self.cursor.move_to_x(300)
+self.selection_start = self.cursor.copy()
+self.selection_end = self.cursor.copy()
+self.add_languagebox('SQL (Dummy)')
+self.pasteText('caf\\xe9\\r  x')
+self.treemanager.key_delete()
+self.move(DOWN, 3)
+self.undo_snapshot()
+self.key_ctrl_z()"""
+
+def new_treemanager():
+    parser, lexer = python.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, python.name)
+    return tm, parser
+
+class Test_Journal:
+
+    def test_from_inputlog(self):
+        j = Journal.from_inputlog(LOG)
+        assert j.get_language() == "Python 2.7.5"
+        assert j.entries[:9] == [
+            (OPCODES["language"], ("Python 2.7.5",)),
+            (OPCODES["key_normal"], ("x",)),
+            (OPCODES["key_normal"], ("\r",)),
+            (OPCODES["key_home"], (False,)),
+            (OPCODES["key_end"], (False,)),
+            (OPCODES["key_cursors"], ("left", True)),
+            (OPCODES["key_cursors"], ("up", False)),
+            (OPCODES["ctrl_cursor"], ("left", False)),
+            (OPCODES["cursor.line"], (12,))]
+        assert (OPCODES["move"], ("down", 3)) in j.entries
+        assert len(j.entries) == 18
+
+    def test_serialisation(self):
+        j = Journal.from_inputlog(LOG)
+        data = j.to_bytes()
+        assert data.startswith(MAGIC)
+        assert len(data) < len(LOG) // 2
+        assert Journal.from_bytes(data).entries == j.entries
+        # the fuzzy tester's moves are written as single cursor movements
+        text = j.to_inputlog()
+        assert "self.cursor_movement(KEY_DOWN)\n" * 3 in text
+        entries = Journal.from_inputlog(text.replace("self.cursor_movement(KEY_DOWN)\n" * 3, "self.move(KEY_DOWN, 3)\n")).entries
+        assert entries == j.entries
+        for i in range(1, len(data) - len(MAGIC)):
+            # truncated journals either end at an entry or raise an error
+            try:
+                Journal.from_bytes(data[:-i])
+            except JournalError:
+                pass
+
+    def test_varints(self):
+        j = Journal()
+        for i in (0, 127, 128, 300, 2**40):
+            j.append("cursor.line", i)
+        j.append("import_file", "x" * 100000)
+        assert Journal.from_bytes(j.to_bytes()).entries == j.entries
+
+    def test_errors(self):
+        for line in ["self.key_normal(x)", "self.key_normal('a', 'b')", "self.key_home(1)",
+                     "self.key_cursors(KEY_FOO, False)", "import os", "self.key_normal(shift=True)",
+                     "self.cursor.line = 'a'", "self.foo()", "os.system('ls')", "self.key_normal('a'"]:
+            with pytest.raises(JournalError):
+                Journal.from_inputlog(line)
+        with pytest.raises(JournalError):
+            Journal.from_bytes(b"self.key_normal('a')")
+        with pytest.raises(JournalError):
+            Journal.from_bytes(MAGIC + bytes([250]))
+        with pytest.raises(JournalError):
+            Journal.from_bytes(MAGIC + bytes([OPCODES["key_normal"], 5, 65]))
+
+    def test_replay(self):
+        log = "\n".join(type_text("class X:\n    def f(self):\n        return 1")) + \
+            "\nself.cursor.line = 1\nself.cursor.move_to_x(9)\nself.key_cursors(KEY_RIGHT, True)\n" \
+            "self.key_cursors(KEY_LEFT, False)\nself.key_backspace()\nself.key_normal('g')\nself.undo_snapshot()\n" \
+            "self.ctrl_cursor(KEY_LEFT, False)\nself.key_normal('_')\nself.key_ctrl_z()\nself.key_normal('x')"
+        tm1, parser1 = new_treemanager()
+        tm1.apply_inputlog(log)
+        assert "def gx(self):" in tm1.export_as_text()
+        for batch in (0, 1, 5, 100):
+            tm2, parser2 = new_treemanager()
+            Journal.from_inputlog(log).replay(tm2, batch)
+            assert tm2.export_as_text() == tm1.export_as_text()
+            assert parser2.last_status == parser1.last_status
+            if batch > 1:
+                assert tm2.version < tm1.version
+            else:
+                assert tm2.version == tm1.version
+            assert tm2.deferred_reparse is None
+
+    def test_batch_autolbox(self):
+        # language boxes are detected after every reparse, so batching is
+        # disabled
+        phppython = lang_dict["PHP + Python"]
+        versions = []
+        for batch in (0, 10):
+            parser, lexer = phppython.load()
+            parser.setup_autolbox(phppython.name, lexer)
+            tm = TreeManager()
+            tm.option_autolbox_insert = True
+            tm.add_parser(parser, lexer, phppython.name)
+            Journal.from_inputlog("\n".join(type_text("def x():\n    p"))).replay(tm, batch)
+            assert len(tm.parsers) == 2
+            versions.append(tm.version)
+        assert versions[0] == versions[1]
+
+    def test_main(self, tmpdir):
+        log = tmpdir.join("a.log")
+        log.write("\n".join(["# Main language: Basic Calculator"] + type_text("1+2")))
+        journal = str(tmpdir.join("a.ecoj"))
+        assert main(["convert", str(log), journal]) == 0
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            assert main(["dump", journal]) == 0
+            assert main(["replay", "-t", "-b", "10", journal]) == 0
+            assert main(["replay", "-t", str(log)]) == 0
+            assert main(["nonsense"]) == 2
+        lines = out.getvalue().splitlines()
+        assert lines[:2] == ["# Main language: Basic Calculator", "self.key_normal('1')"]
+        assert lines.count("1+2") == 2
+        assert err.getvalue().count("parse ok") == 2
@@ -0,0 +1,164 @@
+import gzip, json, sys
+
+import jsonmanager
+from jsonmanager import JsonManager
+from grammar_parser.gparser import Terminal, MagicTerminal, Nonterminal
+from incparser.astree import TextNode, BOS, EOS, FinishSymbol
+
+import pytest
+
+def nodes(root):
+    result = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        stack.extend(reversed(node.children))
+    return result
+
+def terminals(root):
+    node = root.children[0]
+    result = []
+    while node is not None:
+        result.append(node)
+        assert node.next_term is None or node.next_term.prev_term is node
+        node = node.next_term
+    return result
+
+def text(root):
+    return "".join(n.symbol.name for n in terminals(root) if type(n.symbol) is Terminal)
+
+def make_root(children):
+    root = TextNode(Nonterminal("Root"))
+    root.set_children([BOS(Terminal(""))] + children + [EOS(FinishSymbol())])
+    return root
+
+def make_tree(depth):
+    node = None
+    for i in range(depth):
+        parent = TextNode(Nonterminal("n"))
+        parent.set_children([TextNode(Terminal("x"))] + ([node] if node else []))
+        node = parent
+    return make_root([node])
+
+def edit_tree():
+    """Returns a tree that has been edited after its first version, that
+    version and the text in it."""
+    from grammars.grammars import lang_dict
+    from treemanager import TreeManager
+    calc = lang_dict["Basic Calculator"]
+    parser, lexer = calc.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, calc.name)
+    tm.import_file("1+2*3")
+    version = tm.version
+    tm.key_end()
+    tm.key_normal("+")
+    tm.key_normal("4")
+    tm.key_home()
+    tm.key_delete()
+    tm.key_normal("5")
+    assert tm.export_as_text() == "5+2*3+4"
+    return parser.previous_version.parent, version, "1+2*3"
+
+def count_objects(jsnode):
+    count = 0
+    stack = [jsnode]
+    while stack:
+        jsnode = stack.pop()
+        count += 1
+        stack.extend(jsnode["children"])
+    return count
+
+class Test_JsonManager:
+
+    def roundtrip(self, tmpdir, root, language="Basic Calculator", whitespaces=True):
+        filename = str(tmpdir.join("test.eco"))
+        JsonManager().save(root, language, whitespaces, filename)
+        return JsonManager().load(filename)
+
+    @pytest.mark.parametrize("filename", ["test/calcmultistring.eco", "test/retaincalc.eco", "test/undobug1.eco"])
+    def test_existing_files(self, tmpdir, filename):
+        with gzip.open(filename) as f:
+            expected = json.loads(f.read())
+        language_boxes = JsonManager().load(filename)
+        assert len(language_boxes) == 1
+        root, language, whitespaces = language_boxes[0]
+        assert (language, whitespaces) == (expected["language"], expected["whitespaces"])
+        assert len(nodes(root)) == count_objects(expected["root"])
+        assert isinstance(terminals(root)[-1], EOS)
+
+        # Saving again writes the current format, which loads the same tree
+        root2, _, _ = self.roundtrip(tmpdir, root, language, whitespaces)[0]
+        assert text(root2) == text(root)
+        assert [(n.symbol.name, n.textlen) for n in nodes(root2)] == \
+               [(n.symbol.name, n.textlen) for n in nodes(root)]
+
+    def test_output_format(self, tmpdir):
+        root = make_root([TextNode(Terminal("1")), TextNode(Terminal("+\\\"é"))])
+        for node in root.children:
+            node.calc_textlength()
+        filename = str(tmpdir.join("test.eco"))
+        JsonManager().save(root, "Basic Calculator", False, filename)
+        with gzip.open(filename) as f:
+            data = json.loads(f.read())
+        assert data["language"] == "Basic Calculator"
+        assert data["whitespaces"] is False
+        children = data["root"]["children"]
+        assert [c["class"] for c in children] == ["BOS", "TextNode", "TextNode", "EOS"]
+        assert children[2]["text"] == "+\\\"é"
+        assert children[2]["textlen"] == 4
+        assert list(children[1]) == ["class", "symbol", "text", "lookup", "local_error",
+                                     "nested_errors", "image_src", "textlen", "children"]
+
+    def test_plain_json(self, tmpdir):
+        # Very old files weren't compressed
+        with gzip.open("test/retaincalc.eco") as f:
+            data = f.read()
+        filename = tmpdir.join("plain.eco")
+        filename.write(data, mode="wb")
+        root, _, _ = JsonManager().load(str(filename))[0]
+        assert text(root) == text(JsonManager().load("test/retaincalc.eco")[0][0])
+
+    def test_small_chunks(self, monkeypatch):
+        expected = text(JsonManager().load("test/calcmultistring.eco")[0][0])
+        monkeypatch.setattr(jsonmanager, "CHUNKSIZE", 3)
+        assert text(JsonManager().load("test/calcmultistring.eco")[0][0]) == expected
+
+    def test_deep_tree(self, tmpdir):
+        depth = sys.getrecursionlimit() * 5
+        root = make_tree(depth)
+        root2, _, _ = self.roundtrip(tmpdir, root)[0]
+        node = root2.children[1]
+        for i in range(depth - 1):
+            assert node.symbol.name == "n"
+            node = node.children[1]
+        assert [c.symbol.name for c in node.children] == ["x"]
+        assert text(root2) == "x" * depth
+        assert root2.textlen == depth
+
+    def test_language_boxes(self, tmpdir):
+        inner = make_root([TextNode(Terminal("2"))])
+        lbox = TextNode(MagicTerminal("<Python 2.7.5>"))
+        lbox.symbol.ast = inner
+        lbox2 = TextNode(MagicTerminal("<SQL>"))
+        lbox2.symbol.ast = make_root([TextNode(Terminal("3"))])
+        root = make_root([TextNode(Terminal("1")), lbox, lbox2])
+        language_boxes = self.roundtrip(tmpdir, root)
+        assert [(l, w) for _, l, w in language_boxes] == \
+               [("Basic Calculator", True), ("SQL", True), ("Python 2.7.5", True)]
+        root2 = language_boxes[0][0]
+        assert [n.symbol.name for n in terminals(root2)] == ["", "1", "<Python 2.7.5>", "<SQL>", "eos"]
+        lbox = terminals(root2)[2]
+        assert lbox.symbol.ast is language_boxes[2][0]
+        assert lbox.symbol.ast.magic_backpointer is lbox
+        assert text(lbox.symbol.ast) == "2"
+        assert terminals(lbox.symbol.ast)[0].prev_term is None
+
+    def test_version(self, tmpdir):
+        root, version, expected = edit_tree()
+        filename = str(tmpdir.join("test.eco"))
+        JsonManager().save(root, "Basic Calculator", True, filename, version)
+        root2, _, _ = JsonManager().load(filename)[0]
+        assert text(root2) == expected
+        assert root2.textlen == len(expected)
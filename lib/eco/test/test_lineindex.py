@@ -0,0 +1,119 @@
+from lineindex import Line, LineIndex
+
+import random
+
+import pytest
+
+def check(index, expected):
+    assert list(index) == expected
+    assert len(index) == len(expected)
+    assert index.rows == sum(l.height for l in expected)
+    assert index.width == max([l.width for l in expected] or [0])
+    for i, line in enumerate(expected):
+        assert index[i] is line
+        assert index.index(line) == i
+        assert index.find(line.node) == i
+
+class Test_LineIndex:
+
+    def test_list_operations(self):
+        index = LineIndex()
+        expected = []
+        rng = random.Random(0)
+        for i in range(2000):
+            if expected and rng.random() < 0.4:
+                j = rng.randrange(len(expected))
+                del index[j]
+                del expected[j]
+            else:
+                j = rng.randrange(len(expected) + 1)
+                line = Line(object())
+                index.insert(j, line)
+                expected.insert(j, line)
+        check(index, expected)
+        assert index[-1] is expected[-1]
+        assert index[3:10] == expected[3:10]
+        del index[5:50]
+        del expected[5:50]
+        check(index, expected)
+        with pytest.raises(IndexError):
+            index[len(expected)]
+
+    def test_find(self):
+        index = LineIndex()
+        node = object()
+        index.append(Line(node))
+        assert index.find(node) == 0
+        assert index.find(object()) is None
+        del index[0]
+        assert index.find(node) is None
+
+    def test_rows(self):
+        index = LineIndex()
+        lines = [Line(object(), height) for height in [1, 3, 1, 2, 1]]
+        for line in lines:
+            index.append(line)
+        assert index.rows == 8
+        assert [index.row_of(i) for i in range(5)] == [0, 1, 4, 5, 7]
+        assert [index.line_at_row(row) for row in range(9)] == \
+               [(0, 0), (1, 1), (1, 1), (1, 1), (2, 4), (3, 5), (3, 5), (4, 7), (4, 7)]
+        assert index.line_at_row(-1) == (0, 0)
+
+        lines[1].height = 1
+        lines[4].width = 20
+        lines[2].width = 10
+        assert index.rows == 6
+        assert index.width == 20
+        assert index.line_at_row(4) == (3, 3)
+        lines[4].width = 0
+        assert index.width == 10
+
+    def test_versions(self):
+        index = LineIndex()
+        a, b, c, d = [Line(object()) for i in range(4)]
+        index.append(a)
+        index.save(1)
+        index.append(b)
+        index.save(2)
+        index.insert(0, c)
+        del index[1]
+        index.save(3)
+        assert list(index) == [c, b]
+
+        index.load(1)
+        assert list(index) == [a]
+        index.load(3)
+        assert list(index) == [c, b]
+
+        # Unsaved changes are discarded, versions that weren't saved fall
+        # back to the previous version
+        index.load(2)
+        index.append(d)
+        index.load(5)
+        assert list(index) == [c, b]
+
+        # Branch off version 2
+        index.load(2)
+        index.truncate(2)
+        index.append(d)
+        index.save(3)
+        assert list(index) == [a, b, d]
+        index.load(1)
+        assert list(index) == [a]
+        index.load(3)
+        assert list(index) == [a, b, d]
+        check(index, [a, b, d])
+
+    def test_compact(self):
+        index = LineIndex()
+        lines = [Line(object()) for i in range(5)]
+        for v, line in enumerate(lines):
+            index.append(line)
+            index.save(v + 1)
+        index.compact(3)
+        assert sorted(index.saved) == [3, 4, 5]
+        assert index.saved[3].parent is None
+        index.load(3)
+        assert list(index) == lines[:3]
+        index.load(5)
+        assert list(index) == lines
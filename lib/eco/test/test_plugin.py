@@ -0,0 +1,56 @@
+from ip_plugins.plugin import PluginManager, noop
+from ip_plugins.pythonindentation import PythonIndent
+
+class Recorder(object):
+
+    def __init__(self, name, calls, result=None):
+        self.name = name
+        self.calls = calls
+        self.result = result
+
+    def incparse_shift(self, la):
+        self.calls.append((self.name, la))
+        return self.result
+
+class IncParser(object):
+    pass
+
+class Test_PluginManager:
+
+    def test_missing_hook(self):
+        pm = PluginManager()
+        pm.add(Recorder("a", []))
+        assert pm.do_incparse_reduce is noop
+        assert pm.do_incparse_reduce(1) is None
+
+    def test_single_plugin(self):
+        calls = []
+        p = Recorder("a", calls, 1)
+        pm = PluginManager()
+        pm.add(p)
+        pm.resolve("incparse_shift")
+        assert "do_incparse_shift" in pm.__dict__
+        assert pm.do_incparse_shift == p.incparse_shift
+        assert pm.do_incparse_shift("x") == 1
+        assert calls == [("a", "x")]
+
+    def test_chain(self):
+        calls = []
+        pm = PluginManager()
+        pm.add(Recorder("a", calls))
+        assert pm.do_incparse_shift("x") is None
+        pm.add(Recorder("b", calls, 2))
+        pm.add(Recorder("c", calls, 3))
+        assert pm.do_incparse_shift("y") == 2
+        assert calls == [("a", "x"), ("a", "y"), ("b", "y"), ("c", "y")]
+
+    def test_loadplugins(self):
+        pm = PluginManager()
+        pm.loadplugins(object())
+        assert pm.loaded == []
+        assert pm.do_incparse_shift is noop
+
+        caller = IncParser()
+        pm.loadplugins(caller)
+        assert [type(p) for p in pm.loaded] == [PythonIndent]
+        assert pm.do_incparse_init == pm.loaded[0].incparse_init
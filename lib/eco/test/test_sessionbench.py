@@ -0,0 +1,56 @@
+from sessionbench import type_text, percentile, replay, read_log, main, SESSIONS, PYTHON
+from treemanager import TreeManager
+from grammars.grammars import lang_dict
+
+import io, json, contextlib
+
+class Test_SessionBench:
+
+    def test_type_text(self):
+        text = "class X:\n    def f(self):\n        pass\n\n    x = 1\ny = 2"
+        python = lang_dict["Python 2.7.5"]
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.apply_inputlog("\n".join(type_text(text)))
+        # blank lines keep the indentation the editor inserted
+        lines = [l.rstrip() for l in tm.export_as_text().split("\n")]
+        assert lines == text.split("\n")
+        assert parser.last_status
+
+    def test_percentile(self):
+        assert percentile([], 50) == 0
+        assert percentile([3, 1, 2], 50) == 2
+        assert percentile([1, 2], 50) == 1.5
+        assert percentile(list(range(101)), 99) == 99
+
+    def test_sessions(self):
+        for language, session, autolbox in SESSIONS.values():
+            assert language in lang_dict
+            assert session()
+
+    def test_replay(self):
+        result = replay("Basic Calculator", "self.key_normal('1')\nself.cursor.line = 0\nself.key_normal('+')\nself.key_normal('2')")
+        assert result["actions"] == 3
+        assert result["status"] is True
+        assert result["counters"]["shifts"] > 0
+        assert result["phases"]["parse"] > 0
+        assert result["latency"]["p50"] <= result["latency"]["max"]
+        assert result["peak_rss"] >= result["setup_rss"] > 0
+        assert TreeManager.report_stats is None
+
+    def test_main(self, tmpdir):
+        log = tmpdir.join("calc.log")
+        log.write("# Main language: Basic Calculator\nself.key_normal('1')\nself.key_normal('*')\nself.key_normal('3')\n")
+        assert read_log(str(log))[0] == "Basic Calculator"
+        output = str(tmpdir.join("results.json"))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            assert main([str(log), "-o", output]) == 0
+            assert main([str(log), "-c", output]) == 0
+        with open(output) as f:
+            results = json.load(f)
+        assert results["sessions"][str(log)]["actions"] == 3
+        lines = out.getvalue().splitlines()
+        assert lines[1].startswith(str(log))
+        assert "p50" in lines[-1]
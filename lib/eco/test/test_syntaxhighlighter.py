@@ -0,0 +1,25 @@
+from PyQt5.QtGui import QPalette
+
+from syntaxhighlighter import PythonHighlighter
+from grammar_parser.gparser import Terminal, Nonterminal
+from incparser.astree import TextNode
+
+def token(text, lookup, parent="atom"):
+    node = TextNode(Terminal(text))
+    node.lookup = lookup
+    node.parent = TextNode(Nonterminal(parent))
+    return node
+
+class Test_SyntaxHighlighter:
+
+    def test_style_ids(self):
+        h = PythonHighlighter(QPalette())
+        names = [h.get_style_id(token("x%s" % i, "NAME")) for i in range(100)]
+        assert len(set(names)) == 1
+        assert len(h.style_ids) == 1
+        # keywords are told apart by their text
+        assert h.get_style_id(token("print", "NAME")) != names[0]
+        assert h.get_style_id(token("def", "def", "funcdef")) != names[0]
+        assert h.get_style_id(token("f", "NAME", "funcdef")) != names[0]
+        assert len(h.style_ids) == 4
+        assert h.get_style_id(token("y", "NAME")) == names[0]
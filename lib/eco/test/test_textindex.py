@@ -0,0 +1,215 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from textindex import TextIndex
+from incparser.astree import EOS, TextNode
+from grammar_parser.gparser import MagicTerminal
+from utils import KEY_UP as UP, KEY_DOWN as DOWN, KEY_LEFT as LEFT, KEY_RIGHT as RIGHT
+
+from . import programs
+
+import math, random
+
+python = lang_dict["Python 2.7.5"]
+prolog = lang_dict["Prolog"]
+pythonprolog = lang_dict["Python + Prolog"]
+
+def load(language, text=None):
+    parser, lexer = language.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, language.name)
+    if text is not None:
+        tm.import_file(text)
+    return tm
+
+def visible(tm):
+    """Returns the visible terminals of the document by walking it."""
+    cursor = tm.cursor
+    nodes = []
+    node = tm.get_bos()
+    while True:
+        node = cursor.find_next_visible(node)
+        if isinstance(node, EOS):
+            return nodes
+        if isinstance(node.symbol, MagicTerminal):
+            node = node.symbol.ast.children[0]
+            continue
+        nodes.append(node)
+
+def check(tm):
+    expected = visible(tm)
+    assert list(tm.text) == expected
+    offset = 0
+    for node in expected:
+        assert tm.get_offset(node) == offset
+        width = len(node.symbol.name)
+        offset += width
+        assert tm.get_node_at_offset(offset) == (node, width)
+    assert tm.text.chars == offset
+    # columns are the same as those found by walking the lines
+    walking = tm.cursor.copy()
+    walking.text = None
+    for line in range(len(tm.lines)):
+        for column in [0, 1, 3, 4, 5, 9, 30, 1000]:
+            node, pos = tm.get_node_at(line, column)
+            walking.line = line
+            walking.move_to_x(column)
+            assert (node, pos) == (walking.node, walking.pos)
+            cursor = tm.cursor.copy()
+            cursor.node, cursor.pos, cursor.line = node, pos, line
+            assert cursor.get_x() == walking.get_x()
+
+def height(entry):
+    if entry is None:
+        return 0
+    return 1 + max(height(entry._left), height(entry._right))
+
+class Test_TextIndex:
+
+    def test_import(self):
+        tm = load(python, programs.connect4)
+        check(tm)
+        assert tm.get_node_at_offset(0) == (tm.get_bos(), 0)
+        last = visible(tm)[-1]
+        assert tm.get_node_at_offset(10**6) == (last, len(last.symbol.name))
+
+    def test_typing(self):
+        tm = load(python, "x = 1\n\ndef f(a):\n    return a\n")
+        for c in "y = 2\r":
+            tm.key_normal(c)
+            check(tm)
+        tm.cursor_movement(DOWN)
+        tm.cursor_movement(DOWN)
+        tm.key_end()
+        for c in "\rb = (a, 1)":
+            tm.key_normal(c)
+            check(tm)
+        for i in range(4):
+            tm.key_backspace()
+            check(tm)
+        tm.key_home()
+        tm.key_delete()
+        check(tm)
+
+    def test_selection(self):
+        tm = load(python, "x = 1\ndef f(a):\n    return a\ny = 2\n")
+        tm.cursor_movement(RIGHT)
+        tm.selection_start = tm.cursor.copy()
+        for i in range(9):
+            tm.cursor_movement(RIGHT)
+        tm.selection_end = tm.cursor.copy()
+        tm.deleteSelection()
+        check(tm)
+
+    def test_undo(self):
+        tm = load(python)
+        for text in ["x = 1", "\rclass", " X:", "\r    ", "pass", "\ry = x"]:
+            for c in text:
+                tm.key_normal(c)
+            tm.undo_snapshot()
+            check(tm)
+        tm.key_home()
+        tm.key_delete()
+        tm.undo_snapshot()
+        check(tm)
+        for i in range(7):
+            tm.key_ctrl_z()
+            check(tm)
+        for i in range(7):
+            tm.key_shift_ctrl_z()
+            check(tm)
+
+    def test_language_boxes(self):
+        tm = load(pythonprolog, "x = 1\ny = 2\n")
+        tm.key_end()
+        tm.key_normal(" ")
+        tm.key_normal("+")
+        tm.key_normal(" ")
+        tm.add_languagebox(prolog)
+        for c in "a :- b.":
+            tm.key_normal(c)
+            check(tm)
+        tm.leave_languagebox()
+        tm.key_normal(" ")
+        check(tm)
+        tm.cursor_movement(LEFT)
+        tm.cursor_movement(LEFT)
+        tm.selection_start = tm.cursor.copy()
+        for i in range(4):
+            tm.cursor_movement(RIGHT)
+        tm.selection_end = tm.cursor.copy()
+        tm.deleteSelection()
+        check(tm)
+        tm.undo_snapshot()
+        tm.key_ctrl_z()
+        check(tm)
+        tm.key_shift_ctrl_z()
+        check(tm)
+
+    def test_random_edits(self):
+        rng = random.Random(4)
+        tm = load(python, programs.connect4)
+        for i in range(200):
+            r = rng.random()
+            if r < 0.3:
+                tm.key_normal(rng.choice("abc =+()\r:,1"))
+            elif r < 0.45:
+                tm.key_backspace()
+            elif r < 0.55:
+                tm.key_delete()
+            elif r < 0.8:
+                tm.cursor_movement(rng.choice([UP, DOWN, LEFT, RIGHT]))
+            elif r < 0.9:
+                tm.key_ctrl_z()
+            else:
+                tm.key_shift_ctrl_z()
+            if i % 20 == 0:
+                check(tm)
+        check(tm)
+
+    def test_flat_list(self, monkeypatch):
+        # Lists are left-recursive (e.g. `stmts ::= stmts stmt`), so the depth
+        # of the parse tree grows with the length of the file. The costs of
+        # the index only depend on the number of terminals that changed.
+        random.seed(0)
+        for n in [100, 400]:
+            tm = load(python, "x = 1\n" * n)
+            assert len(tm.text) == 6 * n
+            assert height(tm.text.root) <= 4 * math.log(6 * n, 2)
+
+            walked = [0]
+            def count(f):
+                def counted(self):
+                    walked[0] += 1
+                    return f(self)
+                return counted
+            monkeypatch.setattr(TextNode, "next_terminal", count(TextNode.next_terminal))
+            monkeypatch.setattr(TextNode, "previous_terminal", count(TextNode.previous_terminal))
+
+            def query():
+                walked[0] = 0
+                # the line break ending the last statement
+                last = tm.lines[n].node
+                assert tm.get_offset(last) == 6 * n
+                assert tm.get_node_at_offset(6 * n - 2)[0].symbol.name == "="
+                assert tm.get_node_at(n - 1, 3)[0].symbol.name == "="
+                cursor = tm.cursor.copy()
+                cursor.line = n - 1
+                cursor.move_to_x(4)
+                assert cursor.get_x() == 4
+                return walked[0]
+
+            result = []
+            # first queries after edits at the start and at the end
+            tm.key_normal("y")
+            result.append(query())
+            result.append(query())
+            tm.key_end()
+            for i in range(n):
+                tm.cursor_movement(DOWN)
+            tm.key_normal("y")
+            result.append(query())
+            result.append(query())
+            monkeypatch.undo()
+            # walking to the last line would take several calls per line
+            assert result[0] < 50 and result[2] < 50
+            assert result[1] == result[3] == 0
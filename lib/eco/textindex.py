@@ -0,0 +1,643 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Index of the text shown in the editor.
+
+The visible terminals of the document, including those of language boxes, are
+kept in document order in a treap (see lineindex.py). Every subtree stores its
+number of characters and line breaks. This gives O(log n) character offsets
+and columns of terminals, and O(log n) lookups of terminals by offset or by
+column within a line.
+
+The index isn't changed directly. The tree manager passes it the terminals it
+saves or recovers, and terminals that have been edited but not saved yet are
+found through their change flags. Before answering a query, the index replaces
+the entries around each of these terminals with the visible terminals that
+are now between their nearest unchanged neighbours. Its costs therefore only
+depend on the number of changed terminals, not on the shape of the parse
+tree."""
+
+from random import random
+
+from incparser.astree import BOS, EOS, MultiTextNode
+from grammar_parser.gparser import MagicTerminal, IndentationTerminal, Nonterminal
+
+class Unlinked(Exception):
+    """Raised when walking from a node that isn't part of the document."""
+
+class Entry(object):
+    """A visible terminal in the index."""
+
+    __slots__ = ["node", "width", "newline", "_parent", "_left", "_right",
+                 "_priority", "_size", "_chars", "_newlines"]
+
+    def __init__(self, node):
+        self.node = node
+        self.width = len(node.symbol.name)
+        self.newline = 1 if node.symbol.name == "\r" else 0
+
+        # treap node
+        self._parent = None
+        self._left = None
+        self._right = None
+        self._priority = random()
+        self._size = 1
+        self._chars = self.width
+        self._newlines = self.newline
+
+    def _pull(self):
+        """Recomputes the values of this subtree from its children."""
+        size = 1
+        chars = self.width
+        newlines = self.newline
+        left = self._left
+        if left is not None:
+            size += left._size
+            chars += left._chars
+            newlines += left._newlines
+        right = self._right
+        if right is not None:
+            size += right._size
+            chars += right._chars
+            newlines += right._newlines
+        self._size = size
+        self._chars = chars
+        self._newlines = newlines
+
+    def __repr__(self):
+        return "Entry(%s)" % (self.node,)
+
+def is_visible(node):
+    """Checks whether `node` has an entry in the index. Unlike the cursor, this
+    excludes language boxes, as their text is indexed instead."""
+    if isinstance(node, BOS) or isinstance(node, EOS):
+        return False
+    if type(node) is MultiTextNode:
+        return False
+    symbol = node.symbol
+    return not isinstance(symbol, IndentationTerminal) and not isinstance(symbol, MagicTerminal)
+
+class TextIndex(object):
+    """See the module docstring. `roots` returns the roots of all language
+    boxes, starting with the main language."""
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.root = None
+        self.entries = {}       # node -> entry
+        self.pending = []       # nodes saved or recovered since the last sync
+        self.valid = False      # rebuilt on the next query if False
+        self.images = False     # set if terminals may be shown as images
+
+    def __len__(self):
+        self.sync()
+        if self.root is None:
+            return 0
+        return self.root._size
+
+    def __iter__(self):
+        self.sync()
+        entry = self.first()
+        while entry is not None:
+            yield entry.node
+            entry = self.successor(entry)
+
+    @property
+    def chars(self):
+        """Length of the text of the document."""
+        self.sync()
+        if self.root is None:
+            return 0
+        return self.root._chars
+
+    def invalidate(self):
+        """Rebuilds the index from the document on its next use."""
+        self.valid = False
+        self.pending = []
+
+    def changed(self, node):
+        """Notes that `node` has been saved or recovered, so it may have been
+        edited, moved, inserted or removed."""
+        if self.valid:
+            self.pending.append(node)
+            if len(self.pending) > 2 * len(self.entries) + 64:
+                self.invalidate()
+
+    # Queries
+
+    def offset(self, node):
+        """Returns the character offset of `node` in the document, or None if
+        the index can't tell. Invisible nodes are placed after the text in
+        front of them."""
+        if not self.sync():
+            return None
+        entry = self.entries.get(node)
+        if entry is not None:
+            return self._before(entry)[0]
+        entry = self._previous_entry(node)
+        if entry is None:
+            return 0
+        return self._before(entry)[0] + entry.width
+
+    def node_at(self, offset):
+        """Returns the node left of character `offset` and the position within
+        that node, like the cursor does. Offsets past the end of the document
+        map to its end. Returns None if the index can't tell."""
+        if not self.sync():
+            return None
+        if offset > 0:
+            entry, before = self._find(offset)
+            if entry is not None:
+                return entry.node, offset - before
+            entry = self.last()
+            if entry is not None:
+                return entry.node, entry.width
+        return self.roots()[0].children[0], 0
+
+    def column(self, node):
+        """Returns the number of characters between the start of the line and
+        `node`, or None if the index can't tell."""
+        if self.images or not self.sync():
+            return None
+        entry = self.entries.get(node)
+        extra = 0
+        if entry is None:
+            if is_visible(node):
+                return None
+            # count the text in front of invisible nodes
+            entry = self._previous_entry(node)
+            if entry is None or entry.newline:
+                return 0
+            extra = entry.width
+        chars, newlines = self._before(entry)
+        if newlines > 0:
+            chars -= self._before(self._newline(newlines - 1))[0] + 1
+        return chars + extra
+
+    def find_column(self, start, column):
+        """Returns the node at `column` (> 0) of the line starting after the
+        line break or BOS `start` and the position within that node, like
+        `Cursor.move_to_x`. Columns past the end of the line map to its end.
+        Returns None if the index can't tell."""
+        if self.images or not self.sync():
+            return None
+        entry = self.entries.get(start)
+        if entry is not None:
+            base, newlines = self._before(entry)
+            base += entry.width
+            newlines += entry.newline
+        elif start is self.roots()[0].children[0]:
+            base = newlines = 0
+        else:
+            return None
+        end = self._newline(newlines)
+        if end is not None and base + column > self._before(end)[0]:
+            # past the end of the line
+            entry = self.predecessor(end)
+        else:
+            entry, before = self._find(base + column)
+            if entry is not None:
+                return entry.node, base + column - before
+            entry = self.last()
+        if entry is None:
+            return start, len(start.symbol.name)
+        return entry.node, entry.width
+
+    def first(self):
+        entry = self.root
+        if entry is None:
+            return None
+        while entry._left is not None:
+            entry = entry._left
+        return entry
+
+    def last(self):
+        entry = self.root
+        if entry is None:
+            return None
+        while entry._right is not None:
+            entry = entry._right
+        return entry
+
+    def successor(self, entry):
+        if entry._right is not None:
+            entry = entry._right
+            while entry._left is not None:
+                entry = entry._left
+            return entry
+        while entry._parent is not None and entry._parent._right is entry:
+            entry = entry._parent
+        return entry._parent
+
+    def predecessor(self, entry):
+        if entry._left is not None:
+            entry = entry._left
+            while entry._right is not None:
+                entry = entry._right
+            return entry
+        while entry._parent is not None and entry._parent._left is entry:
+            entry = entry._parent
+        return entry._parent
+
+    def _before(self, entry):
+        """Returns the number of characters and line breaks in front of
+        `entry`."""
+        chars = newlines = 0
+        left = entry._left
+        if left is not None:
+            chars += left._chars
+            newlines += left._newlines
+        while entry._parent is not None:
+            parent = entry._parent
+            if parent._right is entry:
+                chars += parent.width
+                newlines += parent.newline
+                left = parent._left
+                if left is not None:
+                    chars += left._chars
+                    newlines += left._newlines
+            entry = parent
+        return chars, newlines
+
+    def _find(self, offset):
+        """Returns the first entry ending at or after `offset` and the number
+        of characters in front of it, or None and the length of the text."""
+        before = 0
+        entry = self.root
+        while entry is not None:
+            left = entry._left
+            if left is not None:
+                if before + left._chars >= offset:
+                    entry = left
+                    continue
+                before += left._chars
+            if before + entry.width >= offset:
+                return entry, before
+            before += entry.width
+            entry = entry._right
+        return None, before
+
+    def _newline(self, i):
+        """Returns the entry of the `i`-th line break (or None)."""
+        entry = self.root
+        while entry is not None:
+            left = entry._left
+            lnewlines = left._newlines if left is not None else 0
+            if i < lnewlines:
+                entry = left
+                continue
+            i -= lnewlines
+            if entry.newline:
+                if i == 0:
+                    return entry
+                i -= 1
+            entry = entry._right
+        return None
+
+    def _rank(self, entry):
+        i = entry._left._size if entry._left is not None else 0
+        while entry._parent is not None:
+            parent = entry._parent
+            if parent._right is entry:
+                i += 1
+                if parent._left is not None:
+                    i += parent._left._size
+            entry = parent
+        return i
+
+    def _previous_entry(self, node):
+        """Returns the entry of the visible terminal in front of `node`, or None
+        at the beginning of the document."""
+        while True:
+            node = self._previous(node)
+            if node is None:
+                return None
+            entry = self.entries.get(node)
+            if entry is not None:
+                return entry
+
+    # Walking the document
+
+    def _next(self, node):
+        """Returns the terminal following `node` in the document, entering and
+        leaving language boxes, or None at the end of the document. Raises
+        Unlinked if `node` is in a language box that has been removed."""
+        if isinstance(node.symbol, MagicTerminal):
+            root = node.symbol.ast
+            if root.get_magicterminal() is not node:
+                raise Unlinked(node)
+            return root.children[0]
+        if isinstance(node, EOS):
+            root = node.parent
+            lbox = root.get_magicterminal()
+            if lbox is None:
+                if root is self.roots()[0]:
+                    return None
+                raise Unlinked(node)
+            following = lbox.next_terminal()
+            if lbox.deleted or following is None or following.previous_terminal() is not lbox:
+                raise Unlinked(node)
+            return following
+        following = node.next_terminal()
+        if following is None:
+            raise Unlinked(node)
+        return following
+
+    def _previous(self, node):
+        """Returns the terminal in front of `node` in the document, entering
+        and leaving language boxes, or None at the beginning of the document.
+        Links to previous terminals aren't always updated when terminals are
+        removed, so this is only a hint (see `_repair`)."""
+        if isinstance(node, BOS):
+            lbox = node.parent.get_magicterminal()
+            if lbox is None:
+                return None
+            return lbox
+        previous = node.previous_terminal()
+        if previous is not None and isinstance(previous.symbol, MagicTerminal):
+            return previous.symbol.ast.children[-1]
+        return previous
+
+    def _is_linked(self, node):
+        """Checks whether the neighbours of `node` link back to it, i.e.
+        whether it can be used to find the text following it."""
+        if node.deleted:
+            return False
+        previous = node.previous_terminal()
+        following = node.next_terminal()
+        return previous is not None and previous.next_terminal() is node and \
+               following is not None and following.previous_terminal() is node
+
+    # Maintenance
+
+    def sync(self):
+        """Brings the index up to date with the document. Returns False if
+        that isn't possible."""
+        if not self.valid:
+            return self.rebuild()
+        changed = self._changed()
+        if not self.pending and not changed:
+            return True
+        dirty = set()
+        for node in self.pending + changed:
+            if isinstance(node.symbol, Nonterminal):
+                continue
+            dirty.add(node)
+            if type(node) is MultiTextNode:
+                # moving nodes in and out of multinodes only marks the multinode
+                dirty.update(node.children)
+        self.pending = []
+        if len(dirty) > len(self.entries) // 2 + 64:
+            return self.rebuild()
+        for node in list(dirty):
+            if node in dirty and not self._repair(node, dirty):
+                return self.rebuild()
+        return True
+
+    def _changed(self):
+        """Returns the terminals that have been edited but not saved yet."""
+        todo = [root for root in self.roots() if root.has_changes()]
+        nodes = []
+        while todo:
+            node = todo.pop()
+            if isinstance(node.symbol, Nonterminal):
+                for c in node.children:
+                    if c.has_changes():
+                        todo.append(c)
+            else:
+                nodes.append(node)
+        return nodes
+
+    def _anchor(self, entry, dirty):
+        """Returns the nearest entry up to `entry` that is unchanged and whose
+        text can be followed (or None for the beginning of the document)."""
+        while entry is not None:
+            if entry.node not in dirty and self._is_linked(entry.node):
+                return entry
+            entry = self.predecessor(entry)
+        return None
+
+    def _repair(self, node, dirty):
+        """Replaces the entries following an unchanged terminal in front of
+        `node` up to the next unchanged terminal by the visible terminals
+        between them in the document. If `node` can't be found in the
+        document, it has been removed and so is its entry. Returns False if
+        the index needs to be rebuilt.
+
+        The document is only walked forwards, as links to previous terminals
+        may be out of date. They are only used to find where new terminals
+        have been inserted."""
+        entries = self.entries
+        candidates = []
+        entry = entries.get(node)
+        if entry is not None:
+            candidates.append(self.predecessor(entry))
+        previous = node
+        for i in range(len(entries) + 1):
+            previous = self._previous(previous)
+            if previous is None or previous in entries:
+                break
+        candidates.append(entries.get(previous) if previous is not None else None)
+        tried = []
+        for left in candidates:
+            left = self._anchor(left, dirty)
+            while left not in tried:
+                tried.append(left)
+                nodes = []
+                right = None
+                following = left.node if left is not None else self.roots()[0].children[0]
+                found = following is node
+                try:
+                    while True:
+                        following = self._next(following)
+                        if following is None:
+                            break
+                        right = entries.get(following)
+                        if right is not None and following not in dirty:
+                            break
+                        right = None
+                        nodes.append(following)
+                        if following is node:
+                            found = True
+                except Unlinked:
+                    # the anchor is in a language box that has been removed
+                    if left is None:
+                        return False
+                    dirty.add(left.node)
+                    left = self._anchor(left, dirty)
+                    continue
+                if found:
+                    return self._replace(left, right, nodes, dirty)
+        # `node` has been removed from the document
+        dirty.discard(node)
+        if entry is not None:
+            self._remove(entry)
+        return True
+
+    def _replace(self, left, right, nodes, dirty):
+        """Replaces the entries between `left` and `right` by entries for the
+        visible nodes in `nodes`."""
+        if left is not None and right is not None:
+            if self._rank(left) >= self._rank(right):
+                return False
+        entry = self.successor(left) if left is not None else self.first()
+        while entry is not None and entry is not right:
+            following = self.successor(entry)
+            self._remove(entry)
+            entry = following
+        if entry is not right:
+            return False
+        for n in nodes:
+            dirty.discard(n)
+            if not is_visible(n):
+                continue
+            entry = self.entries.get(n)
+            if entry is not None:
+                # moved here from somewhere else
+                self._remove(entry)
+            entry = Entry(n)
+            self._insert_after(left, entry)
+            left = entry
+        return True
+
+    def rebuild(self):
+        """Rebuilds the index from the document in O(n)."""
+        self.root = None
+        self.entries = {}
+        self.pending = []
+        self.valid = False
+        roots = self.roots()
+        if not roots:
+            return False
+        node = roots[0].children[0]
+        nodes = []
+        try:
+            while True:
+                node = self._next(node)
+                if node is None:
+                    break
+                if is_visible(node):
+                    nodes.append(node)
+        except Unlinked:
+            return False
+        # Build the treap from the sorted entries (as a Cartesian tree)
+        stack = []
+        for node in nodes:
+            entry = Entry(node)
+            self.entries[node] = entry
+            last = None
+            while stack and stack[-1]._priority > entry._priority:
+                last = stack.pop()
+            entry._left = last
+            if last is not None:
+                last._parent = entry
+            if stack:
+                stack[-1]._right = entry
+                entry._parent = stack[-1]
+            stack.append(entry)
+        if stack:
+            self.root = stack[0]
+            order = []
+            todo = [self.root]
+            while todo:
+                entry = todo.pop()
+                order.append(entry)
+                if entry._left is not None:
+                    todo.append(entry._left)
+                if entry._right is not None:
+                    todo.append(entry._right)
+            for entry in reversed(order):
+                entry._pull()
+        self.valid = True
+        return True
+
+    def _insert_after(self, previous, entry):
+        """Inserts `entry` after the entry `previous` (or at the beginning if
+        it's None)."""
+        self.entries[entry.node] = entry
+        if self.root is None:
+            self.root = entry
+            return
+        if previous is None:
+            parent = self.first()
+            parent._left = entry
+        elif previous._right is None:
+            parent = previous
+            parent._right = entry
+        else:
+            parent = previous._right
+            while parent._left is not None:
+                parent = parent._left
+            parent._left = entry
+        entry._parent = parent
+        while parent is not None:
+            parent._pull()
+            parent = parent._parent
+        while entry._parent is not None and entry._priority < entry._parent._priority:
+            self._rotate_up(entry)
+
+    def _remove(self, entry):
+        while entry._left is not None and entry._right is not None:
+            if entry._left._priority < entry._right._priority:
+                self._rotate_up(entry._left)
+            else:
+                self._rotate_up(entry._right)
+        child = entry._left if entry._left is not None else entry._right
+        parent = entry._parent
+        if child is not None:
+            child._parent = parent
+        if parent is None:
+            self.root = child
+        elif parent._left is entry:
+            parent._left = child
+        else:
+            parent._right = child
+        while parent is not None:
+            parent._pull()
+            parent = parent._parent
+        entry._parent = entry._left = entry._right = None
+        if self.entries.get(entry.node) is entry:
+            del self.entries[entry.node]
+
+    def _rotate_up(self, entry):
+        parent = entry._parent
+        grandparent = parent._parent
+        if parent._left is entry:
+            parent._left = entry._right
+            if entry._right is not None:
+                entry._right._parent = parent
+            entry._right = parent
+        else:
+            parent._right = entry._left
+            if entry._left is not None:
+                entry._left._parent = parent
+            entry._left = parent
+        parent._parent = entry
+        entry._parent = grandparent
+        if grandparent is None:
+            self.root = entry
+        elif grandparent._left is parent:
+            grandparent._left = entry
+        else:
+            grandparent._right = entry
+        parent._pull()
+        entry._pull()
@@ -0,0 +1,309 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Compiles the regex ASTs produced by `RegexParser` into a single minimized
+DFA.
+
+The alphabet is partitioned into character classes that no pattern can tell
+apart, plus one extra class for language boxes (and indentation terminals),
+which are only matched by the wildcard and by negated ranges. Ties between
+rules are resolved by rule order, and non-greedy repetitions stop as soon as
+the remainder of the pattern matches."""
+
+from bisect import bisect_right
+
+MAXCHAR = 0x10FFFF
+
+def _charset(pattern):
+    """Returns the intervals matched by a RE_CHAR or RE_RANGE and whether it
+    also matches language boxes."""
+    from treelexer.lexer import RE_CHAR
+    if type(pattern) is RE_CHAR:
+        c = pattern.c
+        if c == ".":
+            return [(0, MAXCHAR)], True
+        if len(c) == 2 and c[0] == "\\":
+            c = c[1]
+        if len(c) != 1:
+            return [], False
+        return [(ord(c), ord(c))], False
+    intervals = []
+    for o in sorted(set(pattern.c)):
+        if intervals and intervals[-1][1] == o - 1:
+            intervals[-1] = (intervals[-1][0], o)
+        else:
+            intervals.append((o, o))
+    if not pattern.neg:
+        return intervals, False
+    # Negated char ranges can never exclude a language box
+    negated = []
+    lo = 0
+    for a, b in intervals:
+        if a > lo:
+            negated.append((lo, a - 1))
+        lo = b + 1
+    if lo <= MAXCHAR:
+        negated.append((lo, MAXCHAR))
+    return negated, True
+
+class NFA(object):
+    """Thompson construction of all rules into one automaton."""
+
+    def __init__(self, patterns):
+        self.eps = []
+        self.edges = []
+        self.charsets = []
+        self.rule = []
+        # Maps the end of a list containing a non-greedy repetition to the
+        # states of the repetition and the remainder of the list
+        self.nongreedy = {}
+        self.start = self.new_state(-1)
+        self.finals = []
+        for i, pattern in enumerate(patterns):
+            s = self.new_state(i)
+            self.eps[self.start].append(s)
+            self.finals.append(self.build(pattern, s, i))
+
+    def new_state(self, rule):
+        self.eps.append([])
+        self.edges.append([])
+        self.rule.append(rule)
+        return len(self.rule) - 1
+
+    def build(self, pattern, s, rule):
+        from treelexer.lexer import RE_CHAR, RE_RANGE, RE_OR, RE_STAR, RE_PLUS, RE_QUESTION
+        if not pattern:
+            return s
+        if type(pattern) is list:
+            for i, p in enumerate(pattern):
+                if type(p) in (RE_STAR, RE_PLUS) and p.ng and i < len(pattern) - 1:
+                    # A non-greedy repetition stops as soon as the rest of the
+                    # list matches (a trailing one behaves greedily)
+                    first = len(self.rule)
+                    s = self.build(p, s, rule)
+                    s = self.build(pattern[i+1:], s, rule)
+                    self.nongreedy.setdefault(s, set()).update(range(first, len(self.rule)))
+                    return s
+                s = self.build(p, s, rule)
+            return s
+        if type(pattern) in (RE_CHAR, RE_RANGE):
+            t = self.new_state(rule)
+            self.charsets.append(_charset(pattern))
+            self.edges[s].append((len(self.charsets) - 1, t))
+            return t
+        if type(pattern) is RE_OR:
+            e = self.new_state(rule)
+            for alt in (pattern.lhs, pattern.rhs):
+                a = self.new_state(rule)
+                self.eps[s].append(a)
+                self.eps[self.build(alt, a, rule)].append(e)
+            return e
+        if type(pattern) in (RE_STAR, RE_PLUS):
+            loop = self.new_state(rule)
+            self.eps[s].append(loop)
+            end = self.build(pattern.c, loop, rule)
+            self.eps[end].append(loop)
+            if type(pattern) is RE_PLUS:
+                return end
+            return loop
+        if type(pattern) is RE_QUESTION:
+            a = self.new_state(rule)
+            e = self.new_state(rule)
+            self.eps[s].append(a)
+            self.eps[s].append(e)
+            self.eps[self.build(pattern.c, a, rule)].append(e)
+            return e
+        raise NotImplementedError(pattern)
+
+    def closure(self, states):
+        result = self._closure(states, ())
+        triggers = [s for s in result if s in self.nongreedy]
+        if triggers:
+            # Once the remainder of a non-greedy repetition has matched, all
+            # other paths through the repetition and the remainder are dead
+            dead = set()
+            for s in triggers:
+                dead.update(self.nongreedy[s])
+            dead.difference_update(triggers)
+            alive = [s for s in set(states).union(triggers) if s not in dead]
+            result = self._closure(alive, dead)
+        return frozenset(result)
+
+    def _closure(self, states, dead):
+        result = set(states)
+        todo = list(states)
+        while todo:
+            s = todo.pop()
+            for t in self.eps[s]:
+                if t not in result and t not in dead:
+                    result.add(t)
+                    todo.append(t)
+        return result
+
+class DFA(object):
+
+    def __init__(self, patterns):
+        nfa = NFA(patterns)
+        self.build_alphabet(nfa)
+        trans, accept, start = self.build_dfa(nfa)
+        self.minimize(trans, accept, start)
+
+    def build_alphabet(self, nfa):
+        """Partitions the characters into classes so that each NFA edge either
+        matches a whole class or none of it. Classes that are matched by
+        exactly the same edges are merged into one column."""
+        points = set([0])
+        for intervals, _ in nfa.charsets:
+            for a, b in intervals:
+                points.add(a)
+                if b < MAXCHAR:
+                    points.add(b + 1)
+        points = sorted(points)
+        lbox = len(points)
+        signatures = [[] for _ in range(lbox + 1)]
+        for i, (intervals, haslbox) in enumerate(nfa.charsets):
+            for a, b in intervals:
+                for k in range(bisect_right(points, a) - 1, bisect_right(points, b)):
+                    signatures[k].append(i)
+            if haslbox:
+                signatures[lbox].append(i)
+        columns = {}
+        groups = []
+        for sig in signatures:
+            groups.append(columns.setdefault(tuple(sig), len(columns)))
+        self.points = points
+        self.groups = groups[:lbox]
+        self.lbox = groups[lbox]
+        self.ncolumns = len(columns)
+        self.edgecolumns = [set() for _ in nfa.charsets]
+        for k, sig in enumerate(signatures):
+            for i in sig:
+                self.edgecolumns[i].add(groups[k])
+        self.charcache = {}
+
+    def build_dfa(self, nfa):
+        """Subset construction. Returns the transition table, the accepted
+        rule of each state (or -1) and the start state."""
+        start = nfa.closure([nfa.start])
+        ids = {start: 0}
+        todo = [start]
+        trans = []
+        accept = []
+        closures = {}
+        while todo:
+            states = todo.pop()
+            sid = ids[states]
+            while len(trans) <= sid:
+                trans.append(None)
+                accept.append(-1)
+            rules = [nfa.rule[s] for s in states
+                     if nfa.rule[s] >= 0 and nfa.finals[nfa.rule[s]] == s]
+            accept[sid] = min(rules) if rules else -1
+            moves = {}
+            for s in states:
+                for charset, t in nfa.edges[s]:
+                    for col in self.edgecolumns[charset]:
+                        moves.setdefault(col, set()).add(t)
+            row = [-1] * self.ncolumns
+            for col, targets in moves.items():
+                targets = frozenset(targets)
+                target = closures.get(targets)
+                if target is None:
+                    target = closures[targets] = nfa.closure(targets)
+                if target not in ids:
+                    ids[target] = len(ids)
+                    todo.append(target)
+                row[col] = ids[target]
+            trans[sid] = row
+        return trans, accept, 0
+
+    def minimize(self, trans, accept, start):
+        """Merges equivalent states by refining the partition induced by the
+        accepted rule until it is stable (Moore's algorithm)."""
+        block = list(accept)
+        nblocks = -1
+        while True:
+            keys = {}
+            newblock = []
+            for s, row in enumerate(trans):
+                key = (block[s], tuple([block[t] if t >= 0 else -1 for t in row]))
+                newblock.append(keys.setdefault(key, len(keys)))
+            block = newblock
+            if len(keys) == nblocks:
+                break
+            nblocks = len(keys)
+        # Renumber so that the start state is 0
+        order = {block[start]: 0}
+        for s in range(len(trans)):
+            order.setdefault(block[s], len(order))
+        self.trans = [None] * nblocks
+        self.accept = [-1] * nblocks
+        for s, row in enumerate(trans):
+            b = order[block[s]]
+            if self.trans[b] is None:
+                self.trans[b] = [order[block[t]] if t >= 0 else -1 for t in row]
+                self.accept[b] = accept[s]
+        self.start = 0
+        # States without outgoing transitions don't need to look at the next
+        # character to know that the match is complete
+        self.final = [max(row) < 0 for row in self.trans]
+
+    def column(self, c):
+        try:
+            return self.charcache[c]
+        except KeyError:
+            col = self.groups[bisect_right(self.points, ord(c)) - 1]
+            self.charcache[c] = col
+            return col
+
+    def __len__(self):
+        return len(self.trans)
+
+    def scan(self, text, pos):
+        """Finds the longest match in `text` starting at `pos`. Returns the
+        matched rule (or -1), the end of the match and the number of
+        characters that had to be examined (counting the end of the input as
+        a character)."""
+        trans = self.trans
+        accept = self.accept
+        final = self.final
+        charcache = self.charcache
+        state = self.start
+        rule = -1
+        end = pos
+        i = pos
+        length = len(text)
+        while not final[state]:
+            if i >= length:
+                i += 1
+                break
+            c = text[i]
+            col = charcache.get(c)
+            if col is None:
+                col = self.column(c)
+            state = trans[state][col]
+            i += 1
+            if state < 0:
+                break
+            if accept[state] >= 0:
+                rule = accept[state]
+                end = i
+        return rule, end, i - pos
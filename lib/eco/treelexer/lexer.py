@@ -204,6 +204,9 @@ class PatternMatcher(object):
 from incparser.astree import TextNode, BOS, EOS, MultiTextNode
 from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from grammars.grammars import regex
+from treelexer.dfa import DFA
+from incparser.cache import GrammarCache, digest
+import logging
 
 class LBPH(object):
     # Placeholder for language boxes to be used within the generated tokens.
@@ -213,6 +216,46 @@ class LBPH(object):
 
 lbph = LBPH()
 
+def join_token(result):
+    """Joins a list of matched characters (where None stands for a language
+    box) into a token string, or into a list of subtokens if it contains
+    newlines or language boxes."""
+    l = []
+    j = 0
+    for i in range(len(result)):
+        if result[i] is None:
+            if j < i:
+                l.append("".join(result[j:i]))
+            l.append(lbph)
+            j = i+1
+        elif result[i] == "\r":
+            if j < i:
+                l.append("".join(result[j:i]))
+            l.append(result[i])
+            j = i+1
+    if j < len(result):
+        l.append("".join(result[j:]))
+
+    if len(l) == 1:
+        return l[0]
+    return l
+
+def next_node(node):
+    """Returns the next node the lexer reads after `node`, stepping into and
+    out of MultiTextNodes and skipping empty nodes."""
+    while True:
+        if node.next_term is None and node.ismultichild():
+            node = node.parent.next_term
+        else:
+            assert node.next_term is not None
+            node = node.next_term
+
+        if type(node) is MultiTextNode:
+            node = node.children[0]
+
+        if node.symbol.name != "":
+            return node
+
 class TreePatternMatcher(PatternMatcher):
 
     def __init__(self):
@@ -243,17 +286,7 @@ class TreePatternMatcher(PatternMatcher):
             self.pos = 0
 
     def inc_node(self):
-        if self.text.next_term is None and self.text.ismultichild():
-            self.text = self.text.parent.next_term
-        else:
-            assert self.text.next_term is not None
-            self.text = self.text.next_term
-
-        if type(self.text) is MultiTextNode:
-            self.text = self.text.children[0]
-
-        if self.text.symbol.name == "":
-            self.inc_node()
+        self.text = next_node(self.text)
 
     def append(self):
         if type(self.text.symbol) is MagicTerminal:
@@ -267,27 +300,12 @@ class TreePatternMatcher(PatternMatcher):
         """Rejoins all matched characters back to a single token string. If the
         matched token contains newlines or language boxes, the token is split
         into a list of subtokens."""
-        l = []
-        j = 0
-        for i in range(len(self.result)):
-            if self.result[i] is None:
-                if j < i:
-                    l.append("".join(self.result[j:i]))
-                l.append(lbph)
-                j = i+1
-            elif self.result[i] == "\r":
-                if j < i:
-                    l.append("".join(self.result[j:i]))
-                l.append(self.result[i])
-                j = i+1
-        if j < len(self.result):
-            l.append("".join(self.result[j:]))
-
-        if len(l) == 1:
-            self.scanned_chars = len(l[0])
-            return l[0]
-        self.scanned_chars = len(self.result)
-        return l
+        token = join_token(self.result)
+        if type(token) is list:
+            self.scanned_chars = len(self.result)
+        else:
+            self.scanned_chars = len(token)
+        return token
 
     def isend(self):
         if type(self.text) is EOS:
@@ -464,49 +482,47 @@ class LexingError(Exception):
 
 class Lexer(object):
 
+    # Part of the key of cached patterns and DFAs: must be increased whenever
+    # they are pickled differently (see incparser/cache.py)
+    FORMAT = 1
+
     def __init__(self, rules):
-        rp = RegexParser()
-        self.patterns = []
-        for name, rule in rules:
-            pattern = rp.compile(rule)
-            self.patterns.append((pattern, name))
+        # Compiling the regexes requires parsing them with the regex grammar,
+        # so the result is cached on disk
+        rules = list(rules)
+        cache = GrammarCache()
+        key = digest("lexer", Lexer.FORMAT, rules)
+        compiled = cache.load(key)
+        if compiled is None:
+            logging.debug("Compiling lexer")
+            rp = RegexParser()
+            patterns = []
+            for name, rule in rules:
+                pattern = rp.compile(rule)
+                patterns.append((pattern, name))
+            dfa = DFA([pattern for pattern, _ in patterns])
+            compiled = (patterns, dfa)
+            cache.store(key, compiled)
+        self.patterns, self.dfa = compiled
+        self.names = [name for _, name in self.patterns]
 
     def lex(self, text):
-        """Lexes a given string by trying all patterns. When a match is found a
-        token is created, and the lexing continues with the remainder of the
-        string. Lookahead is calculated by observing how far the patternmatcher
-        got before returning 'no match'. If a token was matched by a plus or
-        star rule (e.g. [a-z]+), then the generated token is not an exact match,
-        as it could potentially be longer. This means its lookahead is one
-        character longer (and at least 1), since the pattern matcher had to look
-        ahead one character to decide that the token is complete."""
-        pm = PatternMatcher()
-        self.pos = 0
+        """Lexes a given string by running the DFA of all patterns. Each token
+        is the longest match (the first rule wins ties), after which lexing
+        continues with the remainder of the string. The lookahead of a token is
+        the number of characters the DFA had to examine beyond the end of the
+        token (including the end of the string) before it could decide that the
+        token is complete."""
+        pos = 0
         result = []
-        progress = 0
-        while True:
-            lookahead = 0
-            oldpos = self.pos
-            tmpresult = ("", None, None)
-            for p, n in self.patterns:
-                if pm.match(p, text[self.pos:]):
-                    lookahead = max(pm.la, lookahead)
-                    value = text[self.pos:self.pos + pm.pos]
-                    lookahead = lookahead - len(value)
-                    if len(value) > len(tmpresult[0]):
-                        tmpresult = (value, n, lookahead)
-                        progress = pm.pos
-                    lookahead = 0
-                else:
-                    lookahead = max(pm.la, lookahead)
-            if tmpresult[0]:
-                result.append(tmpresult)
-                self.pos += progress
-            if self.pos == oldpos:
+        while pos < len(text):
+            rule, end, scanned = self.dfa.scan(text, pos)
+            if rule < 0:
                 # no more matches
-                if self.pos < len(text):
-                    result.append((text[self.pos:], None, 0))
+                result.append((text[pos:], None, 0))
                 break
+            result.append((text[pos:end], self.names[rule], scanned - (end - pos)))
+            pos = end
         return result
 
     def treelex(self, node):
@@ -533,14 +549,8 @@ class Lexer(object):
         return result
 
     def get_token_iter(self, node):
-        pm = TreePatternMatcher()
         pos = 0
-        progress = pos, node
         while True:
-            lookahead = 0
-            oldpos = pos
-            oldnode = node
-            result = ("", None, -1, None, 0)
             while type(node.symbol) is IndentationTerminal:
                 node = node.next_term
             if type(node) is MultiTextNode:
@@ -559,25 +569,72 @@ class Lexer(object):
                 else:
                     node = node.next_term
                 continue
-            for p, n in self.patterns:
-                token = pm.match(p, node, pos)
-                lookahead = max(pm.la, lookahead)
-                if token and self.tlen(token) > self.tlen(result[0]): # find longest match
-                    if pm.pos > 0 and pm.pos != len(pm.text.symbol.name):
-                        # Record when a node only produced a partial match
-                        split = pm.pos - len(pm.text.symbol.name)
-                    else:
-                        split = 0
-                    result = (token, n, lookahead - pm.scanned_chars, pm.read_nodes, split)
-                    progress = pm.pos, pm.text
-                    continue
-                else:
-                    pass
-            pos, node = progress
-            if oldnode is node and oldpos == pos:
-                # no progress means we failed to lex something
-                raise LexingError("Failed to lex node '{}' at position {})".format(node, pos))
-            yield result
+            token, node, pos = self.scan_nodes(node, pos)
+            yield token
+
+    def scan_nodes(self, node, pos):
+        """Runs the DFA over the text of consecutive nodes starting at `pos`
+        within `node`. Returns the longest token as a tuple (token, name,
+        lookahead, read_nodes, split), and the node and position after it."""
+        dfa = self.dfa
+        trans = dfa.trans
+        accept = dfa.accept
+        final = dfa.final
+        charcache = dfa.charcache
+        state = dfa.start
+        if node.ismultichild():
+            read_nodes = [node.parent]
+        else:
+            read_nodes = [node]
+        result = []
+        scanned = 0
+        last = None
+        text = node
+        start = pos
+        while not final[state]:
+            scanned += 1
+            if type(text) is EOS:
+                break
+            symtype = type(text.symbol)
+            lbox = symtype is MagicTerminal or symtype is IndentationTerminal
+            if lbox:
+                state = trans[state][dfa.lbox]
+                if state < 0:
+                    break
+                if symtype is MagicTerminal:
+                    result.append(None)
+            else:
+                c = text.symbol.name[pos]
+                col = charcache.get(c)
+                if col is None:
+                    col = dfa.column(c)
+                state = trans[state][col]
+                if state < 0:
+                    break
+                result.append(c)
+                pos += 1
+            if text.ismultichild():
+                parent = text.parent
+                if not any(n is parent for n in read_nodes):
+                    read_nodes.append(parent)
+            elif read_nodes[-1] is not text:
+                read_nodes.append(text)
+            if lbox or pos >= len(text.symbol.name):
+                text = next_node(text)
+                pos = 0
+            if accept[state] >= 0:
+                last = (accept[state], text, pos, len(result), len(read_nodes), scanned)
+        if last is None:
+            # no progress means we failed to lex something
+            raise LexingError("Failed to lex node '{}' at position {})".format(node, start))
+        rule, text, pos, length, nodes, _ = last
+        if pos > 0 and pos != len(text.symbol.name):
+            # Record when a node only produced a partial match
+            split = pos - len(text.symbol.name)
+        else:
+            split = 0
+        token = join_token(result[:length])
+        return (token, self.names[rule], scanned - length, read_nodes[:nodes], split), text, pos
 
     def tlen(self, token):
         if type(token) is list:
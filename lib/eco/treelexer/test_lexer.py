@@ -1,4 +1,5 @@
 from .lexer import Lexer, PatternMatcher, RegexParser, LexingError, RE_CHAR, RE_OR, RE_STAR, RE_PLUS, lbph
+from .dfa import DFA
 import pytest
 
 class Test_RegexParser(object):
@@ -300,10 +301,10 @@ class Test_Lexer(object):
         assert l.lex("abcx") == [("abcx", "test", 0)]
 
         l = Lexer([("test", "abcde|abc")])
-        assert l.lex("abcx") == [("abc", "test", 0), ("x", None, 0)]
+        assert l.lex("abcx") == [("abc", "test", 1), ("x", None, 0)]
 
         l = Lexer([("test", "abc|abcde")])
-        assert l.lex("abcx") == [("abc", "test", 0), ("x", None, 0)]
+        assert l.lex("abcx") == [("abc", "test", 1), ("x", None, 0)]
 
     def test_nodes(self):
         root = TextNode(Nonterminal("Root"))
@@ -525,7 +526,8 @@ class Test_LuaComments(object):
         new = TextNode(Terminal('--[[testtest]]'))
         ast.parent.children[0].insert_after(new)
         it = self.lexer.get_token_iter(new)
-        assert next(it) == ('--[[testtest]]', "mcomment", 0, [TextNode(Terminal('--[[testtest]]'))], 0)
+        # scomment could still produce a longer token
+        assert next(it) == ('--[[testtest]]', "mcomment", 1, [TextNode(Terminal('--[[testtest]]'))], 0)
 
     def test_lookahead(self):
         ast = AST()
@@ -542,3 +544,46 @@ class Test_LuaComments(object):
         ast.parent.children[0].insert_after(new)
         it = self.lexer.get_token_iter(new)
         assert next(it) == (['--[[test', '\r', 'test]]'], "mcomment", 0, [TextNode(Terminal('--[[test\rtest]]'))], 0)
+
+class Test_DFA(object):
+
+    def setup_class(cls):
+        cls.rp = RegexParser()
+
+    def dfa(self, *patterns):
+        return DFA([self.rp.compile(p) for p in patterns])
+
+    def test_longest_match(self):
+        dfa = self.dfa("as", "[a-z]+")
+        assert dfa.scan("as", 0) == (0, 2, 3)
+        assert dfa.scan("asd", 0) == (1, 3, 4)
+        assert dfa.scan("as d", 0) == (0, 2, 3)
+        assert dfa.scan("123", 0) == (-1, 0, 1)
+
+    def test_minimized(self):
+        assert len(self.dfa("a|b")) == 2
+        assert len(self.dfa("(a|b)*c", "(b|a)*d")) == 3
+        assert len(self.dfa("[a-z]+", "[a-z]*")) == 2
+
+    def test_nongreedy(self):
+        dfa = self.dfa(r"/\*.*?\*/")
+        assert dfa.scan("/* a */ b */", 0) == (0, 7, 7)
+        # trailing non-greedy repetitions are greedy
+        dfa = self.dfa("a.*?")
+        assert dfa.scan("abc", 0) == (0, 3, 4)
+        # only the branch containing the non-greedy repetition is affected
+        dfa = self.dfa(r"//[^\r]*|/\*.*?\*/")
+        assert dfa.scan("//a*/b\rc", 0) == (0, 6, 7)
+        assert dfa.scan("/*a*/b*/", 0) == (0, 5, 5)
+
+    def test_lbox(self):
+        dfa = self.dfa("'[^']*'", "a.b", "[a-z]")
+        assert dfa.trans[dfa.start][dfa.lbox] == -1
+        state = dfa.trans[dfa.start][dfa.column("'")]
+        assert dfa.trans[state][dfa.lbox] == state
+        state = dfa.trans[dfa.start][dfa.column("a")]
+        assert dfa.trans[state][dfa.lbox] >= 0
+
+    def test_unicode(self):
+        dfa = self.dfa("[^a]+")
+        assert dfa.scan(u"ä☃x", 0) == (0, 3, 4)
@@ -36,10 +36,17 @@ except ImportError:
     from utils import arrow_keys, KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT
 from grammars.grammars import lang_dict, Language, EcoFile
 from indentmanager import IndentationManager
+from lineindex import Line, LineIndex, compact_dict
+from textindex import TextIndex
 from export import HTMLPythonSQL, PHPPython, ATerms
 from export.cpython import CPythonExporter
 
-import math, os
+import math, os, time
+import config
+
+# Languages whose terminals may be shown as images (see renderers.py). Columns
+# of lines containing images can't be counted in characters.
+IMAGE_LANGUAGES = ("Chemicals", "Image")
 
 def debug_trace():
   '''Set a tracepoint in the Python debugger that works with Qt'''
@@ -64,22 +71,6 @@ class NodeSize(object):
         self.w = w
         self.h = h
 
-class Line(object):
-    """Representation of a source code line.
-
-    Has a reference to the node at the beginning of that line and stores the
-    lines width and height values.
-    """
-    def __init__(self, node, height=1):
-        self.node = node        # this lines newline node
-        self.height = height    # line height
-        self.width = 0          # line width
-        self.indent = 0         # line indentation
-        self.ws = 0
-
-    def __repr__(self):
-        return "Line(%s, width=%s, height=%s)" % (self.node, self.width, self.height)
-
 class Cursor(object):
     """Represents the text cursor in the sourcecode view.
 
@@ -87,11 +78,12 @@ class Cursor(object):
     node and the current line number. Can be manipulated by the user through key
     presses."""
 
-    def __init__(self, node, pos, line, lines):
+    def __init__(self, node, pos, line, lines, text=None):
         self.node = node
         self.pos = pos
         self.line = line
         self.lines = lines
+        self.text = text
         self.last_x = 0
         self.log = {}
 
@@ -108,7 +100,7 @@ class Cursor(object):
                 del self.log[key]
 
     def copy(self):
-        return Cursor(self.node, self.pos, self.line, self.lines)
+        return Cursor(self.node, self.pos, self.line, self.lines, self.text)
 
     def store_last_x(self):
         self.last_x = self.get_x()
@@ -312,6 +304,11 @@ class Cursor(object):
     def move_to_x(self, x):
         """Jump to the x-th character/column position in the current line."""
         node = self.lines[self.line].node
+        if x > 0 and self.text is not None:
+            found = self.text.find_column(node, x)
+            if found is not None:
+                self.node, self.pos = found
+                return
         while x > 0:
             newnode = self.find_next_visible(node)
             if newnode is node:
@@ -351,6 +348,10 @@ class Cursor(object):
             if not self.node.get_root().get_magicterminal():
                 return 0
 
+        if self.text is not None:
+            x = self.text.column(self.node)
+            if x is not None:
+                return x + self.pos
         if self.node.image and not self.node.plain_mode:
             x = self.get_nodesize_in_chars(self.node).w
         else:
@@ -381,11 +382,7 @@ class Cursor(object):
             self.pos = len(self.node.symbol.name)
 
     def get_line_from_node(self, node):
-        i = 0
-        for l in self.lines:
-            if l.node is node:
-                return i
-            i += 1
+        return self.lines.find(node)
 
     def get_nodesize_in_chars(self, node):
         """Calculate the size in characters of a non-textual node."""
@@ -433,8 +430,12 @@ class Cursor(object):
 class TreeManager(object):
     version = 1
 
+    # Called with the ParseStats of every reparse if set (see eco.py --stats)
+    report_stats = None
+
     def __init__(self):
-        self.lines = []             # storage for line objects
+        self.lines = LineIndex()    # storage for line objects
+        self.text = TextIndex(self.get_roots) # offsets and columns of nodes
         self.mainroot = None        # root node (main language)
         self.parsers = []           # stores all currently used parsers
         self.edit_rightnode = False # changes which node to select when inbetween two nodes
@@ -443,11 +444,12 @@ class TreeManager(object):
         self.version = self.global_version = 1
         self.reference_version = 0
         TreeManager.version = 1
+        self.revision = 0           # changed whenever versions are recovered or discarded
         self.last_saved_version = 1
         self.savenextparse = False
-        self.saved_lines = {}
         self.saved_parsers = {}
         self.undo_snapshots = []
+        self.undo_limit = config.UNDO_LIMIT
         self.min_version = 1
 
         self.tool_data_is_dirty = False
@@ -456,6 +458,14 @@ class TreeManager(object):
         self.option_autolbox_insert = False
 
         self.skipautolbox = False
+        self.parse_stats = None     # ParseStats of the last reparse
+        self.deferred_reparse = None # roots to reparse later (see defer_reparse)
+        # parser -> version it was parsed in, for language boxes that were
+        # loaded without being parsed (see load_file)
+        self.unparsed = {}
+        # Terminals saved or recovered since the last call of `take_damage`.
+        # None if those can't be known.
+        self.damage = None
 
         # This code and the can_profile() method should probably be refactored.
         self.langs_with_profiler = {
@@ -503,6 +513,11 @@ class TreeManager(object):
     def get_eos(self):
         return self.parsers[0][0].previous_version.parent.children[-1]
 
+    def get_roots(self):
+        """Return the roots of all language boxes, starting with the root of
+        the main language."""
+        return [p[0].previous_version.parent for p in self.parsers]
+
     def get_mainparser(self):
         """Return the parser of the root language."""
         return self.parsers[0][0]
@@ -532,7 +547,7 @@ class TreeManager(object):
             if parser.previous_version.parent is root:
                 return im
 
-    def add_parser(self, parser, lexer, language):
+    def add_parser(self, parser, lexer, language, parse=True):
         analyser = self.load_analyser(language)
         if lexer.is_indentation_based():
             im = IndentationManager(parser.previous_version.parent)
@@ -541,11 +556,15 @@ class TreeManager(object):
             im = None
         self.parsers.append((parser, lexer, language, analyser, im))
         parser.reference_version = 0
-        parser.inc_parse()
+        if language in IMAGE_LANGUAGES or getattr(lang_dict.get(language), "base", None) in IMAGE_LANGUAGES:
+            self.text.images = True
+        if parse:
+            parser.inc_parse()
         if len(self.parsers) == 1:
             self.lines.append(Line(parser.previous_version.parent.children[0]))
             self.mainroot = parser.previous_version.parent
-            self.cursor = Cursor(self.mainroot.children[0], 0, 0, self.lines)
+            self.text.invalidate()
+            self.cursor = Cursor(self.mainroot.children[0], 0, 0, self.lines, self.text)
             self.selection_start = self.cursor.copy()
             self.selection_end = self.cursor.copy()
             lboxnode = self.create_node("<%s>" % language, lbox=True)
@@ -627,25 +646,39 @@ class TreeManager(object):
                           return "'%s' was changed to '%s'" % (pres, node.symbol.name)
         return None
 
-    def analyse(self):
+    def get_analyses(self, parsers=None):
+        """Returns the analyses that `analyse` runs as (analyser, parser,
+        parsers) tuples, where `parsers` are passed on to the analyser if it
+        also analyses language boxes. Returns None if the main language has
+        no analyser. `parsers` default to the tree manager's own. Language
+        boxes that haven't been parsed yet (see `load_file`) are parsed if the
+        analyser reaches them and skipped otherwise."""
+        if parsers is None:
+            parsers = self.parsers
         # for now only do cross-scope analysing for certain grammars
         crossscope = ["PHP + Python", "Java + Python"]
-        lang = self.parsers[0][2]
-        parser = self.parsers[0][0]
-        analyser = self.parsers[0][3]
+        lang = parsers[0][2]
+        parser = parsers[0][0]
+        analyser = parsers[0][3]
 
         if not analyser:
-            return False
+            return None
 
         if lang in crossscope:
-            analyser.analyse(parser.previous_version.parent, self.parsers)
-            return
+            # the analyser follows references into all language boxes
+            self.parse_boxes()
+            return [(analyser, parser, parsers)]
 
         # analyse all parsers individually
-        for p in self.parsers:
-            if p[0].last_status:
-                if p[3]:
-                    p[3].analyse(p[0].previous_version.parent)
+        return [(p[3], p[0], None) for p in parsers
+                if p[0].last_status and p[3] and not self.is_unparsed(p[0])]
+
+    def analyse(self):
+        analyses = self.get_analyses()
+        if analyses is None:
+            return False
+        for analyser, parser, parsers in analyses:
+            analyser.analyse(parser.previous_version.parent, parsers, parser.take_changes())
 
     def getCompletion(self):
         for p in self.parsers:
@@ -821,14 +854,34 @@ class TreeManager(object):
             self.selection_end = self.cursor.copy()
         self.last_search = text
 
+    def get_offset(self, node):
+        """Returns the character offset of `node` in the text of the document,
+        which includes the text of language boxes, or None if `node` isn't
+        part of the document. Takes O(log n) (see textindex.py)."""
+        return self.text.offset(node)
+
+    def get_node_at_offset(self, offset):
+        """Returns the node left of character `offset` in the text of the
+        document and the position within that node, as used by the cursor.
+        Takes O(log n) (see textindex.py)."""
+        return self.text.node_at(offset)
+
+    def get_node_at(self, line, column):
+        """Returns the node at `column` in `line` and the position within that
+        node, as used by the cursor. Columns count the characters of the text,
+        including the text of language boxes. Columns past the end of the line
+        map to its end. Takes O(log n) (see textindex.py)."""
+        cursor = self.cursor.copy()
+        cursor.line = line
+        cursor.move_to_x(column)
+        return cursor.node, cursor.pos
+
     def jump_to_error(self, parser):
-        bos = parser.previous_version.parent.children[0]
-        eos = parser.previous_version.parent.children[-1]
-        node = bos
-        while node is not eos:
-            if node is parser.error_nodes[0]:
-                break
-            node = node.next_term
+        root = parser.previous_version.parent
+        eos = root.children[-1]
+        node = parser.error_nodes[0]
+        if node.deleted or node.get_root() is not root:
+            node = eos
 
         # get linenode
         linenode = node
@@ -843,12 +896,10 @@ class TreeManager(object):
 
         # get line number
         linenr = 0
-        for line in self.lines:
-            if linenode is None:
-                break
-            if line.node is linenode:
-                break
-            linenr += 1
+        if linenode is not None:
+            linenr = self.lines.find(linenode)
+            if linenr is None:
+                linenr = len(self.lines)
 
         self.cursor.line = linenr
         self.cursor.node = node
@@ -877,17 +928,19 @@ class TreeManager(object):
             undo_amount = self.undo_snapshots[i+1] - self.undo_snapshots[i]
         except ValueError:
             undo_amount = self.undo_snapshots[0] - self.version
-        for u in range(undo_amount):
-            self.version += 1
-            self.recover_version("redo", self.version - 1)
-            self.cursor.load(self.version, self.lines)
+        if undo_amount <= 0:
+            return
+        # Jump to the target version directly. Nodes that changed between the
+        # two versions also changed their parents, so recover_version only
+        # visits nodes that actually differ.
+        _from = self.version
+        self.version += undo_amount
+        self.recover_version("redo", _from)
+        self.cursor.load(self.version, self.lines)
 
     def get_max_version(self):
         root = self.get_bos().parent
-        maxversion = 0
-        for (key, version) in list(root.log.keys()):
-            maxversion = max(maxversion, version)
-        return maxversion
+        return root.log.latest() or 0
 
     def key_ctrl_z(self):
         self.log_input("key_ctrl_z")
@@ -907,51 +960,76 @@ class TreeManager(object):
             undo_amount = self.version - 1
         else:
             undo_amount = self.undo_snapshots[i] - self.undo_snapshots[i-1]
-        for u in range(undo_amount):
-            self.version -= 1
-            self.recover_version("undo", self.version + 1)
-            self.cursor.load(self.version, self.lines)
+        undo_amount = min(undo_amount, self.version - self.min_version)
+        if undo_amount <= 0:
+            return
+        _from = self.version
+        self.version -= undo_amount
+        self.recover_version("undo", _from)
+        self.cursor.load(self.version, self.lines)
 
     def recover_version(self, direction, _from):
+        self.revision += 1
         self.load_lines()
         self.load_parsers()
         for l in self.parsers:
             parser = l[0]
             parser.load_status(self.version)
             root = parser.previous_version.parent
+            # collect the recovered nodes, so the indentation manager only
+            # needs to repair their lines and the editor only repaints them
+            loaded = []
             if direction == "undo":
-                self.undo(root)
+                self.undo(root, loaded)
             elif direction == "redo":
-                self.redo(root, _from)
-
-    def undo(self, node):
+                self.redo(root, _from, loaded)
+            if l[4]:
+                l[4].invalidate(loaded, self.lines)
+            if self.damage is not None:
+                self.damage.extend(loaded)
+            for node in loaded:
+                self.text.changed(node)
+
+    def undo(self, node, loaded=None, visited=None):
+        if visited is None:
+            visited = set()
+        if node in visited:
+            # Nodes created after the version we jump to can't be loaded and
+            # keep their version, so they would be descended into again from
+            # every parent that still has them, doubling the work per level
+            return
+        visited.add(node)
         if not node.log:
             # Node was never integrated during parsing and thus hasn't been
             # saved. Continue with its children. This could be also solved by
             # having nodes version themselves as soon as their attributes
             # changes. Requires rethinking the versioning system.
             for c in node.children:
-                self.undo(c)
+                self.undo(c, loaded, visited)
             return
         if node.version <= self.version and not node.has_unsaved_changes():
             # node is already at this or an even earlier version and has no
             # unsaved changes
             return
         for c in node.children:
-            self.undo(c)
+            self.undo(c, loaded, visited)
         if not node.is_new(node.version):
             if node.autobox and len(node.autobox) == 1:
                 # block this node for autolboxes in the future
                 node.autobox = False
             node.load(self.version)
+            if loaded is not None:
+                loaded.append(node)
             for c in node.children:
-                self.undo(c)
+                self.undo(c, loaded, visited)
 
-    def redo(self, node, _from):
+    def redo(self, node, _from, loaded=None):
         node.load(self.version)
         if node.version > _from:
+            if loaded is not None:
+                loaded.append(node)
             for c in node.children:
-                self.redo(c, _from)
+                self.redo(c, _from, loaded)
 
     def pop_lookahead(self, la):
         while(la.right_sibling() is None):
@@ -960,9 +1038,7 @@ class TreeManager(object):
 
     def clean_versions(self, version):
         # clean linenumbers
-        for key in list(self.saved_lines.keys()):
-            if key > version:
-                del self.saved_lines[key]
+        self.lines.truncate(version)
         for key in list(self.saved_parsers.keys()):
             if key > version:
                 del self.saved_parsers[key]
@@ -990,46 +1066,41 @@ class TreeManager(object):
                     node = self.pop_lookahead(node)
 
     def delete_versions_from(self, node, version):
-        for (key, v) in list(node.log.keys()):
-            if v > version:
-                del node.log[(key, v)]
+        node.log.truncate(version)
 
-    def save_lines(self):
-        # check if lines have changed
-        lines = self.get_lines_from_version(self.version)
-        if len(lines) != len(self.lines):
-            self.saved_lines[self.version] = list(self.lines)
+    def compact_history(self):
+        """Discards versions that can no longer be reached by undo, keeping
+        at most `undo_limit` undo snapshots. Only the state of each node at
+        the oldest remaining snapshot is kept."""
+        if self.undo_limit is None or len(self.undo_snapshots) <= self.undo_limit:
+            return
+        cutoff = self.undo_snapshots[-self.undo_limit]
+        # error recovery may still look at the last valid version
+        cutoff = min(cutoff, self.reference_version, self.version)
+        if cutoff <= self.min_version:
             return
+        self.undo_snapshots = [v for v in self.undo_snapshots if v >= cutoff]
+        self.min_version = cutoff
+        self.revision += 1
 
-        # check if nodes are different (e.g. we could delete and reinsert a line between saves)
-        for i in range(len(lines)):
-            if lines[i] is not self.lines[i]:
-                self.saved_lines[self.version] = list(self.lines)
-                return
+        self.lines.compact(cutoff)
+        compact_dict(self.saved_parsers, cutoff)
+        compact_dict(self.cursor.log, cutoff)
+        for l in self.parsers:
+            parser = l[0]
+            compact_dict(parser.status_by_version, cutoff)
+            compact_dict(parser.errornodes_by_version, cutoff)
+            todo = [parser.previous_version.parent]
+            while todo:
+                node = todo.pop()
+                node.log.compact(cutoff)
+                todo.extend(node.children)
 
-    def get_lines_from_version(self, version):
-        version = self.version
-        while True:
-            if version == -1:
-                return []
-            try:
-                l = self.saved_lines[version]
-                break
-            except KeyError:
-                version -= 1
-        return l
+    def save_lines(self):
+        self.lines.save(self.version)
 
     def load_lines(self):
-        version = self.version
-        while True:
-            if version == 0:
-                return
-            try:
-                l = self.saved_lines[version]
-                break
-            except KeyError:
-                version -= 1
-        self.lines = list(l) # copy, otherwise saved list will be mutated
+        self.lines.load(self.version)
 
     def save_parsers(self):
         self.saved_parsers[self.version] = list(self.parsers)
@@ -1043,15 +1114,17 @@ class TreeManager(object):
         self.save_parsers()
         self.cursor.save(self.version)
         for l in self.parsers:
-            parser = l[0]
-            parser.save_status(self.version)
-            root = parser.previous_version.parent
-            root.save(self.version)
-            bos = root.children[0]
-            bos.save(self.version)
-            eos = root.children[-1]
-            eos.save(self.version)
-            self.save_and_textlen_rec(root, postparse)
+            self.save_parser(l[0], postparse)
+
+    def save_parser(self, parser, postparse=False):
+        parser.save_status(self.version)
+        root = parser.previous_version.parent
+        root.save(self.version)
+        bos = root.children[0]
+        bos.save(self.version)
+        eos = root.children[-1]
+        eos.save(self.version)
+        self.save_and_textlen_rec(root, postparse)
 
     def save_and_textlen_rec(self, node, postparse):
         if node.has_changes() or node.new:
@@ -1062,6 +1135,10 @@ class TreeManager(object):
                 self.save_and_textlen_rec(c, postparse)
             node.calc_textlength()
             node.save(self.version)
+            if self.damage is not None and not node.children:
+                self.damage.append(node)
+            if not isinstance(node.symbol, Nonterminal):
+                self.text.changed(node)
             # Make sure that all nodes are always marked as non-existent before
             # a new parse. This way only parsed subtrees are marked as exists,
             # and we avoid retaining not yet parsed subtrees. However, not yet
@@ -1257,7 +1334,7 @@ class TreeManager(object):
             node.plain_mode = False
 
     def key_cursors(self, key, shift=False):
-        self.log_input("key_cursors", arrow_keys[key.key], str(shift))
+        self.log_input("key_cursors", "KEY_" + arrow_keys[key.key].upper(), str(shift))
         self.edit_rightnode = False
 
         # Four possible cases:
@@ -1312,7 +1389,7 @@ class TreeManager(object):
             self.cursor_movement(key)
 
     def ctrl_cursor(self, key, shift=False):
-        self.log_input("key_escape", arrow_keys[key.key])
+        self.log_input("ctrl_cursor", "KEY_" + arrow_keys[key.key].upper(), str(shift))
 
         if shift and not self.hasSelection():
             self.start_new_selection()
@@ -1335,7 +1412,7 @@ class TreeManager(object):
         self.cursor.node = self.selection_end.node
 
     def select_all(self):
-        self.selection_start = Cursor(self.get_bos(), -1, 0, self.lines)
+        self.selection_start = Cursor(self.get_bos(), -1, 0, self.lines, self.text)
         self.cursor.node = self.get_eos()
         self.cursor.jump_left() # for now ignore invisible nodes
         self.cursor.pos = len(self.cursor.node.symbol.name)
@@ -1389,6 +1466,7 @@ class TreeManager(object):
             text1 = node.symbol.name[:internal_position]
             text2 = node.symbol.name[internal_position:]
             node.symbol.name = text1
+            node.mark_changed()
             node.insert_after(newnode)
 
             node2 = TextNode(Terminal(text2))
@@ -1580,9 +1658,9 @@ class TreeManager(object):
             n.remove()
             n = n.next_term
 
-        for i in reversed(list(range(len(self.lines)))):
-            if self.lines[i].node.deleted:
-                del self.lines[i]
+        deleted = [i for i, line in enumerate(self.lines) if line.node.deleted]
+        for i in reversed(deleted):
+            del self.lines[i]
 
         self.skipautolbox = True
         self.reparse(lbox.symbol.ast.children[0], True)
@@ -1693,6 +1771,7 @@ class TreeManager(object):
         node = self.cursor.node
         if text.startswith(node.symbol.name):
             node.symbol.name = text
+            node.mark_changed()
             self.cursor.pos = len(text)
         else:
             self.pasteText(text)
@@ -1767,10 +1846,13 @@ class TreeManager(object):
             s = nodes[0].symbol.name
             s = s[:diff_start] + s[diff_end:]
             nodes[0].symbol.name = s
+            nodes[0].mark_changed()
             self.delete_if_empty(nodes[0])
         else:
             nodes[0].symbol.name = nodes[0].symbol.name[:diff_start]
             nodes[-1].symbol.name = nodes[-1].symbol.name[diff_end:]
+            nodes[0].mark_changed()
+            nodes[-1].mark_changed()
             self.delete_if_empty(nodes[0])
             self.delete_if_empty(nodes[-1])
         for node in nodes[1:-1]:
@@ -1890,6 +1972,8 @@ class TreeManager(object):
     def import_file(self, text):
         self.log_input("import_file", repr(text))
         self.version = self.global_version = 0
+        self.revision += 1
+        self.text.invalidate()
         text = text.replace("\r\n","\r")
         text = text.replace("\n","\r")
         text = text.replace("\t","    ")
@@ -1927,14 +2011,17 @@ class TreeManager(object):
         def x():
             return bos
         self.get_bos = x
-        self.lines.append(X())
-        self.lines[0].node = bos
+        self.lines.append(Line(bos))
         return self.export(path, source=source)
 
-    def load_file(self, language_boxes, reparse=True):
+    def load_file(self, language_boxes, reparse=True, defer=False):
+        """Sets up the parsers for the loaded `language_boxes` and parses
+        them. If `defer` is set, only the main language is parsed straight
+        away, and language boxes are parsed once they are needed (see
+        `parse_box`)."""
         # setup language boxes
         TreeManager.version = 0
-        for root, language, whitespaces in language_boxes:
+        for i, (root, language, whitespaces) in enumerate(language_boxes):
             grammar = lang_dict[language]
             incparser, inclexer = self.get_parser_lexer_for_language(grammar, whitespaces)
             incparser.setup_autolbox(grammar.name, inclexer)
@@ -1946,12 +2033,24 @@ class TreeManager(object):
             except:
                 pass # first language doesn't have parent
 
-            self.add_parser(incparser, inclexer, grammar.name)
+            if defer and i > 0:
+                # until it is parsed the box keeps the status it was saved
+                # with: a successful parse leaves a single start rule
+                children = root.children
+                incparser.last_status = len(children) == 3 and not children[1].has_errors()
+                incparser.error_nodes = []
+                incparser.error_pres = []
+                self.unparsed[incparser] = None
+                self.add_parser(incparser, inclexer, grammar.name, parse=False)
+            else:
+                self.add_parser(incparser, inclexer, grammar.name)
 
         self.rescan_linebreaks(0)
 
         self.savenextparse = True
         self.version = self.global_version = 1
+        self.revision += 1
+        self.text.invalidate()
         self.last_saved_version = 1
         self.reference_version = 1
         self.full_reparse() # needed to recreate AST nodes
@@ -1973,6 +2072,7 @@ class TreeManager(object):
             return
 
     def export(self, path=None, run=False, profile=False, source=None, debug=False):
+        self.parse_boxes()
         for p, _, _, _, _ in self.parsers:
             if p.last_status == False:
                 print("Cannot export a syntactically incorrect grammar")
@@ -2133,10 +2233,36 @@ class TreeManager(object):
         lexer = self.get_lexer(root)
         return lexer.relex(node)
 
+    def defer_reparse(self):
+        """Collects reparses instead of running them until `flush_reparse`
+        is called, e.g. to replay a batch of edits with a single reparse."""
+        if self.deferred_reparse is None:
+            self.deferred_reparse = {}
+
+    def flush_reparse(self):
+        """Runs the reparses collected since `defer_reparse`."""
+        deferred = self.deferred_reparse
+        self.deferred_reparse = None
+        if deferred:
+            # Save the cursor position of the last edit with the new version
+            # (as the edit's own reparse would have), not the current one
+            cursor = self.cursor
+            current = (cursor.node, cursor.pos, cursor.line)
+            cursor.node, cursor.pos, cursor.line = self.deferred_cursor
+            for root, changed in deferred.items():
+                self.reparse(root, changed)
+            cursor.node, cursor.pos, cursor.line = current
+
     def reparse(self, node, changed=True, skipautolbox=False):
+        if self.deferred_reparse is not None:
+            root = node.get_root()
+            self.deferred_reparse[root] = self.deferred_reparse.get(root, False) or changed
+            self.deferred_cursor = (self.cursor.node, self.cursor.pos, self.cursor.line)
+            return
         if self.version < self.global_version:
             # we changed stuff after one or more undos
             # later versions are void -> delete
+            self.revision += 1
             for l in self.parsers:
                 root = l[0].previous_version.parent
                 for v in reversed(list(range(self.version+1, self.global_version+1))):
@@ -2145,20 +2271,37 @@ class TreeManager(object):
                         self.undo_snapshots.remove(v)
                     except ValueError:
                         pass
+            for p, version in self.unparsed.items():
+                if version is not None and version > self.version:
+                    self.unparsed[p] = None
             self.global_version = self.version
         if changed:
+            start = time.perf_counter()
             self.save_current_version() # save current changes
+            save = time.perf_counter() - start
             root = node.get_root()
             parser = self.get_parser(root)
             self.previous_version = self.version
             parser.prev_version = self.version
             parser.reference_version = self.reference_version
             parser.option_autolbox_find = self.option_autolbox_find
-            parser.inc_parse()
+            if self.is_unparsed(parser):
+                parser.reparse()
+                self.unparsed[parser] = self.version
+            else:
+                parser.inc_parse()
+            stats = parser.stats
+            start = time.perf_counter()
             parser.top_down_reuse()
+            stats.times["reuse"] += time.perf_counter() - start
+            start = time.perf_counter()
             self.save_current_version(postparse=True) # save post parse tree
+            stats.times["save"] += save + time.perf_counter() - start
             if parser.last_status == True:
                 self.reference_version = self.version
+            self.parse_stats = stats
+            if TreeManager.report_stats:
+                TreeManager.report_stats(stats)
         else:
             # save changes without reparse (e.g. when a value has changed but
             # the type remains the same)
@@ -2282,8 +2425,8 @@ class TreeManager(object):
         return result
 
     def delete_version(self, version, node):
-        if ("parent", version) in node.log:
-            children = node.log["children", version]
+        if node.log.has_version(version):
+            children = node.log.get("children", version)
             node.delete_version(version)
             for c in children:
                 self.delete_version(version, c)
@@ -2294,6 +2437,29 @@ class TreeManager(object):
             # undo_snapshot is called without any changes)
             return
         self.undo_snapshots.append(self.version)
+        if self.undo_limit is not None and \
+                len(self.undo_snapshots) > self.undo_limit + self.undo_limit // 10:
+            # compact in batches so the cost of traversing the tree is spread
+            # over many snapshots
+            self.compact_history()
+
+    def take_damage(self):
+        """Returns the terminals that have been saved or recovered by undo and
+        redo since the last call, or None if they are unknown. Changes are
+        only tracked after this has been called once."""
+        damage = self.damage
+        self.damage = []
+        return damage
+
+    def snapshot(self):
+        """Returns an id for the current state of the tree. As long as
+        `is_current` returns True for it, the tree hasn't changed and its
+        version (the first element) can still be read from the history of
+        its nodes (see `Node.saved_state`)."""
+        return self.version, self.revision
+
+    def is_current(self, snapshot):
+        return snapshot == (self.version, self.revision)
 
     def save_current_version(self, postparse=False):
         self.log_input("save_current_version")
@@ -2304,22 +2470,59 @@ class TreeManager(object):
 
     def full_reparse(self):
         for p in self.parsers:
+            if self.is_unparsed(p[0]):
+                continue
             p[0].prev_version = self.version
             p[0].reference_version = self.reference_version
             p[0].reparse()
 
+    def is_unparsed(self, parser):
+        """Returns True if the language box of `parser` was loaded without
+        being parsed and isn't parsed in the current version."""
+        if parser not in self.unparsed:
+            return False
+        version = self.unparsed[parser]
+        return version is None or self.version < version
+
+    def parse_box(self, root):
+        """Parses the language box `root` if it was loaded without being
+        parsed. As the text doesn't change, the parse is saved in the current
+        version. Returns True if the box was parsed."""
+        parser = self.get_parser(root)
+        if parser is None or not self.is_unparsed(parser):
+            return False
+        self.revision += 1
+        parser.prev_version = self.version
+        parser.reference_version = self.reference_version
+        parser.reparse()
+        self.save_parser(parser, True)
+        self.unparsed[parser] = self.version
+        return True
+
+    def parse_boxes(self):
+        """Parses all language boxes that were loaded without being parsed."""
+        for p in self.parsers:
+            if self.is_unparsed(p[0]):
+                self.parse_box(p[0].previous_version.parent)
+
     def apply_inputlog(self, inputlog):
-        for l in inputlog.split("\n"):
-            l = l.replace("\r", "\\r")
-            if l.startswith("#"):
-                continue
-            try:
-                eval(l) # expressions
-            except SyntaxError:
-                exec(l) # statements
+        for _, code in compile_inputlog(inputlog):
+            exec(code)
 
     def get_langdef_from_string(self, lang):
         return lang_dict[lang]
 
+def compile_inputlog(inputlog):
+    """Compiles the lines of an input log (see `TreeManager.log_input`).
+    Returns a list of (line, code) tuples. The code expects the TreeManager to
+    be replayed on in the local variable `self`."""
+    result = []
+    for l in inputlog.split("\n"):
+        l = l.replace("\r", "\\r")
+        if l.startswith("#") or not l.strip():
+            continue
+        result.append((l, compile(l, "<inputlog>", "exec")))
+    return result
+
 class ExecutionError(Exception):
   pass